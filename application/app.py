@@ -1,8 +1,14 @@
+import asyncio
 import logging
 import json
+import time
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, Depends, Request, Query
+from fastapi.responses import Response, StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, Field, constr
 from typing import List, Dict, Tuple, Optional
 from .models import (
@@ -12,7 +18,9 @@ from .models import (
     AlternativeVote,
     AuthorizationToken,
     ElectionWinner,
+    EmailDelivery,
     SessionLocal,
+    engine,
 )
 from .utils import (
     generate_otp,
@@ -20,20 +28,92 @@ from .utils import (
     send_email,
     handle_otp_storage_and_notification,
 )
+from .bulk import insert_candidates, insert_voter_tokens
+from .mailer import get_dispatcher, stop_dispatcher
+from .finalizer import (
+    FINALIZER_ENABLED,
+    finalize_election,
+    get_finalizer,
+    schedule_finalization,
+    stop_finalizer,
+)
+from .ballots import MAX_BALLOT_VALUE, encode_ballot
+from .engines import (
+    BALLOT_KINDS,
+    Ballots,
+    TallyResult,
+    compare,
+    tally_ballots,
+    tally_election,
+)
+from .migrations import upgrade
+from .cache import ballot_versions, election_info, result_cache, token_index
+from .async_db import ASYNC_DB, get_async_db
+from .profiling import (
+    PROFILING,
+    ProfilingMiddleware,
+    profiled,
+    profiles_router,
+    route_class,
+)
+from .metrics import (
+    CONTENT_TYPE,
+    REGISTRY,
+    http_requests,
+    http_request_duration,
+    instrument_engine,
+    votes_accepted,
+    votes_rejected,
+)
+from .ingest import (
+    GROUP_COMMIT,
+    IMPORT_CHUNK_SIZE,
+    ElectionClosed,
+    PendingVote,
+    get_vote_writer,
+    parse_ballot_line,
+    read_lines,
+    stop_vote_writer,
+    write_votes,
+)
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import func
 from datetime import datetime, timezone
 from .vote_calculation import (
-    calculate_traditional_votes,
-    calculate_ranked_choice_votes,
-    calculate_score_votes,
-    calculate_quadratic_votes,
+    first_preference,
+    validate_score_ballot,
+    validate_quadratic_ballot,
+    live_results,
+    live_tally,
+    score_averages,
 )
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Bring existing databases up to the current schema
+upgrade(engine)
+instrument_engine(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Close elections in the background as their end times pass
+    if FINALIZER_ENABLED:
+        get_finalizer()
+    # Resume sending OTP emails left queued by the previous run
+    if SEND_EMAILS:
+        get_dispatcher()
+    yield
+    # Flush buffered ballots and let queued OTP emails drain before exiting
+    stop_vote_writer()
+    stop_finalizer()
+    stop_dispatcher()
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = route_class
 
 # Add CORS middleware
 app.add_middleware(
@@ -44,15 +124,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Requests carrying the admin X-Profile header are profiled, see profiling.py
+if PROFILING:
+    app.add_middleware(ProfilingMiddleware)
+
 
 @app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url}")
+async def observe_requests(request: Request, call_next):
+    started = time.perf_counter()
     response = await call_next(request)
-    logger.info(f"Response: {response.status_code}")
+    elapsed = time.perf_counter() - started
+    # Label by route template, not the raw path, to keep one series per endpoint
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    http_requests.labels(request.method, path, response.status_code).inc()
+    http_request_duration.labels(request.method, path).observe(elapsed)
     return response
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
 # Dependency to get the DB session
 def get_db():
     db = SessionLocal()
@@ -84,6 +178,8 @@ class CandidateResponse(BaseModel):
     id: int | None = None
     name: str | None = None
     votes: float
+    # Average score per ballot, for score voting
+    average: float | None = None
 
 
 class ElectionCreate(BaseModel):
@@ -94,6 +190,7 @@ class ElectionCreate(BaseModel):
     end_time: datetime
     candidates: List[CandidateCreate]
     voter_emails: List[str]
+    credit_budget: int = Field(100, gt=0, le=MAX_BALLOT_VALUE)
 
 
 class ElectionResponse(BaseModel):
@@ -112,13 +209,67 @@ class ElectionResultsResponse(BaseModel):
     is_draw: bool = False
 
 
+class RoundResponse(BaseModel):
+    round: int
+    counts: Dict[int, int]
+    exhausted: int = 0
+    eliminated: int | None = None
+    transfers: Dict[int, int] = {}
+    transfers_exhausted: int = 0
+
+
+class ElectionRoundsResponse(BaseModel):
+    election_id: int
+    winner: CandidateResponse | None = None
+    rounds: List[RoundResponse]
+
+
+class MethodResultResponse(BaseModel):
+    method: str
+    results: List[CandidateResponse]
+    winner: CandidateResponse | None = None
+    is_draw: bool = False
+
+
+class ElectionComparisonResponse(BaseModel):
+    election_id: int
+    voting_system: str
+    ballots: int
+    methods: List[MethodResultResponse]
+
+
 class VotesResponse(BaseModel):
     election_id: int
     votes: Dict[str, str] | Dict[str, int]
+    next_after_id: int | None = None
+
+
+class BallotImportError(BaseModel):
+    line: int
+    error: str
+
+
+class BallotImportResponse(BaseModel):
+    election_id: int
+    accepted: int = 0
+    rejected: int = 0
+    errors: List[BallotImportError] = []
+    errors_truncated: bool = False
+
+
+class EmailStatusResponse(BaseModel):
+    election_id: int
+    queued: int = 0
+    sent: int = 0
+    failed: int = 0
 
 
 security = HTTPBearer()
 
+# Voting and results are served by one of these, see async_db.ASYNC_DB
+sync_router = APIRouter(route_class=route_class)
+async_router = APIRouter(route_class=route_class)
+
 SEND_EMAILS = False  # Set to True to enable email sending
 WRITE_TO_CSV = True  # Set to True to enable writing to CSV
 
@@ -135,88 +286,150 @@ def create_election(election: ElectionCreate, db: Session = Depends(get_db)):
         title=election.title,
         end_time=election.end_time,
         voting_system=election.voting_system,
+        credit_budget=election.credit_budget,
     )
     db.add(db_election)
-    db.commit()
-    db.refresh(db_election)
+    db.flush()
 
-    candidates = []
-    for candidate in election.candidates:
-        db_candidate = Candidate(name=candidate.name, election_id=db_election.id)
-        db.add(db_candidate)
-        db.commit()
-        db.refresh(db_candidate)
-        candidates.append(db_candidate)
-    db_election.candidates = candidates
-
-    # To clear out the OTP table: db.query(OTP).delete(synchronize_session=False)
-    # Generate OTPs
-    email_otp_mapping = {}
-    for email in election.voter_emails:
-        otp = generate_otp()
-        auth_token = create_auth_token(email, otp)
-        db_auth = AuthorizationToken(auth_token=auth_token, election_id=db_election.id)
-        db.add(db_auth)
-        email_otp_mapping[email] = otp
+    candidates = insert_candidates(
+        db_election.id, [candidate.name for candidate in election.candidates], db
+    )
     db.commit()
-    handle_otp_storage_and_notification(
+    schedule_finalization(db_election.id, db_election.end_time)
+
+    # Generate OTPs, storing and sending them one batch at a time
+    insert_voter_tokens(
         db_election.id,
-        db_election.title,
-        email_otp_mapping,
-        send_emails=SEND_EMAILS,
-        write_to_csv=WRITE_TO_CSV,
+        election.voter_emails,
+        db,
+        on_batch=lambda email_otp_mapping: handle_otp_storage_and_notification(
+            db_election.id,
+            db_election.title,
+            email_otp_mapping,
+            send_emails=SEND_EMAILS,
+            write_to_csv=WRITE_TO_CSV,
+            dispatcher=get_dispatcher() if SEND_EMAILS else None,
+        ),
     )
 
-    return db_election
+    return ElectionResponse(
+        id=db_election.id,
+        title=db_election.title,
+        candidates=[
+            CandidateResponse(id=candidate_id, name=name, votes=0.0)
+            for candidate_id, name in candidates
+        ],
+    )
 
 
 # Vote in an election
-@app.post("/elections/{election_id}/vote", response_model=dict)
+@sync_router.post("/elections/{election_id}/vote", response_model=dict)
 def vote_in_election(
     election_id: int,
     vote: VoteCreate | AlternativeVoteCreate,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db),
 ):
-    election = db.query(Election).filter(Election.id == election_id).first()
-    if not election:
-        raise HTTPException(status_code=404, detail="Election not found")
+    return record_vote(election_id, vote, credentials.credentials, db)
 
-    if election.end_time and datetime.now(timezone.utc) > election.end_time.replace(
-        tzinfo=timezone.utc
-    ):
-        raise HTTPException(status_code=400, detail="Election has ended")
 
-    validation_token = credentials.credentials
-    # Validate auth_token
-    auth_token_record = (
-        db.query(AuthorizationToken)
-        .filter(
-            (AuthorizationToken.auth_token == validation_token)
-            & (AuthorizationToken.election_id == election_id)
+@async_router.post("/elections/{election_id}/vote", response_model=dict)
+async def vote_in_election_async(
+    election_id: int,
+    vote: VoteCreate | AlternativeVoteCreate,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # The same ORM code, run on the async connection without a threadpool worker
+    if not GROUP_COMMIT:
+        return await db.run_sync(
+            lambda sync_db: record_vote(
+                election_id, vote, credentials.credentials, sync_db
+            )
+        )
+    pending = await db.run_sync(
+        lambda sync_db: prepare_vote(
+            election_id, vote, credentials.credentials, sync_db
         )
-        .first()
     )
-    if auth_token_record is None:
-        raise HTTPException(status_code=401, detail="Invalid OTP")
+    # Wait for the writer's commit without holding up the event loop
+    try:
+        stored = await asyncio.wrap_future(get_vote_writer().submit(pending))
+    except ElectionClosed:
+        raise reject_vote("election_ended", 400, "Election has ended")
+    return vote_outcome(pending, stored)
+
 
+def record_vote(
+    election_id: int,
+    vote: VoteCreate | AlternativeVoteCreate,
+    validation_token: str,
+    db: Session,
+):
+    pending = prepare_vote(election_id, vote, validation_token, db)
+    try:
+        if GROUP_COMMIT:
+            stored = get_vote_writer().submit(pending).result()
+        else:
+            # Token consume, ballot insert and counter update share one commit
+            (stored,) = write_votes([pending], db)
+            if stored:
+                db.commit()
+                ballot_versions.bump(election_id)
+            token_index.consume(election_id, validation_token)
+    except ElectionClosed:
+        # Validated before the end time, but the results are already final
+        db.rollback()
+        raise reject_vote("election_ended", 400, "Election has ended")
+    return vote_outcome(pending, stored)
+
+
+def vote_outcome(pending: PendingVote, stored: bool):
+    if not stored:
+        raise reject_vote("invalid_token", 401, "Invalid OTP")
+    votes_accepted.labels(pending.voting_system).inc()
+    return {"message": "Vote cast successfully"}
+
+
+def reject_vote(reason: str, status_code: int, detail: str) -> HTTPException:
+    votes_rejected.labels(reason).inc()
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+def prepare_vote(
+    election_id: int,
+    vote: VoteCreate | AlternativeVoteCreate,
+    validation_token: str,
+    db: Session,
+) -> PendingVote:
+    # Validate a ballot against the cached election, without writing anything
+    election = election_info.get(election_id, db)
+    if not election:
+        raise reject_vote("election_not_found", 404, "Election not found")
+
+    if election.end_time and datetime.now(timezone.utc) > election.end_time:
+        raise reject_vote("election_ended", 400, "Election has ended")
+
+    # Unknown and already used tokens are refused without touching the database
+    if not token_index.might_contain(election_id, validation_token, db):
+        raise reject_vote("invalid_token", 401, "Invalid OTP")
+
+    ordinals = election.candidate_ordinals
     if election.voting_system == "traditional" and type(vote.vote) == type(0):
         # Traditional voting logic
-        candidate = (
-            db.query(Candidate)
-            .filter(Candidate.id == vote.vote, Candidate.election_id == election_id)
-            .first()
-        )
-        if candidate is None:
-            raise HTTPException(
-                status_code=404, detail="Candidate not found for this election"
+        if vote.vote not in ordinals:
+            raise reject_vote(
+                "unknown_candidate", 404, "Candidate not found for this election"
             )
-        db_vote = Vote(
+        return PendingVote(
+            election_id=election_id,
+            voting_system=election.voting_system,
             validation_token=validation_token,
-            election_id=election.id,
-            candidate_id=candidate.id,
+            candidate_id=vote.vote,
+            vote_string=None,
+            packed_vote=None,
+            tally_candidate_id=vote.vote,
         )
-        db.add(db_vote)
     elif election.voting_system in (
         "ranked_choice",
         "score_voting",
@@ -224,208 +437,354 @@ def vote_in_election(
     ) and type(vote.vote) == type(""):
         # Parse the JSON data
         # sample: '{"id1":1, "id2":2, "id3":3, "id4":4}'
-        vote_data = json.loads(vote.vote)
+        try:
+            vote_data = json.loads(vote.vote)
+        except ValueError:
+            vote_data = None
+        if not isinstance(vote_data, dict):
+            raise reject_vote("invalid_ballot", 400, "Invalid ballot format")
+
+        if election.voting_system == "score_voting":
+            try:
+                validate_score_ballot(vote_data)
+            except ValueError as e:
+                raise reject_vote("invalid_ballot", 400, str(e))
+        elif election.voting_system == "quadratic_voting":
+            try:
+                validate_quadratic_ballot(vote_data, election.credit_budget)
+            except ValueError as e:
+                raise reject_vote("invalid_ballot", 400, str(e))
         for candidate_id in vote_data:
-            if (
-                not db.query(Candidate)
-                .filter(
-                    Candidate.id == candidate_id, Candidate.election_id == election_id
+            if not candidate_id.isdigit() or int(candidate_id) not in ordinals:
+                raise reject_vote(
+                    "unknown_candidate",
+                    404,
+                    f"Candidate with ID {candidate_id} not found for this election",
                 )
-                .first()
-            ):
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Candidate with ID {candidate_id} not found for this election",
-                )
-
-        db_vote = AlternativeVote(
+        try:
+            packed_vote = encode_ballot(vote_data, ordinals)
+        except ValueError as e:
+            raise reject_vote("invalid_ballot", 400, str(e))
+
+        return PendingVote(
+            election_id=election_id,
+            voting_system=election.voting_system,
             validation_token=validation_token,
-            election_id=election.id,
+            candidate_id=None,
             vote_string=vote.vote,
-            vote=str.encode(vote.vote),
+            packed_vote=packed_vote,
+            tally_candidate_id=(
+                first_preference(vote_data)
+                if election.voting_system == "ranked_choice"
+                else None
+            ),
         )
-        db.add(db_vote)
     else:
+        raise reject_vote(
+            "wrong_vote_type",
+            400,
+            "Invalid voting system and/or vote type for this election",
+        )
+
+
+# Import ballots collected elsewhere, e.g. paper ballots carrying voter tokens
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+IMPORT_MAX_ERRORS = 1000
+
+
+@app.post("/elections/{election_id}/ballots", response_model=BallotImportResponse)
+async def import_ballots(
+    election_id: int,
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    db: Session = Depends(get_db),
+):
+    """Store a CSV (``token,vote``) or NDJSON upload of ballots.
+
+    The body is read as a stream and every ``IMPORT_CHUNK_SIZE`` lines are
+    validated like single votes and committed together. A bad line only
+    rejects that ballot; the report lists the first ``IMPORT_MAX_ERRORS``.
+    """
+    format = format or IMPORT_FORMATS.get(
+        request.headers.get("content-type", "").split(";")[0].strip().lower()
+    )
+    if format is None:
         raise HTTPException(
-            status_code=400,
-            detail="Invalid voting system and/or vote type for this election",
+            status_code=415, detail="Send text/csv or application/x-ndjson"
         )
+    election = await run_in_threadpool(election_info.get, election_id, db)
+    if not election:
+        raise HTTPException(status_code=404, detail="Election not found")
+    if election.end_time and datetime.now(timezone.utc) > election.end_time:
+        raise HTTPException(status_code=400, detail="Election has ended")
 
+    report = BallotImportResponse(election_id=election_id)
+
+    def add_errors(errors):
+        report.rejected += len(errors)
+        room = IMPORT_MAX_ERRORS - len(report.errors)
+        report.errors.extend(
+            BallotImportError(line=line, error=error) for line, error in errors[:room]
+        )
+        report.errors_truncated |= len(errors) > room
+
+    chunk, errors = [], []
+    async for number, line in read_lines(request.stream()):
+        try:
+            ballot = parse_ballot_line(format, line)
+        except ValueError as e:
+            errors.append((number, f"Invalid line: {e}"))
+            continue
+        if ballot is not None:
+            chunk.append((number, *ballot))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            accepted, chunk_errors = await run_in_threadpool(
+                profiled(import_ballot_chunk),
+                election_id,
+                election.voting_system,
+                chunk,
+                db,
+            )
+            report.accepted += accepted
+            add_errors(sorted(errors + chunk_errors))
+            chunk, errors = [], []
+    if chunk:
+        accepted, chunk_errors = await run_in_threadpool(
+            profiled(import_ballot_chunk),
+            election_id,
+            election.voting_system,
+            chunk,
+            db,
+        )
+        report.accepted += accepted
+        errors += chunk_errors
+    add_errors(sorted(errors))
+    return report
+
+
+def import_ballot_chunk(election_id: int, voting_system: str, chunk, db: Session):
+    """Validate and store ``(line, token, vote)`` ballots in one transaction.
+
+    Returns the number of ballots stored and ``(line, error)`` for the rest.
+    """
+    errors, pending_votes, lines = [], [], []
+    for number, token, vote in chunk:
+        # CSV votes arrive as text; traditional ones are candidate ids
+        if voting_system == "traditional" and isinstance(vote, str):
+            try:
+                vote = int(vote)
+            except ValueError:
+                pass
+        try:
+            ballot = (
+                VoteCreate(vote=vote)
+                if type(vote) == type(0)
+                else AlternativeVoteCreate(vote=vote)
+            )
+            pending_votes.append(prepare_vote(election_id, ballot, token, db))
+            lines.append(number)
+        except HTTPException as e:
+            errors.append((number, e.detail))
+        except ValueError:
+            votes_rejected.labels("wrong_vote_type").inc()
+            errors.append((number, "Vote must be a candidate id or a JSON ballot"))
+    if not pending_votes:
+        return 0, errors
+
+    try:
+        stored = write_votes(pending_votes, db)
+    except ElectionClosed:
+        db.rollback()
+        votes_rejected.labels("election_ended").inc(len(pending_votes))
+        return 0, errors + [(number, "Election has ended") for number in lines]
     db.commit()
-    db.delete(auth_token_record)
-    db.commit()
-    return {"message": "Vote cast successfully"}
+    ballot_versions.bump(election_id)
+    for pending, number, ok in zip(pending_votes, lines, stored):
+        token_index.consume(election_id, pending.validation_token)
+        if ok:
+            votes_accepted.labels(voting_system).inc()
+        else:
+            votes_rejected.labels("invalid_token").inc()
+            errors.append((number, "Invalid OTP"))
+    return sum(stored), errors
 
 
 # Get election results
-@app.get("/elections/{election_id}/results", response_model=ElectionResultsResponse)
+@sync_router.get(
+    "/elections/{election_id}/results", response_model=ElectionResultsResponse
+)
 def get_election_results(election_id: int, db: Session = Depends(get_db)):
-    draw_flag = False
+    now = datetime.now(timezone.utc)
+    cached_results = result_cache.get(election_id, now)
+    if cached_results is not None:
+        return cached_results
+    return election_results(election_id, now, db)
 
+
+@async_router.get(
+    "/elections/{election_id}/results", response_model=ElectionResultsResponse
+)
+async def get_election_results_async(
+    election_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    finalize_db: Session = Depends(get_db),
+):
+    # Cache hits are answered on the event loop; reads go through the async
+    # connection and only tallies take a threadpool worker
+    now = datetime.now(timezone.utc)
+    cached_results = result_cache.get(election_id, now)
+    if cached_results is not None:
+        return cached_results
+    return await election_results_async(election_id, now, db, finalize_db)
+
+
+def election_results(election_id: int, now: datetime, db: Session):
+    # Read the version before tallying so votes landing mid-tally invalidate it
+    ballot_version = ballot_versions.get(election_id)
     election = db.query(Election).filter(Election.id == election_id).first()
     if not election:
         raise HTTPException(status_code=404, detail="Election not found")
 
-    candidates = db.query(Candidate).filter(Candidate.election_id == election_id).all()
-    if not candidates:
-        raise HTTPException(
-            status_code=404, detail="No candidates found for this election"
-        )
+    end_time = (
+        election.end_time.replace(tzinfo=timezone.utc) if election.end_time else None
+    )
+    ended = end_time is not None and now > end_time
+    results = compute_election_results(election, ended, db)
+    result_cache.put(election_id, ballot_version, ended, end_time, results)
+    return results
 
-    def candidate_votes_winner_calculate(
-        election_id: int, db: Session
-    ) -> Tuple[List[CandidateResponse], Optional[CandidateResponse], bool]:
 
-        draw_flag = False
+async def election_results_async(
+    election_id: int, now: datetime, db: AsyncSession, finalize_db: Session
+):
+    """``election_results`` over an AsyncSession.
 
-        stored_winner = (
-            db.query(ElectionWinner)
-            .filter(ElectionWinner.election_id == election_id)
-            .first()
-        )
+    ``finalize_db`` is only used, from the threadpool, when this request has
+    to finalize the election itself.
+    """
+    ballot_version = ballot_versions.get(election_id)
+    election = await db.get(Election, election_id)
+    if not election:
+        raise HTTPException(status_code=404, detail="Election not found")
 
-        # Check if the election has a stored winner
-        if stored_winner:
-            stored_candidate_votes_response = [
-                CandidateResponse(
-                    id=candidate.id, name=candidate.name, votes=candidate.votes
+    end_time = (
+        election.end_time.replace(tzinfo=timezone.utc) if election.end_time else None
+    )
+    ended = end_time is not None and now > end_time
+    candidates = await db.run_sync(
+        lambda sync_db: election_candidates(election_id, sync_db)
+    )
+    if ended:
+        if election.finalized_at is None:
+            await run_in_threadpool(
+                profiled(finalize_election), election_id, finalize_db, "request"
+            )
+            # End the read snapshot so the stored totals are visible
+            await db.rollback()
+        results = await db.run_sync(
+            lambda sync_db: closed_results(
+                sync_db.get(Election, election_id),
+                election_candidates(election_id, sync_db),
+                sync_db,
+            )
+        )
+    else:
+        try:
+            if BALLOT_KINDS.get(election.voting_system) == "ranks":
+                live = TallyResult(
+                    await db.run_sync(lambda sync_db: live_tally(election_id, sync_db)),
+                    None,
                 )
-                for candidate in candidates
-            ]
-
-            if stored_winner.winner_id:
-                winner_response = CandidateResponse(
-                    id=stored_winner.winner_id,
-                    name=stored_winner.winner.name,
-                    votes=stored_winner.votes,
+            else:
+                started = time.perf_counter()
+                ballots = await db.run_sync(
+                    lambda sync_db: Ballots.load(election, sync_db)
                 )
-
-            elif stored_winner.winner_id is None:
-                winner_response = CandidateResponse(
-                    id=None, name="Draw", votes=stored_winner.votes
+                live = await run_in_threadpool(
+                    profiled(tally_ballots), election, ballots, started
                 )
-                draw_flag = True
-            else:
-                winner_response = None
+        except ValueError:
+            raise HTTPException(
+                status_code=404, detail="Invalid voting system for this election"
+            )
+        results = open_results(election, candidates, live)
+    result_cache.put(election_id, ballot_version, ended, end_time, results)
+    return results
 
-            return stored_candidate_votes_response, winner_response, draw_flag
 
-        else:
-            candidate_votes = {}
-            if election.voting_system == "traditional":
-                candidate_votes = calculate_traditional_votes(election_id, db)
-            elif election.voting_system == "ranked_choice":
-                candidate_votes = calculate_ranked_choice_votes(election_id, db)
-            elif election.voting_system == "score_voting":
-                candidate_votes = calculate_score_votes(election_id, db)
-            elif election.voting_system == "quadratic_voting":
-                candidate_votes = calculate_quadratic_votes(election_id, db)
-            else:
-                raise HTTPException(
-                    status_code=404, detail="Invalid voting system for this election"
-                )
+def election_candidates(election_id: int, db: Session) -> List[Candidate]:
+    candidates = db.query(Candidate).filter(Candidate.election_id == election_id).all()
+    if not candidates:
+        raise HTTPException(
+            status_code=404, detail="No candidates found for this election"
+        )
+    return candidates
 
-            # print(
-            #     f"Candidate Votes returned from calculate_system_votes: {candidate_votes}"
-            # )
-
-            for candidate in candidates:
-                if candidate.id not in candidate_votes:
-                    candidate_votes[candidate.id] = 0.0
-                else:
-                    candidate.votes = candidate_votes[candidate.id]
-
-            winner = max(candidates, key=lambda x: x.votes)
-            other_winners = {
-                candidate.id: candidate
-                for candidate in candidates
-                if candidate.votes == winner.votes
-            }
-            if len(other_winners) > 1:
-                db_winner = ElectionWinner(
-                    election_id=election_id,
-                    winner_id=None,
-                    votes=winner.votes,
-                )
-                winner_response = CandidateResponse(
-                    id=None, name="Draw", votes=winner.votes
-                )
-                draw_flag = True
 
-            elif len(other_winners) == 1:
-                db_winner = ElectionWinner(
-                    election_id=election_id,
-                    winner_id=winner.id,
-                    votes=winner.votes,
-                )
-                winner_response = CandidateResponse(
-                    id=winner.id, name=winner.name, votes=winner.votes
-                )
-            else:
-                db_winner = None
+def compute_election_results(
+    election: Election, ended: bool, db: Session
+) -> ElectionResultsResponse:
+    candidates = election_candidates(election.id, db)
 
-            if db_winner:
-                db.add(db_winner)
-                db.commit()
+    # Closed elections are answered from the stored final results
+    if ended:
+        if election.finalized_at is None:
+            # The finalizer has not reached it yet, or is not running here
+            finalize_election(election.id, db, trigger="request")
+            # Another request may have finalized it while this one waited, so
+            # the candidates loaded above can predate the stored totals
+            db.expire_all()
+        return closed_results(election, candidates, db)
 
-        return [
-            [
-                CandidateResponse(
-                    id=candidate.id, name=candidate.name, votes=candidate.votes
-                )
-                for candidate in candidates
-            ],
-            winner_response,
-            draw_flag,
-        ]
-
-    # Check if the election has expired and calculate the winner
-    candidate_responses, winner_response = None, None
-    if election.end_time and datetime.now(timezone.utc) > election.end_time.replace(
-        tzinfo=timezone.utc
-    ):
-        candidate_responses, winner_response, draw_flag = (
-            candidate_votes_winner_calculate(election_id, db)
+    # Traditional and first-preference RCV counts are kept live per vote
+    try:
+        live = live_results(election, db)
+    except ValueError:
+        raise HTTPException(
+            status_code=404, detail="Invalid voting system for this election"
         )
-    else:
+    return open_results(election, candidates, live)
 
-        if election.voting_system == "traditional":
-            candidate_votes = calculate_traditional_votes(election_id, db)
-        elif election.voting_system == "ranked_choice":
-            candidate_votes = calculate_ranked_choice_votes(
-                election_id, db, traditional=True
-            )
-        elif election.voting_system == "score_voting":
-            candidate_votes = calculate_score_votes(election_id, db)
-        elif election.voting_system == "quadratic_voting":
-            candidate_votes = calculate_quadratic_votes(election_id, db)
-        else:
-            HTTPException(
-                status_code=404, detail="Invalid voting system for this election"
-            )
 
-        print(
-            f"Traditional Votes for systems while the election is going on: {candidate_votes}"
-        )
-        for candidate in candidates:
-            if candidate.id not in candidate_votes:
-                candidate_votes[candidate.id] = 0.0
-            else:
-                candidate.votes = candidate_votes[candidate.id]
-        candidate_responses = [
+def open_results(
+    election: Election, candidates: List[Candidate], live
+) -> ElectionResultsResponse:
+    averages = live.averages or {}
+    return ElectionResultsResponse(
+        election_title=election.title,
+        voting_system=election.voting_system,
+        results=[
             CandidateResponse(
                 id=candidate.id,
                 name=candidate.name,
-                votes=candidate.votes,
+                votes=live.totals.get(candidate.id, candidate.votes),
+                average=averages.get(candidate.id),
             )
             for candidate in candidates
-        ]
+        ],
+    )
 
-    if not candidate_responses:
-        raise HTTPException(
-            status_code=404, detail="No results found for this election"
-        )
 
+def closed_results(
+    election: Election, candidates: List[Candidate], db: Session
+) -> ElectionResultsResponse:
+    candidate_responses, winner_response, draw_flag = final_results(
+        election.id, candidates, db
+    )
+    if election.voting_system == "score_voting":
+        averages = score_averages(
+            election.id,
+            {response.id: response.votes for response in candidate_responses},
+            db,
+        )
+        for response in candidate_responses:
+            response.average = averages[response.id]
+        if winner_response is not None and not draw_flag:
+            winner_response.average = averages[winner_response.id]
     return ElectionResultsResponse(
         election_title=election.title,
         voting_system=election.voting_system,
@@ -435,26 +794,224 @@ def get_election_results(election_id: int, db: Session = Depends(get_db)):
     )
 
 
-# Get all votes of that election
-@app.get("/elections/{election_id}/all_votes", response_model=VotesResponse)
-def get_all_votes(election_id: int, db: Session = Depends(get_db)):
+def final_results(
+    election_id: int, candidates: List[Candidate], db: Session
+) -> Tuple[List[CandidateResponse], Optional[CandidateResponse], bool]:
+    stored_winner = (
+        db.query(ElectionWinner).filter(ElectionWinner.election_id == election_id).first()
+    )
+    candidate_responses = [
+        CandidateResponse(id=candidate.id, name=candidate.name, votes=candidate.votes)
+        for candidate in candidates
+    ]
+    if stored_winner is None:
+        return candidate_responses, None, False
+    if stored_winner.winner_id is None:
+        return (
+            candidate_responses,
+            CandidateResponse(id=None, name="Draw", votes=stored_winner.votes),
+            True,
+        )
+    return (
+        candidate_responses,
+        CandidateResponse(
+            id=stored_winner.winner_id,
+            name=stored_winner.winner.name,
+            votes=stored_winner.votes,
+        ),
+        False,
+    )
+
 
+# Get the instant-runoff rounds of a closed ranked choice election
+@app.get("/elections/{election_id}/rounds", response_model=ElectionRoundsResponse)
+def get_election_rounds(election_id: int, db: Session = Depends(get_db)):
     election = db.query(Election).filter(Election.id == election_id).first()
     if not election:
         raise HTTPException(status_code=404, detail="Election not found")
+    if election.voting_system != "ranked_choice":
+        raise HTTPException(
+            status_code=400, detail="Rounds are only kept for ranked choice elections"
+        )
+    end_time = (
+        election.end_time.replace(tzinfo=timezone.utc) if election.end_time else None
+    )
+    if end_time is None or datetime.now(timezone.utc) <= end_time:
+        raise HTTPException(status_code=400, detail="Election has not ended")
+
+    # Rounds are stored with the winner when the election is finalized
+    if election.finalized_at is None:
+        finalize_election(election_id, db, trigger="request")
+        db.expire_all()
+    candidates = db.query(Candidate).filter(Candidate.election_id == election_id).all()
+    _, winner_response, _ = final_results(election_id, candidates, db)
+    stored_winner = (
+        db.query(ElectionWinner).filter(ElectionWinner.election_id == election_id).first()
+    )
+    if stored_winner is None:
+        rounds = []
+    elif stored_winner.rounds is None:
+        # Finalized before rounds were kept: tally once more and keep them
+        rounds = tally_election(election, db).rounds
+        stored_winner.rounds = json.dumps(rounds)
+        db.commit()
+    else:
+        rounds = json.loads(stored_winner.rounds)
+    return ElectionRoundsResponse(
+        election_id=election_id, winner=winner_response, rounds=rounds
+    )
+
+
+# Tally an election's ballots under several methods from one load of them
+@app.get(
+    "/elections/{election_id}/compare", response_model=ElectionComparisonResponse
+)
+def compare_election_methods(
+    election_id: int,
+    methods: str | None = Query(
+        None, description="Comma separated tally engines; all that fit by default"
+    ),
+    db: Session = Depends(get_db),
+):
+    election = db.query(Election).filter(Election.id == election_id).first()
+    if not election:
+        raise HTTPException(status_code=404, detail="Election not found")
+    candidates = {
+        candidate.id: candidate.name
+        for candidate in db.query(Candidate).filter(Candidate.election_id == election_id)
+    }
+    if not candidates:
+        raise HTTPException(
+            status_code=404, detail="No candidates found for this election"
+        )
+
+    ballots = Ballots.load(election, db)
+    names = [name.strip() for name in methods.split(",")] if methods else None
+    try:
+        results = compare(ballots, names)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown tally method {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return ElectionComparisonResponse(
+        election_id=election_id,
+        voting_system=election.voting_system,
+        ballots=ballots.total,
+        methods=[
+            MethodResultResponse(
+                method=name,
+                results=[
+                    CandidateResponse(
+                        id=candidate_id,
+                        name=candidates[candidate_id],
+                        votes=votes,
+                        average=(result.averages or {}).get(candidate_id),
+                    )
+                    for candidate_id, votes in result.totals.items()
+                ],
+                winner=(
+                    None
+                    if result.winner is None
+                    else CandidateResponse(
+                        id=result.winner,
+                        name=candidates[result.winner],
+                        votes=result.totals[result.winner],
+                        average=(result.averages or {}).get(result.winner),
+                    )
+                ),
+                is_draw=result.winner is None and ballots.total > 0,
+            )
+            for name, result in results.items()
+        ],
+    )
+
+
+app.include_router(async_router if ASYNC_DB else sync_router)
+app.include_router(profiles_router)
 
-    if election.voting_system == "traditional":
-        votes = db.query(Vote).filter(Vote.election_id == election_id).all()
-        votes_list = {vote.validation_token: vote.candidate_id for vote in votes}
-        print(f"Votes List: {votes_list}")
-        return VotesResponse(election_id=election_id, votes=votes_list)
 
+# Get all votes of that election
+EXPORT_BATCH_SIZE = 1000
+
+
+def ballot_export_query(election: Election, db: Session, after_id=None, limit=None):
+    # Keyset pagination over (id, validation_token, vote) in vote id order
+    if election.voting_system == "traditional":
+        columns = (Vote.id, Vote.validation_token, Vote.candidate_id)
+        election_filter = Vote.election_id == election.id
     else:
-        votes = (
-            db.query(AlternativeVote)
-            .filter(AlternativeVote.election_id == election_id)
-            .all()
+        columns = (
+            AlternativeVote.id,
+            AlternativeVote.validation_token,
+            AlternativeVote.vote_string,
         )
-        votes_list = {vote.validation_token: vote.vote.decode() for vote in votes}
-        print(f"Votes List: {votes_list}")
-        return VotesResponse(election_id=election_id, votes=votes_list)
+        election_filter = AlternativeVote.election_id == election.id
+
+    query = db.query(*columns).filter(election_filter)
+    if after_id is not None:
+        query = query.filter(columns[0] > after_id)
+    query = query.order_by(columns[0])
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+@app.get("/elections/{election_id}/all_votes", response_model=VotesResponse)
+def get_all_votes(
+    election_id: int,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, gt=0),
+    db: Session = Depends(get_db),
+):
+
+    election = db.query(Election).filter(Election.id == election_id).first()
+    if not election:
+        raise HTTPException(status_code=404, detail="Election not found")
+
+    if format == "ndjson":
+        # The request session is closed before the body is sent, so stream
+        # from a session of our own on the same engine
+        stream_db = Session(bind=db.get_bind())
+        query = (
+            ballot_export_query(election, stream_db, after_id, limit)
+            .execution_options(stream_results=True)
+            .yield_per(EXPORT_BATCH_SIZE)
+        )
+
+        def ndjson_lines():
+            try:
+                for vote_id, validation_token, vote in query:
+                    yield json.dumps(
+                        {"id": vote_id, "validation_token": validation_token, "vote": vote}
+                    ) + "\n"
+            finally:
+                stream_db.close()
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    votes = ballot_export_query(election, db, after_id, limit).all()
+    votes_list = {validation_token: vote for _, validation_token, vote in votes}
+    return VotesResponse(
+        election_id=election_id,
+        votes=votes_list,
+        next_after_id=votes[-1][0] if limit is not None and len(votes) == limit else None,
+    )
+
+
+# Get OTP email delivery status of that election
+@app.get("/elections/{election_id}/email_status", response_model=EmailStatusResponse)
+def get_email_status(election_id: int, db: Session = Depends(get_db)):
+
+    election = db.query(Election).filter(Election.id == election_id).first()
+    if not election:
+        raise HTTPException(status_code=404, detail="Election not found")
+
+    status_counts = dict(
+        db.query(EmailDelivery.status, func.count(EmailDelivery.id))
+        .filter(EmailDelivery.election_id == election_id)
+        .group_by(EmailDelivery.status)
+        .all()
+    )
+    return EmailStatusResponse(election_id=election_id, **status_counts)
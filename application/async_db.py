@@ -0,0 +1,45 @@
+import os
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from .models import DATABASE_URL, apply_sqlite_pragmas, pool_options
+from .metrics import instrument_engine
+
+# Set DB_MODE=async to serve voting and results from async handlers. Either
+# mode can run under several uvicorn --workers: the token index of each worker
+# only trusts elections whose tokens were all stored before it loaded them
+# (Election.tokens_issued_at), and its other caches are described in cache.py
+ASYNC_DB = os.getenv("DB_MODE", "sync").lower() == "async"
+
+# Async drivers for the sync URLs accepted in DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url):
+    """Rewrite a sync database URL to use its async driver (aiosqlite, asyncpg)."""
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+# The engine is created on first use, so aiosqlite/asyncpg are only
+# required when async mode is switched on
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+def bind_async_engine(url=DATABASE_URL):
+    if url.startswith("sqlite"):
+        engine = create_async_engine(async_database_url(url))
+        apply_sqlite_pragmas(engine.sync_engine)
+    else:
+        engine = create_async_engine(async_database_url(url), **pool_options())
+    instrument_engine(engine.sync_engine)
+    AsyncSessionLocal.configure(bind=engine)
+    return engine
+
+
+async def get_async_db():
+    if AsyncSessionLocal.kw.get("bind") is None:
+        bind_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
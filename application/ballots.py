@@ -0,0 +1,161 @@
+import struct
+import numpy as np
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from .models import Candidate, AlternativeVote, BallotPattern
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# Packed ballots hold one little-endian uint16 per candidate of the election,
+# in candidate ordinal order: the rank for ranked_choice (0 = unranked), the
+# score for score_voting and the credits for quadratic_voting.
+BALLOT_DTYPE = np.dtype("<u2")
+MAX_BALLOT_VALUE = np.iinfo(BALLOT_DTYPE).max
+
+
+def candidate_ordinals(election_id: int, db: Session):
+    """Map each candidate id of an election to its ordinal (position by id)."""
+    return {
+        candidate_id: ordinal
+        for ordinal, (candidate_id,) in enumerate(
+            db.query(Candidate.id)
+            .filter(Candidate.election_id == election_id)
+            .order_by(Candidate.id)
+        )
+    }
+
+
+def encode_ballot(vote_data, ordinals):
+    """Pack a ``{candidate_id: value}`` ballot into its fixed-width binary form.
+
+    Raises ``KeyError`` for a candidate outside ``ordinals`` and ``ValueError``
+    for a value that is not an integer in ``0 .. MAX_BALLOT_VALUE``.
+    """
+    values = [0] * len(ordinals)
+    for candidate_id, value in vote_data.items():
+        if type(value) is not int or not 0 <= value <= MAX_BALLOT_VALUE:
+            raise ValueError(f"Invalid ballot value {value!r} for {candidate_id}")
+        values[ordinals[int(candidate_id)]] = value
+    return struct.pack(f"<{len(values)}H", *values)
+
+
+def decode_ballots(blobs, n_candidates):
+    """View packed ballots as an ``(n_ballots, n_candidates)`` uint16 matrix."""
+    buffer = b"".join(blobs)
+    if n_candidates == 0:
+        return np.empty((0, 0), dtype=BALLOT_DTYPE)
+    return np.frombuffer(buffer, dtype=BALLOT_DTYPE).reshape(-1, n_candidates)
+
+
+def load_ballots(election_id: int, db: Session):
+    """Load an election's packed ballots in vote order.
+
+    Returns the election's candidate ids in ordinal order and the
+    ``(n_ballots, n_candidates)`` ballot matrix.
+    """
+    candidate_ids = list(candidate_ordinals(election_id, db))
+    blobs = [
+        vote
+        for (vote,) in db.query(AlternativeVote.vote)
+        .filter(AlternativeVote.election_id == election_id)
+        .order_by(AlternativeVote.id)
+        .yield_per(10_000)
+    ]
+    return candidate_ids, decode_ballots(blobs, len(candidate_ids))
+
+
+def load_ballot_patterns(election_id: int, db: Session):
+    """Load an election's distinct packed ballots in first-arrival order.
+
+    Returns the election's candidate ids in ordinal order, the
+    ``(n_patterns, n_candidates)`` ballot matrix and the number of ballots
+    cast for each pattern.
+    """
+    candidate_ids = list(candidate_ordinals(election_id, db))
+    patterns, counts = [], []
+    for pattern, count in (
+        db.query(BallotPattern.pattern, BallotPattern.count)
+        .filter(BallotPattern.election_id == election_id)
+        .order_by(BallotPattern.id)
+        .yield_per(10_000)
+    ):
+        patterns.append(pattern)
+        counts.append(count)
+    return (
+        candidate_ids,
+        decode_ballots(patterns, len(candidate_ids)),
+        np.array(counts, dtype=np.int64),
+    )
+
+
+def add_ballot_patterns(pattern_counts, db: Session):
+    """Count ``{(election_id, packed ballot): ballots}`` into the ballot patterns.
+
+    Runs in the caller's transaction, as one upsert where the database
+    supports it.
+    """
+    if not pattern_counts:
+        return
+    table = BallotPattern.__table__
+    rows = [
+        {"election_id": election_id, "pattern": pattern, "count": count}
+        for (election_id, pattern), count in pattern_counts.items()
+    ]
+    upsert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        statement = upsert(table)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["election_id", "pattern"],
+                set_={"count": table.c["count"] + statement.excluded["count"]},
+            ),
+            rows,
+        )
+        return
+    for row in rows:
+        updated = db.execute(
+            update(table)
+            .where(
+                (table.c.election_id == row["election_id"])
+                & (table.c.pattern == row["pattern"])
+            )
+            .values(count=table.c["count"] + row["count"])
+        ).rowcount
+        if not updated:
+            db.execute(insert(table), row)
+
+
+def rebuild_ballot_patterns(election_id: int, db: Session):
+    """Recount an election's ballot patterns from its raw ballots. Does not commit."""
+    table = BallotPattern.__table__
+    db.execute(delete(table).where(table.c.election_id == election_id))
+    db.execute(
+        insert(table).from_select(
+            ["election_id", "pattern", "count"],
+            db.query(
+                AlternativeVote.election_id,
+                AlternativeVote.vote,
+                func.count(AlternativeVote.id),
+            )
+            .filter(AlternativeVote.election_id == election_id)
+            .group_by(AlternativeVote.election_id, AlternativeVote.vote)
+            .order_by(func.min(AlternativeVote.id))
+            .statement,
+        )
+    )
+
+
+def ranks_to_rank_matrix(ranks):
+    """Turn per-candidate ranks into candidate ordinals in preference order.
+
+    Unranked candidates (rank 0) become the exhausted marker ``n_candidates``,
+    matching ``tally.rank_matrix``.
+    """
+    n_candidates = ranks.shape[1]
+    keyed = np.where(ranks == 0, MAX_BALLOT_VALUE + 1, ranks.astype(np.int32))
+    order = np.argsort(keyed, axis=1, kind="stable")
+    ranked = np.take_along_axis(keyed, order, axis=1) <= MAX_BALLOT_VALUE
+    dtype = np.int16 if n_candidates < np.iinfo(np.int16).max else np.int32
+    return np.where(ranked, order, n_candidates).astype(dtype)
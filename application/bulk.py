@@ -0,0 +1,98 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from .models import Candidate, CandidateTally, AuthorizationToken, Election
+from .utils import generate_otp_batch, create_auth_token_batch
+from .cache import token_index
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BATCH_SIZE = 10_000
+
+
+def insert_candidates(election_id: int, names, db: Session):
+    """Insert an election's candidates and their tally counters in one statement each.
+
+    Returns ``(id, name)`` rows in the order the names were given. Does not commit.
+    """
+    if not names:
+        # An executemany with no parameter sets would insert one default row
+        return []
+    rows = db.execute(
+        insert(Candidate)
+        .returning(Candidate.id, Candidate.name, sort_by_parameter_order=True),
+        [{"name": name, "election_id": election_id, "votes": 0.0} for name in names],
+    ).all()
+    db.execute(
+        insert(CandidateTally),
+        [
+            {"election_id": election_id, "candidate_id": candidate_id, "votes": 0.0}
+            for candidate_id, _ in rows
+        ],
+    )
+    return rows
+
+
+def prepare_voter_tokens(emails):
+    """Generate OTPs for a batch of voter emails and hash them into auth tokens."""
+    otps = generate_otp_batch(len(emails))
+    return otps, create_auth_token_batch(emails, otps)
+
+
+def insert_voter_tokens(
+    election_id: int, emails, db: Session, on_batch=None, batch_size=TOKEN_BATCH_SIZE
+):
+    """Generate OTPs for voter emails and store their auth tokens in batches.
+
+    Each batch is inserted with one executemany and committed, which releases
+    the SQLite writer between batches; meanwhile a worker thread generates and
+    hashes the next batch. After the commit ``on_batch`` receives the batch's
+    ``{email: otp}`` mapping, so identities are streamed out instead of
+    collected for the whole electorate. ``Election.tokens_issued_at`` is set
+    after the last batch, so token indexes loaded before then are not trusted.
+
+    Returns the number of tokens inserted.
+    """
+    started = time.perf_counter()
+    emails = iter(emails)
+    batches = iter(lambda: list(islice(emails, batch_size)), [])
+    total = 0
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="voter-tokens") as pool:
+        batch = next(batches, None)
+        pending = pool.submit(prepare_voter_tokens, batch) if batch else None
+        while batch:
+            otps, tokens = pending.result()
+            next_batch = next(batches, None)
+            if next_batch:
+                pending = pool.submit(prepare_voter_tokens, next_batch)
+            db.execute(
+                insert(AuthorizationToken.__table__),
+                [{"auth_token": token, "election_id": election_id} for token in tokens],
+            )
+            db.commit()
+            token_index.invalidate(election_id)
+            if on_batch is not None:
+                on_batch(dict(zip(batch, otps)))
+            total += len(batch)
+            batch = next_batch
+
+    db.execute(
+        update(Election)
+        .where(Election.id == election_id)
+        .values(tokens_issued_at=datetime.now(timezone.utc))
+    )
+    db.commit()
+    token_index.invalidate(election_id)
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Election #%s: inserted %d voter tokens in %.2fs (%.0f rows/s)",
+        election_id,
+        total,
+        elapsed,
+        total / elapsed if elapsed else 0.0,
+    )
+    return total
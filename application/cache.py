@@ -0,0 +1,302 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from datetime import timezone
+import numpy as np
+from sqlalchemy.orm import Session
+from .models import Election, AuthorizationToken
+from .ballots import candidate_ordinals
+from .metrics import token_index_hits, token_index_misses
+
+
+class BallotVersions:
+    """Per-election counters bumped whenever an election's ballots change.
+
+    Versions live in process memory, so with several worker processes each
+    one only sees its own votes; use a staleness window to bound how long
+    results from other workers can be missed.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, election_id):
+        return self._versions.get(election_id, 0)
+
+    def bump(self, election_id):
+        with self._lock:
+            self._versions[election_id] = self._versions.get(election_id, 0) + 1
+
+
+class ResultCache:
+    """LRU cache of computed election results keyed by ballot version.
+
+    An entry is served while the election's ballot version is unchanged and
+    the election has not crossed its end time since it was computed. With
+    ``max_staleness`` seconds set, an entry is also served for that long after
+    it was computed even if newer ballots arrived, which bounds recomputation
+    of very hot elections to once per window.
+    """
+
+    def __init__(self, versions, max_entries=1024, max_staleness=0.0):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.max_staleness = max_staleness
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, election_id, now):
+        """Return the cached results for ``election_id``, or ``None``."""
+        with self._lock:
+            entry = self._entries.get(election_id)
+            if entry is None:
+                return None
+            version, ended, end_time, computed_at, value = entry
+            if ended != (end_time is not None and now > end_time):
+                return None
+            if version != self.versions.get(election_id) and (
+                time.monotonic() - computed_at >= self.max_staleness
+            ):
+                return None
+            self._entries.move_to_end(election_id)
+            return value
+
+    def put(self, election_id, version, ended, end_time, value):
+        """Store results computed when the election was at ``version``."""
+        with self._lock:
+            self._entries[election_id] = (
+                version,
+                ended,
+                end_time,
+                time.monotonic(),
+                value,
+            )
+            self._entries.move_to_end(election_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SingleFlight:
+    """Run at most one call per key at a time.
+
+    Callers of ``do`` that arrive while a call for the same key is running
+    wait for it and get its result (or exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+ElectionInfo = namedtuple(
+    "ElectionInfo",
+    ["id", "voting_system", "end_time", "credit_budget", "candidate_ordinals"],
+)
+
+
+class ElectionInfoCache:
+    """LRU cache of the parts of an election that are fixed once it is created.
+
+    Holds the voting system, end time (as an aware UTC datetime), credit
+    budget and the candidate id to ordinal map, so casting a vote needs no
+    reads for them after the first ballot.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, election_id: int, db: Session):
+        """Return the ``ElectionInfo`` for ``election_id``, or ``None`` if missing."""
+        with self._lock:
+            info = self._entries.get(election_id)
+            if info is not None:
+                self._entries.move_to_end(election_id)
+                return info
+
+        election = db.query(Election).filter(Election.id == election_id).first()
+        if election is None:
+            return None
+        info = ElectionInfo(
+            id=election.id,
+            voting_system=election.voting_system,
+            end_time=(
+                election.end_time.replace(tzinfo=timezone.utc)
+                if election.end_time
+                else None
+            ),
+            credit_budget=election.credit_budget,
+            candidate_ordinals=candidate_ordinals(election_id, db),
+        )
+        with self._lock:
+            self._entries[election_id] = info
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenIndex:
+    """Per-election index of unconsumed auth tokens, for rejecting bad tokens early.
+
+    An election's tokens are loaded on first use as a sorted array of the
+    first 8 bytes of each SHA-256 token (8 bytes per voter), plus a set of
+    tokens seen consumed or rejected since. ``might_contain`` answers
+    ``False`` only when the token is certainly not usable, so those requests
+    can be refused without a query; ``True`` still needs the database to
+    consume the token.
+
+    Until ``Election.tokens_issued_at`` is set more tokens may still arrive,
+    possibly through another worker process, so no index is kept and every
+    token goes to the database. Within a process, tokens issued after a load
+    are announced with ``invalidate``; a load that an invalidation overtook is
+    not kept. Tokens consumed by other worker processes still reach the
+    database once here before being remembered.
+    """
+
+    # Entry of an election whose tokens are not all SHA-256 hex digests, so
+    # a prefix miss proves nothing
+    UNUSABLE = object()
+    # Load result of an election still being issued tokens; never stored
+    ISSUING = object()
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # election id -> number of invalidations, to spot loads gone stale
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prefix(token):
+        if len(token) != 64:
+            return None
+        try:
+            return int(token[:16], 16)
+        except ValueError:
+            return None
+
+    def _load(self, election_id, db):
+        issued = (
+            db.query(Election.tokens_issued_at)
+            .filter(Election.id == election_id)
+            .scalar()
+        )
+        if issued is None:
+            return self.ISSUING
+        tokens = [
+            token
+            for (token,) in db.query(AuthorizationToken.auth_token).filter(
+                AuthorizationToken.election_id == election_id
+            )
+        ]
+        if any(self._prefix(token) is None for token in tokens):
+            return self.UNUSABLE
+        prefixes = np.frombuffer(
+            bytes.fromhex("".join(token[:16] for token in tokens)), dtype=">u8"
+        ).astype(np.uint64)
+        prefixes.sort()
+        return prefixes, set()
+
+    def might_contain(self, election_id: int, token: str, db: Session):
+        """Return ``False`` if ``token`` is certainly not a usable token of the election."""
+        with self._lock:
+            entry = self._entries.get(election_id)
+            if entry is not None:
+                self._entries.move_to_end(election_id)
+            generation = self._generations.get(election_id, 0)
+        if entry is None:
+            entry = self._load(election_id, db)
+            with self._lock:
+                if entry is self.ISSUING:
+                    # Not kept, so the next token looks at the election again
+                    entry = self.UNUSABLE
+                elif self._generations.get(election_id, 0) == generation:
+                    self._entries[election_id] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                else:
+                    # Tokens were issued while loading and may be missing
+                    entry = self.UNUSABLE
+
+        found = True
+        if entry is not self.UNUSABLE:
+            prefixes, consumed = entry
+            prefix = self._prefix(token)
+            if prefix is None or token in consumed:
+                found = False
+            else:
+                position = np.searchsorted(prefixes, np.uint64(prefix))
+                found = position < len(prefixes) and prefixes[position] == prefix
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def consume(self, election_id: int, token: str):
+        """Remember that ``token`` can no longer be used in the election."""
+        with self._lock:
+            entry = self._entries.get(election_id)
+            if entry is not None and entry is not self.UNUSABLE:
+                entry[1].add(token)
+
+    def invalidate(self, election_id: int):
+        """Drop an election's index, e.g. after more tokens were issued."""
+        with self._lock:
+            self._generations[election_id] = self._generations.get(election_id, 0) + 1
+            self._entries.pop(election_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+election_info = ElectionInfoCache()
+ballot_versions = BallotVersions()
+result_cache = ResultCache(
+    ballot_versions,
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+    max_staleness=float(os.getenv("RESULT_CACHE_MAX_STALENESS", "0")),
+)
+token_index = TokenIndex(max_entries=int(os.getenv("TOKEN_INDEX_SIZE", "256")))
+token_index_hits.set_function(lambda: token_index.hits)
+token_index_misses.set_function(lambda: token_index.misses)
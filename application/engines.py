@@ -0,0 +1,298 @@
+import time
+from collections import namedtuple
+from functools import cached_property
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .ballots import (
+    BALLOT_DTYPE,
+    MAX_BALLOT_VALUE,
+    candidate_ordinals,
+    load_ballot_patterns,
+    ranks_to_rank_matrix,
+)
+from .metrics import record_tally
+from .models import Election, Vote
+from .tally import instant_runoff, quadratic_voting, score_voting
+
+MAX_SCORE = 10
+
+# What the values of an election's ballot matrix mean, by voting system.
+# Traditional ballots are read as rankings of their one candidate.
+BALLOT_KINDS = {
+    "traditional": "ranks",
+    "ranked_choice": "ranks",
+    "score_voting": "scores",
+    "quadratic_voting": "credits",
+}
+
+# Cells of the (ballots, candidates, candidates) block compared at a time
+PAIRWISE_BLOCK = 4_000_000
+
+
+class Ballots:
+    """An election's distinct ballots, loaded once for any number of tallies.
+
+    ``values`` is the ``(n_patterns, n_candidates)`` matrix of ballot values
+    in candidate ordinal order (see ``ballots.BALLOT_DTYPE``), ``counts`` the
+    number of ballots cast for each row, and rows are in order of their first
+    ballot so ties break as they would over single ballots.
+    """
+
+    def __init__(self, kind, candidate_ids, values, counts, credit_budget=None):
+        self.kind = kind
+        self.candidate_ids = candidate_ids
+        self.values = values
+        self.counts = counts
+        self.credit_budget = credit_budget
+
+    @classmethod
+    def load(cls, election: Election, db: Session):
+        try:
+            kind = BALLOT_KINDS[election.voting_system]
+        except KeyError:
+            raise ValueError(f"Invalid voting system {election.voting_system!r}")
+        if election.voting_system != "traditional":
+            return cls(
+                kind,
+                *load_ballot_patterns(election.id, db),
+                credit_budget=election.credit_budget,
+            )
+
+        ordinals = candidate_ordinals(election.id, db)
+        # Sorted here rather than by ORDER BY, which would need a temp b-tree
+        # on top of the (election_id, candidate_id) index scan
+        rows = sorted(
+            db.query(func.min(Vote.id), Vote.candidate_id, func.count(Vote.id))
+            .filter(Vote.election_id == election.id)
+            .group_by(Vote.candidate_id)
+        )
+        values = np.zeros((len(rows), len(ordinals)), dtype=BALLOT_DTYPE)
+        columns = [ordinals[candidate_id] for _, candidate_id, _ in rows]
+        values[np.arange(len(rows)), columns] = 1
+        counts = np.array([votes for _, _, votes in rows], dtype=np.int64)
+        return cls(kind, list(ordinals), values, counts)
+
+    @property
+    def n_candidates(self):
+        return len(self.candidate_ids)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    @cached_property
+    def rankings(self):
+        """Candidate ordinals in preference order, as ``tally.rank_matrix`` builds them."""
+        return ranks_to_rank_matrix(self.values)
+
+
+TallyEngine = namedtuple(
+    "TallyEngine", ["name", "kind", "tally", "description", "voting_system"]
+)
+TallyResult = namedtuple(
+    "TallyResult", ["totals", "winner", "rounds", "averages"], defaults=[None, None]
+)
+
+# Tally engines by name. Each takes a ``Ballots`` of its ``kind`` and returns
+# a TallyResult of per-candidate totals (by ordinal), the winning ordinal
+# (None for a draw or without ballots), any instant-runoff rounds and, for
+# score voting, the average score per ballot. An
+# engine registered with a ``voting_system`` is that system's own tally,
+# used for its results and finalization.
+TALLY_ENGINES = {}
+
+
+def tally_engine(name, kind, voting_system=None):
+    def register(fn):
+        TALLY_ENGINES[name] = TallyEngine(
+            name, kind, fn, fn.__doc__.strip().splitlines()[0], voting_system
+        )
+        return fn
+
+    return register
+
+
+def top(totals, ballots: Ballots):
+    # The candidate with the unique highest total
+    if ballots.total == 0 or not len(totals):
+        return None
+    leaders = np.flatnonzero(totals == totals.max())
+    return int(leaders[0]) if len(leaders) == 1 else None
+
+
+@tally_engine("plurality", "ranks", voting_system="traditional")
+def plurality(ballots: Ballots):
+    """The most first preferences wins."""
+    n = ballots.n_candidates
+    totals = np.bincount(
+        ballots.rankings[:, 0], weights=ballots.counts, minlength=n + 1
+    )[:n]
+    return TallyResult(totals, top(totals, ballots))
+
+
+@tally_engine("instant_runoff", "ranks", voting_system="ranked_choice")
+def runoff(ballots: Ballots):
+    """Instant-runoff elimination; the winner is credited with every ballot.
+
+    The round-by-round counts are in the result's ``rounds``.
+    """
+    n = ballots.n_candidates
+    winner, rounds = instant_runoff(
+        ballots.rankings, n, with_rounds=True, weights=ballots.counts
+    )
+    totals = np.zeros(n, dtype=np.float64)
+    if winner is not None:
+        totals[winner] = ballots.total
+    return TallyResult(totals, winner, rounds)
+
+
+@tally_engine("borda", "ranks")
+def borda(ballots: Ballots):
+    """n - 1 points for a ballot's first choice, n - 2 for its second, and so on."""
+    rankings = ballots.rankings
+    n = ballots.n_candidates
+    points = (n - 1 - np.arange(rankings.shape[1])) * ballots.counts[:, None]
+    ranked = rankings < n
+    totals = np.bincount(
+        rankings[ranked], weights=points[ranked].astype(np.float64), minlength=n
+    )
+    return TallyResult(totals, top(totals, ballots))
+
+
+def pairwise_preferences(ballots: Ballots):
+    """``(n, n)`` matrix of the number of ballots ranking candidate ``a`` above ``b``.
+
+    Ranked candidates are preferred to unranked ones.
+    """
+    n = ballots.n_candidates
+    keys = np.where(
+        ballots.values == 0, MAX_BALLOT_VALUE + 1, ballots.values.astype(np.int32)
+    )
+    weights = ballots.counts.astype(np.float64)
+    preferences = np.zeros((n, n), dtype=np.float64)
+    block = max(1, PAIRWISE_BLOCK // max(n * n, 1))
+    for start in range(0, len(keys), block):
+        rows = keys[start : start + block]
+        preferences += np.tensordot(
+            weights[start : start + block],
+            rows[:, :, None] < rows[:, None, :],
+            axes=1,
+        )
+    return preferences
+
+
+@tally_engine("copeland", "ranks")
+def copeland(ballots: Ballots):
+    """A point per head-to-head win, half per tie; a Condorcet winner scores n - 1."""
+    preferences = pairwise_preferences(ballots)
+    wins = (preferences > preferences.T).sum(axis=1)
+    ties = (preferences == preferences.T).sum(axis=1) - 1
+    totals = wins + 0.5 * ties
+    return TallyResult(totals, top(totals, ballots))
+
+
+@tally_engine("score", "scores", voting_system="score_voting")
+def score(ballots: Ballots):
+    """The highest total score wins."""
+    totals, averages = score_voting(ballots.values, MAX_SCORE, weights=ballots.counts)
+    return TallyResult(totals, top(totals, ballots), averages=averages)
+
+
+@tally_engine("quadratic", "credits", voting_system="quadratic_voting")
+def quadratic(ballots: Ballots):
+    """The highest sum of square roots of the credits spent wins."""
+    totals = quadratic_voting(
+        ballots.values, ballots.credit_budget, weights=ballots.counts
+    )
+    return TallyResult(totals, top(totals, ballots))
+
+
+def engines_for(kind):
+    return [name for name, engine in TALLY_ENGINES.items() if engine.kind == kind]
+
+
+def engine_for(voting_system):
+    """The engine registered as ``voting_system``'s own tally."""
+    for engine in TALLY_ENGINES.values():
+        if engine.voting_system == voting_system:
+            return engine
+    raise ValueError(f"Invalid voting system {voting_system!r}")
+
+
+def rounds_by_candidate(rounds, candidate_ids):
+    """Translate ``instant_runoff`` rounds from candidate indices to ids.
+
+    Ballots exhausted by a round's elimination move from ``transfers`` to
+    ``transfers_exhausted``.
+    """
+    exhausted = len(candidate_ids)
+    return [
+        {
+            "round": number,
+            "counts": {candidate_ids[i]: votes for i, votes in round["counts"].items()},
+            "exhausted": round["exhausted"],
+            "eliminated": (
+                None
+                if round["eliminated"] is None
+                else candidate_ids[round["eliminated"]]
+            ),
+            "transfers": {
+                candidate_ids[i]: votes
+                for i, votes in round["transfers"].items()
+                if i != exhausted
+            },
+            "transfers_exhausted": round["transfers"].get(exhausted, 0),
+        }
+        for number, round in enumerate(rounds, start=1)
+    ]
+
+
+def by_candidate(values, ballots: Ballots):
+    return dict(zip(ballots.candidate_ids, np.asarray(values, np.float64).tolist()))
+
+
+def run_engine(name, ballots: Ballots):
+    """Run one engine, with results keyed and the winner given by candidate id.
+
+    Raises ``KeyError`` for an unknown engine and ``ValueError`` for one that
+    cannot read these ballots.
+    """
+    engine = TALLY_ENGINES[name]
+    if engine.kind != ballots.kind:
+        raise ValueError(f"{name} tallies {engine.kind}, not {ballots.kind}")
+    totals, winner, rounds, averages = engine.tally(ballots)
+    return TallyResult(
+        by_candidate(totals, ballots),
+        None if winner is None else ballots.candidate_ids[winner],
+        None if rounds is None else rounds_by_candidate(rounds, ballots.candidate_ids),
+        None if averages is None else by_candidate(averages, ballots),
+    )
+
+
+def compare(ballots: Ballots, names=None):
+    """Run several engines over one load of the ballots.
+
+    ``names`` defaults to every engine for the ballots' kind. Returns
+    ``{name: TallyResult}`` as ``run_engine`` gives them.
+    """
+    names = engines_for(ballots.kind) if names is None else names
+    return {name: run_engine(name, ballots) for name in names}
+
+
+def tally_election(election: Election, db: Session):
+    """Tally all of an election's ballots with its voting system's engine.
+
+    Returns a TallyResult by candidate id; ``rounds`` is None for voting
+    systems without rounds. Raises ``ValueError`` for an unknown voting system.
+    """
+    started = time.perf_counter()
+    engine_for(election.voting_system)
+    return tally_ballots(election, Ballots.load(election, db), started)
+
+
+def tally_ballots(election: Election, ballots: Ballots, started):
+    """The CPU half of ``tally_election``, for ballots loaded since ``started``."""
+    result = run_engine(engine_for(election.voting_system).name, ballots)
+    record_tally(election.voting_system, ballots.total, started)
+    return result
@@ -0,0 +1,286 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import (
+    AlternativeVote,
+    Candidate,
+    Election,
+    ElectionWinner,
+    SessionLocal,
+    Vote,
+)
+from .cache import SingleFlight
+from .metrics import elections_finalized
+from .engines import TallyResult, tally_election
+
+logger = logging.getLogger(__name__)
+
+# Set FINALIZER_ENABLED=false to leave finalization to the first results request
+FINALIZER_ENABLED = os.getenv("FINALIZER_ENABLED", "true").lower() == "true"
+
+# Finalizations running in this process, by election id
+_finalizing = SingleFlight()
+
+
+def finalize_election(election_id: int, db: Session, trigger="scheduler"):
+    """Tally a closed election and store its final results.
+
+    Per-candidate totals go to ``Candidate.votes``, the winner (``winner_id``
+    None for a draw) and any instant-runoff rounds to ``ElectionWinner``, and
+    ``Election.finalized_at`` is set, all in one commit. Does nothing for an
+    election that is missing or already final.
+
+    Concurrent calls for one election in this process share a single tally:
+    later callers wait for the first and get its return value, which is
+    whether the election was finalized by that call.
+    """
+    return _finalizing.do(
+        election_id, lambda: _finalize_election(election_id, db, trigger)
+    )
+
+
+def _finalize_election(election_id: int, db: Session, trigger):
+    election = db.get(Election, election_id)
+    if election is None or election.finalized_at is not None:
+        return False
+    candidate_ids = [
+        candidate_id
+        for (candidate_id,) in db.query(Candidate.id).filter(
+            Candidate.election_id == election_id
+        )
+    ]
+    ballots = ballot_count(election_id, db)
+    result = tally_election(election, db) if candidate_ids else TallyResult({}, None)
+    # End the read transaction: the tally can take long, and SQLite cannot
+    # turn a read snapshot into a write once another connection has written
+    db.rollback()
+
+    # Claim the election; a finalizer in another process may have won
+    claimed = (
+        db.query(Election)
+        .filter(Election.id == election_id, Election.finalized_at.is_(None))
+        .update(
+            {Election.finalized_at: datetime.now(timezone.utc)},
+            synchronize_session=False,
+        )
+    )
+    if not claimed:
+        db.rollback()
+        return False
+    # Ballots committed since the tally read them count too. From the claim
+    # on write_votes refuses new ones, so a second tally is complete
+    if candidate_ids and ballot_count(election_id, db) != ballots:
+        logger.info("Election #%s: ballots arrived mid-tally, recounting", election_id)
+        result = tally_election(election, db)
+    if candidate_ids:
+        totals = {
+            candidate_id: result.totals.get(candidate_id, 0.0)
+            for candidate_id in candidate_ids
+        }
+        db.execute(
+            update(Candidate),
+            [
+                {"id": candidate_id, "votes": votes}
+                for candidate_id, votes in totals.items()
+            ],
+        )
+        top = max(totals.values())
+        winners = [candidate_id for candidate_id, votes in totals.items() if votes == top]
+        db.add(
+            ElectionWinner(
+                election_id=election_id,
+                winner_id=winners[0] if len(winners) == 1 else None,
+                votes=top,
+                rounds=None if result.rounds is None else json.dumps(result.rounds),
+            )
+        )
+    try:
+        db.commit()
+    except IntegrityError:
+        # A winner row already exists (unique per election), so it is final
+        db.rollback()
+        return False
+    elections_finalized.labels(trigger).inc()
+    logger.info("Election #%s finalized (%s)", election_id, trigger)
+    return True
+
+
+def ballot_count(election_id: int, db: Session):
+    return sum(
+        db.query(func.count(model.id)).filter(model.election_id == election_id).scalar()
+        for model in (Vote, AlternativeVote)
+    )
+
+
+def utc_timestamp(end_time: datetime):
+    # Stored end times are naive UTC
+    if end_time.tzinfo is None:
+        end_time = end_time.replace(tzinfo=timezone.utc)
+    return end_time.timestamp()
+
+
+class FinalizerScheduler:
+    """Finalize elections in the background as their end times pass.
+
+    Upcoming end times are kept in a heap, filled from the database on start
+    and every ``resync_interval`` seconds (which also picks up elections
+    created by other processes and retries failed ones) and by ``schedule``
+    for new elections. ``grace`` seconds after an end time the election is
+    handed to a pool of ``workers`` threads that run ``finalize_election``,
+    the grace letting ballots accepted just before the end commit first.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        workers=2,
+        grace=2.0,
+        resync_interval=60.0,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.grace = grace
+        self.resync_interval = resync_interval
+        self._heap = []
+        # election id -> scheduled end timestamp; superseded heap entries are skipped
+        self._scheduled = {}
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._pool = None
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            workers=int(os.getenv("FINALIZER_WORKERS", "2")),
+            grace=float(os.getenv("FINALIZER_GRACE_SECONDS", "2")),
+            resync_interval=float(os.getenv("FINALIZER_RESYNC_SECONDS", "60")),
+            **kwargs,
+        )
+
+    def start(self):
+        self._stopping = False
+        self._resync()
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="finalizer"
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="finalizer-scheduler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def schedule(self, election_id: int, end_time: datetime | None):
+        """Finalize ``election_id`` once ``end_time`` has passed."""
+        if end_time is None:
+            return
+        due = utc_timestamp(end_time)
+        with self._condition:
+            if self._scheduled.get(election_id) == due:
+                return
+            self._scheduled[election_id] = due
+            heapq.heappush(self._heap, (due, election_id))
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return dict(self._scheduled)
+
+    def resync(self):
+        with self.session_factory() as db:
+            elections = (
+                db.query(Election.id, Election.end_time)
+                .filter(Election.finalized_at.is_(None), Election.end_time.is_not(None))
+                .all()
+            )
+        for election_id, end_time in elections:
+            self.schedule(election_id, end_time)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        # Let finalizations already running commit
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+
+    def _resync(self):
+        try:
+            self.resync()
+        except Exception:
+            logger.exception("Finalizer could not load pending elections")
+        return time.monotonic() + self.resync_interval
+
+    def _run(self):
+        next_resync = time.monotonic() + self.resync_interval
+        while True:
+            if time.monotonic() >= next_resync:
+                next_resync = self._resync()
+            with self._condition:
+                due = []
+                while self._heap and self._heap[0][0] + self.grace <= time.time():
+                    end, election_id = heapq.heappop(self._heap)
+                    if self._scheduled.get(election_id) == end:
+                        due.append(election_id)
+                if not due and not self._stopping:
+                    timeout = next_resync - time.monotonic()
+                    if self._heap:
+                        timeout = min(
+                            timeout, self._heap[0][0] + self.grace - time.time()
+                        )
+                    self._condition.wait(max(timeout, 0))
+                if self._stopping:
+                    return
+            for election_id in due:
+                self._pool.submit(self._finalize, election_id)
+
+    def _finalize(self, election_id):
+        try:
+            with self.session_factory() as db:
+                finalize_election(election_id, db)
+        except Exception:
+            logger.exception("Finalizing election #%s failed", election_id)
+        # Done either way; a failed election is picked up again by the next resync
+        with self._condition:
+            self._scheduled.pop(election_id, None)
+
+
+_finalizer = None
+_finalizer_lock = threading.Lock()
+
+
+def get_finalizer():
+    """Return the process-wide finalizer, starting it on first use."""
+    global _finalizer
+    with _finalizer_lock:
+        if _finalizer is None:
+            _finalizer = FinalizerScheduler.from_env().start()
+        return _finalizer
+
+
+def schedule_finalization(election_id: int, end_time: datetime | None):
+    """Tell the running finalizer, if any, about a new election's end time."""
+    with _finalizer_lock:
+        finalizer = _finalizer
+    if finalizer is not None:
+        finalizer.schedule(election_id, end_time)
+
+
+def stop_finalizer():
+    global _finalizer
+    with _finalizer_lock:
+        if _finalizer is not None:
+            _finalizer.stop()
+            _finalizer = None
@@ -0,0 +1,309 @@
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import Future
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from .models import AuthorizationToken, Election, Vote, AlternativeVote, SessionLocal
+from .cache import ballot_versions, token_index
+from .ballots import add_ballot_patterns
+from .vote_calculation import increment_tally
+
+logger = logging.getLogger(__name__)
+
+# Set VOTE_GROUP_COMMIT=true to commit ballots in groups, see GroupCommitWriter
+GROUP_COMMIT = os.getenv("VOTE_GROUP_COMMIT", "false").lower() == "true"
+
+# Tokens deleted per statement, well under SQLite's bound parameter limit
+TOKEN_BATCH_SIZE = 500
+
+# Ballot imports are validated and committed this many lines at a time
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# A validated ballot waiting to be stored. Traditional votes carry
+# candidate_id, alternative ballots vote_string and packed_vote.
+# tally_candidate_id is the live counter to increment, if any.
+PendingVote = namedtuple(
+    "PendingVote",
+    [
+        "election_id",
+        "voting_system",
+        "validation_token",
+        "candidate_id",
+        "vote_string",
+        "packed_vote",
+        "tally_candidate_id",
+    ],
+)
+
+
+class ElectionClosed(Exception):
+    """Raised by ``write_votes`` for ballots of an election already finalized."""
+
+
+def consume_tokens(election_id, tokens, db: Session):
+    """Delete ``tokens`` of one election and return the set actually deleted."""
+    table = AuthorizationToken.__table__
+    tokens = list(dict.fromkeys(tokens))
+    consumed = set()
+    for start in range(0, len(tokens), TOKEN_BATCH_SIZE):
+        consumed.update(
+            db.scalars(
+                delete(table)
+                .where(
+                    (table.c.election_id == election_id)
+                    & table.c.auth_token.in_(tokens[start : start + TOKEN_BATCH_SIZE])
+                )
+                .returning(table.c.auth_token)
+            )
+        )
+    return consumed
+
+
+def write_votes(pending_votes, db: Session):
+    """Consume each ballot's token and store the ballots whose token was valid.
+
+    Tokens are deleted with one ``DELETE ... RETURNING`` per election (and
+    per ``TOKEN_BATCH_SIZE`` tokens); a token repeated within the batch is
+    only accepted for its first ballot. Accepted ballots are inserted with one
+    executemany per table, alternative ballots counted into their election's
+    ballot patterns and live counters incremented per candidate.
+    Does not commit.
+
+    Returns one bool per ballot, ``False`` where the token was invalid.
+    Raises ``ElectionClosed`` if any of the elections has been finalized,
+    leaving the caller to roll back: its results no longer count new ballots.
+    """
+    tokens = defaultdict(list)
+    for pending in pending_votes:
+        tokens[pending.election_id].append(pending.validation_token)
+    consumed = {
+        election_id: consume_tokens(election_id, election_tokens, db)
+        for election_id, election_tokens in tokens.items()
+    }
+    # Checked once the token deletes have opened the write transaction, so a
+    # finalizer cannot claim the election between this check and the commit
+    # (on SQLite writers are serialized; elsewhere FOR SHARE waits for a claim)
+    finalized = db.scalars(
+        select(Election.id)
+        .where(Election.id.in_(list(tokens)), Election.finalized_at.is_not(None))
+        .with_for_update(read=True)
+    ).first()
+    if finalized is not None:
+        raise ElectionClosed(f"Election #{finalized} has been finalized")
+
+    accepted = []
+    votes, alternative_votes, tallies, patterns = [], [], Counter(), Counter()
+    for pending in pending_votes:
+        valid = consumed[pending.election_id]
+        stored = pending.validation_token in valid
+        valid.discard(pending.validation_token)
+        accepted.append(stored)
+        if not stored:
+            continue
+        if pending.candidate_id is not None:
+            votes.append(
+                {
+                    "validation_token": pending.validation_token,
+                    "election_id": pending.election_id,
+                    "candidate_id": pending.candidate_id,
+                }
+            )
+        else:
+            alternative_votes.append(
+                {
+                    "validation_token": pending.validation_token,
+                    "election_id": pending.election_id,
+                    "vote_string": pending.vote_string,
+                    "vote": pending.packed_vote,
+                }
+            )
+            patterns[pending.election_id, pending.packed_vote] += 1
+        if pending.tally_candidate_id is not None:
+            tallies[pending.election_id, pending.tally_candidate_id] += 1
+
+    if votes:
+        db.execute(insert(Vote.__table__), votes)
+    if alternative_votes:
+        db.execute(insert(AlternativeVote.__table__), alternative_votes)
+        add_ballot_patterns(patterns, db)
+    for (election_id, candidate_id), count in tallies.items():
+        increment_tally(election_id, candidate_id, db, votes=float(count))
+    return accepted
+
+
+async def read_lines(chunks):
+    """Split an async stream of byte chunks into ``(line_number, bytes)`` lines.
+
+    Only the current partial line is buffered, so uploads of any size are
+    read in constant memory.
+    """
+    number, buffer = 0, b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            yield number, line
+    if buffer:
+        yield number + 1, buffer
+
+
+def parse_ballot_line(format, line):
+    """Return ``(token, vote)`` from one CSV or NDJSON import line.
+
+    CSV lines are ``token,vote``, the vote being a candidate id or a JSON
+    ballot (quoted as CSV requires); NDJSON lines are objects with ``token``
+    and ``vote`` keys, where the vote may also be the ballot object itself.
+    Returns None for blank lines and the CSV header; raises ValueError for
+    anything else that is not a ballot.
+    """
+    text = line.decode("utf-8").strip()
+    if not text:
+        return None
+    if format == "csv":
+        try:
+            row = next(csv.reader([text]))
+        except csv.Error as e:
+            raise ValueError(str(e))
+        if len(row) != 2:
+            raise ValueError("Expected 2 fields: token,vote")
+        token, vote = (field.strip() for field in row)
+        if (token, vote) == ("token", "vote"):
+            return None
+        return token, vote
+    record = json.loads(text)
+    if not isinstance(record, dict) or "token" not in record or "vote" not in record:
+        raise ValueError('Expected an object with "token" and "vote"')
+    token, vote = record["token"], record["vote"]
+    if not isinstance(token, str):
+        raise ValueError("token must be a string")
+    if isinstance(vote, dict):
+        vote = json.dumps(vote)
+    return token, vote
+
+
+class GroupCommitWriter:
+    """Single writer thread that stores ballots in shared transactions.
+
+    ``submit`` hands a ``PendingVote`` to the writer and returns a Future. The
+    writer collects ballots until ``max_batch`` are waiting or ``interval``
+    seconds have passed since the first, writes them with ``write_votes`` and
+    commits once. Futures resolve only after that commit, to ``True`` for a
+    stored ballot or ``False`` for an invalid token, so a caller that waits
+    for its Future gets the same durability as a per-vote commit. If a group
+    fails, its ballots are written again one per transaction, so an error
+    (such as ``ElectionClosed``) only reaches the Futures of ballots that
+    fail on their own.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_batch=500, interval=0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.interval = interval
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            max_batch=int(os.getenv("VOTE_GROUP_COMMIT_MAX_BATCH", "500")),
+            interval=float(os.getenv("VOTE_GROUP_COMMIT_INTERVAL_MS", "5")) / 1000,
+            **kwargs,
+        )
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="vote-group-commit", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def submit(self, pending: PendingVote) -> Future:
+        future = Future()
+        self.queue.put((pending, future))
+        return future
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            stopping = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        pending_votes = [pending for pending, _ in batch]
+        try:
+            with self.session_factory() as db:
+                accepted = write_votes(pending_votes, db)
+                db.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                # Write the ballots one at a time, so only those at fault fail
+                logger.warning(
+                    "Group commit of %d ballots failed (%r), retrying them singly",
+                    len(batch),
+                    e,
+                )
+                for item in batch:
+                    self._flush([item])
+                return
+            if not isinstance(e, ElectionClosed):
+                logger.exception("Storing a ballot failed")
+            batch[0][1].set_exception(e)
+            return
+        for election_id in {pending.election_id for pending in pending_votes}:
+            ballot_versions.bump(election_id)
+        for pending in pending_votes:
+            token_index.consume(pending.election_id, pending.validation_token)
+        for (_, future), stored in zip(batch, accepted):
+            future.set_result(stored)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_vote_writer():
+    """Return the process-wide group commit writer, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = GroupCommitWriter.from_env().start()
+        return _writer
+
+
+def stop_vote_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
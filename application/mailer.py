@@ -0,0 +1,276 @@
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, or_, select, update, func
+from .models import EmailDelivery, SessionLocal
+from .utils import open_smtp_connection, build_email, otp_email
+from .metrics import email_queue_depth
+
+logger = logging.getLogger(__name__)
+
+
+def utc_now():
+    # Stored times are naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class EmailDispatcher:
+    """Background email delivery over a small pool of long-lived SMTP sessions.
+
+    Messages are stored in ``email_deliveries`` and handed to ``workers``
+    threads through a bounded queue. ``enqueue`` never waits for room: what
+    does not fit stays 'queued' in the table, and a worker sweeps it into the
+    queue once the queue runs empty, as ``start`` does for messages left
+    queued by a previous run. A worker claims each message before sending it,
+    so dispatchers in several processes do not send it twice; a claim older
+    than ``claim_timeout`` seconds (a process that died mid-send) lapses.
+
+    Each worker keeps one authenticated connection open and reuses it for
+    every message it sends, reconnecting only after an error. Failed sends
+    are retried with exponential backoff, and every message's outcome is
+    recorded in ``email_deliveries``.
+    """
+
+    def __init__(
+        self,
+        workers=4,
+        queue_size=100_000,
+        max_attempts=3,
+        retry_backoff=1.0,
+        claim_timeout=600.0,
+        session_factory=SessionLocal,
+        connect=open_smtp_connection,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.claim_timeout = claim_timeout
+        self.session_factory = session_factory
+        self.connect = connect
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        # Delivery ids in the queue, and whether the table holds queued
+        # messages that did not fit in it
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._backlog = False
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            workers=int(os.getenv("EMAIL_WORKERS", "4")),
+            queue_size=int(os.getenv("EMAIL_QUEUE_SIZE", "100000")),
+            max_attempts=int(os.getenv("EMAIL_MAX_ATTEMPTS", "3")),
+            retry_backoff=float(os.getenv("EMAIL_RETRY_BACKOFF", "1.0")),
+            **kwargs,
+        )
+
+    def start(self):
+        self._backlog = True
+        self._sweep()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"email-dispatch-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def enqueue(self, election_id, messages):
+        """Queue ``(recipient, subject, body)`` messages for delivery."""
+        messages = list(messages)
+        if not messages:
+            return
+        with self.session_factory() as db:
+            delivery_ids = (
+                db.execute(
+                    insert(EmailDelivery).returning(
+                        EmailDelivery.id, sort_by_parameter_order=True
+                    ),
+                    [
+                        {
+                            "election_id": election_id,
+                            "recipient": recipient,
+                            "subject": subject,
+                            "body": body,
+                        }
+                        for recipient, subject, body in messages
+                    ],
+                )
+                .scalars()
+                .all()
+            )
+            db.commit()
+        self._put(
+            (delivery_id, *message)
+            for delivery_id, message in zip(delivery_ids, messages)
+        )
+
+    def enqueue_otps(self, election_id, election_title, email_otp_mapping):
+        self.enqueue(
+            election_id,
+            (
+                (email, *otp_email(election_id, election_title, otp))
+                for email, otp in email_otp_mapping.items()
+            ),
+        )
+
+    def join(self):
+        """Block until every queued message has been delivered or given up on."""
+        self.queue.join()
+
+    def _put(self, jobs):
+        # Queue what fits without waiting; the rest is left to _sweep
+        with self._lock:
+            for job in jobs:
+                if job[0] in self._queued:
+                    continue
+                try:
+                    self.queue.put_nowait(job)
+                except queue.Full:
+                    self._backlog = True
+                    return
+                self._queued.add(job[0])
+
+    def _claimable(self):
+        return (
+            EmailDelivery.status == "queued",
+            or_(
+                EmailDelivery.claimed_at.is_(None),
+                EmailDelivery.claimed_at
+                < utc_now() - timedelta(seconds=self.claim_timeout),
+            ),
+        )
+
+    def _sweep(self):
+        """Queue messages left 'queued' in the table, as many as fit."""
+        with self._lock:
+            room = (
+                self.queue.maxsize - self.queue.qsize() if self.queue.maxsize else None
+            )
+            if not self._backlog or room == 0:
+                return
+            with self.session_factory() as db:
+                rows = db.execute(
+                    select(
+                        EmailDelivery.id,
+                        EmailDelivery.recipient,
+                        EmailDelivery.subject,
+                        EmailDelivery.body,
+                    )
+                    .where(*self._claimable(), EmailDelivery.body.is_not(None))
+                    .order_by(EmailDelivery.id)
+                    .limit(None if room is None else room + len(self._queued))
+                ).all()
+            jobs = [tuple(row) for row in rows if row.id not in self._queued]
+            self._backlog = room is not None and len(jobs) >= room
+        self._put(jobs)
+
+    def _claim(self, delivery_id):
+        with self.session_factory() as db:
+            claimed = db.execute(
+                update(EmailDelivery)
+                .where(EmailDelivery.id == delivery_id, *self._claimable())
+                .values(claimed_at=utc_now())
+            ).rowcount
+            db.commit()
+        return claimed == 1
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        server = None
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    break
+                if self._claim(job[0]):
+                    server = self._deliver(server, *job)
+            except Exception:
+                logger.exception("Email dispatch worker error")
+            finally:
+                if job is not None:
+                    with self._lock:
+                        self._queued.discard(job[0])
+                    # Refill before task_done so join() cannot return early
+                    if self._backlog and self.queue.empty():
+                        self._sweep()
+                self.queue.task_done()
+        self._disconnect(server)
+
+    def _deliver(self, server, delivery_id, recipient, subject, body):
+        msg = build_email(recipient, subject, body)
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if server is None:
+                    server = self.connect()
+                server.sendmail(msg["From"], recipient, msg.as_string())
+                self._record(delivery_id, "sent", attempt)
+                return server
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+                server = self._disconnect(server)
+                if attempt < self.max_attempts:
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+        logger.warning("Giving up on email to %s: %s", recipient, error)
+        self._record(delivery_id, "failed", self.max_attempts, str(error))
+        return server
+
+    def _disconnect(self, server):
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+    def _record(self, delivery_id, status, attempts, error=None):
+        with self.session_factory() as db:
+            db.execute(
+                update(EmailDelivery)
+                .where(EmailDelivery.id == delivery_id)
+                .values(
+                    status=status,
+                    attempts=attempts,
+                    last_error=error,
+                    updated_at=func.now(),
+                    # The message holds an OTP; keep it no longer than needed
+                    body=None,
+                )
+            )
+            db.commit()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+email_queue_depth.set_function(
+    lambda: _dispatcher.queue.qsize() if _dispatcher is not None else 0
+)
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher, starting it on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EmailDispatcher.from_env().start()
+        return _dispatcher
+
+
+def stop_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.stop()
+            _dispatcher = None
@@ -0,0 +1,47 @@
+import argparse
+from .models import Election, SessionLocal, engine
+from .migrations import upgrade
+from .vote_calculation import rebuild_tally_counters
+
+
+def rebuild_tallies(args):
+    db = SessionLocal()
+    try:
+        if args.election_id is not None:
+            election_ids = [args.election_id]
+        else:
+            election_ids = [election_id for (election_id,) in db.query(Election.id)]
+        for election_id in election_ids:
+            candidate_votes = rebuild_tally_counters(election_id, db)
+            if candidate_votes is None:
+                print(f"Election #{election_id} not found")
+            else:
+                print(f"Election #{election_id}: {candidate_votes}")
+    finally:
+        db.close()
+
+
+def migrate(args):
+    upgrade(engine)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Election maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser(
+        "rebuild-tallies", help="Recompute live tally counters from raw ballots"
+    )
+    rebuild.add_argument("--election-id", type=int, default=None)
+    rebuild.set_defaults(handler=rebuild_tallies)
+
+    commands.add_parser(
+        "migrate", help="Apply pending schema and data migrations"
+    ).set_defaults(handler=migrate)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
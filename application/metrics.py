@@ -0,0 +1,256 @@
+import math
+import threading
+import time
+from sqlalchemy import event
+
+# Prometheus text exposition (format 0.0.4) for the handful of metric types
+# the app needs. Updates take one lock per labelled series; rendering only
+# happens when /metrics is scraped.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._function = None
+        registry.register(self)
+
+    def labels(self, *values):
+        """Return the series for ``values``, one per label name, creating it on first use."""
+        values = tuple(str(value) for value in values)
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from ``function`` at scrape time."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        return [
+            line
+            for values, child in series
+            for line in child.samples(self.name, self.labelnames, values)
+        ]
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = float(value)
+
+    def samples(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_series(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _Buckets:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.bounds, counts):
+            cumulative += bucket_count
+            labels = _format_labels(labelnames, values, [("le", _format_value(bound))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, values, [("le", "+Inf")])
+        lines.append(f"{name}_bucket{labels} {count}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, **kwargs)
+
+    def _new_series(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route"]
+)
+votes_accepted = Counter(
+    "votes_accepted_total", "Ballots stored, by voting system", ["voting_system"]
+)
+votes_rejected = Counter("votes_rejected_total", "Ballots refused, by reason", ["reason"])
+tally_duration = Histogram(
+    "tally_duration_seconds",
+    "Time to tally an election, by voting system and ballot count (order of magnitude)",
+    ["voting_system", "ballots"],
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Database statement latency, by statement type",
+    ["statement"],
+    buckets=QUERY_BUCKETS,
+)
+db_query_errors = Counter(
+    "db_query_errors_total", "Database statements that raised, by statement type", ["statement"]
+)
+elections_finalized = Counter(
+    "elections_finalized_total",
+    "Elections whose final results were stored, by what triggered it",
+    ["trigger"],
+)
+email_queue_depth = Gauge("email_queue_depth", "OTP emails waiting for a mailer worker")
+token_index_hits = Counter(
+    "token_index_hits_total", "Vote tokens the in-memory index could not rule out"
+)
+token_index_misses = Counter(
+    "token_index_misses_total", "Vote tokens refused by the in-memory index"
+)
+
+
+def ballots_bucket(ballots):
+    """Label ballot counts by order of magnitude: 0, 1e1, 1e2, ..."""
+    if ballots <= 1:
+        return str(int(ballots))
+    return f"1e{math.ceil(math.log10(ballots))}"
+
+
+def record_tally(voting_system, ballots, started):
+    """Observe a tally that began at ``time.perf_counter()`` value ``started``."""
+    tally_duration.labels(voting_system, ballots_bucket(ballots)).observe(
+        time.perf_counter() - started
+    )
+
+
+def _statement_type(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+
+
+def instrument_engine(engine):
+    """Time every statement ``engine`` (a sync Engine) sends to the database."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration.labels(_statement_type(statement)).observe(
+            time.perf_counter() - started
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            started.pop()
+        db_query_errors.labels(_statement_type(context.statement or "")).inc()
+
+    return engine
@@ -0,0 +1,318 @@
+import json
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import inspect, text, update
+from sqlalchemy.orm import Session
+from .models import (
+    Base,
+    Election,
+    Candidate,
+    Vote,
+    AlternativeVote,
+    AuthorizationToken,
+    EmailDelivery,
+    ElectionWinner,
+    BallotPattern,
+)
+from .ballots import candidate_ordinals, encode_ballot, rebuild_ballot_patterns
+from .vote_calculation import rebuild_tally_counters
+
+logger = logging.getLogger(__name__)
+
+# Ordered (name, function) pairs. Each function receives a Session inside an
+# open transaction and must be safe to run against a freshly created schema,
+# since upgrade creates missing tables from the models first.
+MIGRATIONS = []
+
+BATCH_SIZE = 10_000
+
+
+def migration(fn):
+    MIGRATIONS.append((fn.__name__, fn))
+    return fn
+
+
+def set_aside_ballots(unreadable, db: Session):
+    """Move ``[{"id": ..., "error": ...}]`` ballots to unreadable_ballots."""
+    db.execute(
+        text(
+            "INSERT INTO unreadable_ballots "
+            "(id, election_id, validation_token, vote_string, error) "
+            "SELECT id, election_id, validation_token, vote_string, :error "
+            "FROM alternative_votes WHERE id = :id"
+        ),
+        unreadable,
+    )
+    db.execute(text("DELETE FROM alternative_votes WHERE id = :id"), unreadable)
+
+
+@migration
+def pack_alternative_ballots(db: Session):
+    """Re-encode JSON ballots in alternative_votes.vote as packed uint16 values.
+
+    Ballots that cannot be packed (not a JSON object, a rank that is not an
+    integer from 0 to 65535, a candidate no longer in the election) would
+    break every tally; they are logged and moved to unreadable_ballots.
+    """
+    db.execute(text("DROP INDEX IF EXISTS ix_alternative_votes_vote"))
+    db.execute(text("DROP INDEX IF EXISTS ix_alternative_votes_vote_string"))
+    db.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS unreadable_ballots "
+            "(id INTEGER PRIMARY KEY, election_id INTEGER, validation_token VARCHAR, "
+            "vote_string VARCHAR, error VARCHAR)"
+        )
+    )
+
+    election_ids = (
+        db.query(Election.id).filter(Election.voting_system != "traditional").all()
+    )
+    for (election_id,) in election_ids:
+        ordinals = candidate_ordinals(election_id, db)
+        last_id, packed = 0, 0
+        while rows := (
+            db.query(AlternativeVote.id, AlternativeVote.vote_string)
+            .filter(
+                AlternativeVote.election_id == election_id,
+                AlternativeVote.id > last_id,
+            )
+            .order_by(AlternativeVote.id)
+            .limit(BATCH_SIZE)
+            .all()
+        ):
+            packed_rows, unreadable = [], []
+            for vote_id, vote_string in rows:
+                try:
+                    vote = encode_ballot(json.loads(vote_string), ordinals)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    logger.warning(
+                        "Election #%s: setting aside unreadable ballot #%s: %r",
+                        election_id,
+                        vote_id,
+                        e,
+                    )
+                    unreadable.append({"id": vote_id, "error": repr(e)})
+                else:
+                    packed_rows.append({"id": vote_id, "vote": vote})
+            if packed_rows:
+                db.execute(update(AlternativeVote), packed_rows)
+            if unreadable:
+                set_aside_ballots(unreadable, db)
+            last_id, packed = rows[-1][0], packed + len(packed_rows)
+        if packed:
+            logger.info("Election #%s: packed %d ballots", election_id, packed)
+
+
+@migration
+def add_election_credit_budget(db: Session):
+    """Add the per-election quadratic voting credit budget."""
+    columns = {column["name"] for column in inspect(db.connection()).get_columns("elections")}
+    if "credit_budget" not in columns:
+        db.execute(
+            text(
+                "ALTER TABLE elections ADD COLUMN credit_budget INTEGER NOT NULL DEFAULT 100"
+            )
+        )
+
+
+# Indexes of the original models that no current query uses, or that a
+# composite index in index_hot_queries replaces
+OBSOLETE_INDEXES = [
+    "ix_elections_id",
+    "ix_elections_title",
+    "ix_candidates_id",
+    "ix_candidates_name",
+    "ix_votes_id",
+    "ix_votes_validation_token",
+    "ix_alternative_votes_id",
+    "ix_alternative_votes_validation_token",
+    "ix_authorization_tokens_id",
+    "ix_authorization_tokens_auth_token",
+    "ix_email_deliveries_id",
+    "ix_email_deliveries_election_id",
+    "ix_election_winners_id",
+]
+
+
+def set_aside_duplicates(index, db: Session):
+    """Move rows that would break a unique index to ``<table>_duplicates``.
+
+    The lowest id of each key is kept. The original voting flow checked a
+    token before inserting its vote, so concurrent requests could store two.
+    """
+    table = index.table.name
+    columns = [column.name for column in index.columns]
+    duplicates = (
+        f"SELECT id FROM {table} WHERE "
+        + " AND ".join(f"{column} IS NOT NULL" for column in columns)
+        + f" AND id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {', '.join(columns)})"
+    )
+    moved = db.execute(text(f"SELECT COUNT(*) FROM ({duplicates})")).scalar()
+    if not moved:
+        return
+    db.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {table}_duplicates "
+            f"AS SELECT * FROM {table} WHERE 0"
+        )
+    )
+    db.execute(
+        text(
+            f"INSERT INTO {table}_duplicates "
+            f"SELECT * FROM {table} WHERE id IN ({duplicates})"
+        )
+    )
+    db.execute(text(f"DELETE FROM {table} WHERE id IN ({duplicates})"))
+    logger.warning(
+        "Moved %d rows with a duplicate %s to %s_duplicates",
+        moved,
+        ", ".join(columns),
+        table,
+    )
+
+
+@migration
+def index_hot_queries(db: Session):
+    """Swap the original indexes for the ones declared on the models."""
+    for name in OBSOLETE_INDEXES:
+        db.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    # election_winners is indexed by unique_election_winners
+    for model in (
+        Candidate,
+        Vote,
+        AlternativeVote,
+        AuthorizationToken,
+        EmailDelivery,
+    ):
+        for index in model.__table__.indexes:
+            if index.unique:
+                set_aside_duplicates(index, db)
+            index.create(db.connection(), checkfirst=True)
+
+
+@migration
+def add_election_finalized_at(db: Session):
+    """Add the finalization mark; elections that already have a winner are final."""
+    columns = {column["name"] for column in inspect(db.connection()).get_columns("elections")}
+    if "finalized_at" not in columns:
+        db.execute(text("ALTER TABLE elections ADD COLUMN finalized_at DATETIME"))
+    db.execute(
+        text(
+            "UPDATE elections SET finalized_at = CURRENT_TIMESTAMP "
+            "WHERE finalized_at IS NULL "
+            "AND id IN (SELECT election_id FROM election_winners)"
+        )
+    )
+    for index in Election.__table__.indexes:
+        index.create(db.connection(), checkfirst=True)
+
+
+@migration
+def add_election_tokens_issued_at(db: Session):
+    """Add the mark of elections whose voter tokens are all stored."""
+    columns = {column["name"] for column in inspect(db.connection()).get_columns("elections")}
+    if "tokens_issued_at" not in columns:
+        db.execute(text("ALTER TABLE elections ADD COLUMN tokens_issued_at DATETIME"))
+    # Existing elections were created in one request that has long finished
+    db.execute(
+        text(
+            "UPDATE elections SET tokens_issued_at = CURRENT_TIMESTAMP "
+            "WHERE tokens_issued_at IS NULL"
+        )
+    )
+
+
+@migration
+def unique_election_winners(db: Session):
+    """Keep the first winner row of each election and make election_id unique."""
+    db.execute(
+        text(
+            "DELETE FROM election_winners WHERE id NOT IN "
+            "(SELECT MIN(id) FROM election_winners GROUP BY election_id)"
+        )
+    )
+    db.execute(text("DROP INDEX IF EXISTS ix_election_winners_election_id"))
+    for index in ElectionWinner.__table__.indexes:
+        index.create(db.connection(), checkfirst=True)
+
+
+@migration
+def add_election_winner_rounds(db: Session):
+    """Add the stored instant-runoff rounds of ranked choice elections."""
+    columns = {
+        column["name"] for column in inspect(db.connection()).get_columns("election_winners")
+    }
+    if "rounds" not in columns:
+        db.execute(text("ALTER TABLE election_winners ADD COLUMN rounds VARCHAR"))
+
+
+@migration
+def count_ballot_patterns(db: Session):
+    """Fill ballot_patterns from the ballots already cast."""
+    for index in BallotPattern.__table__.indexes:
+        index.create(db.connection(), checkfirst=True)
+    election_ids = (
+        db.query(Election.id).filter(Election.voting_system != "traditional").all()
+    )
+    for (election_id,) in election_ids:
+        rebuild_ballot_patterns(election_id, db)
+
+
+@migration
+def backfill_tally_counters(db: Session):
+    """Fill the live counters of elections still open from their raw ballots."""
+    now = datetime.now(timezone.utc)
+    elections = (
+        db.query(Election.id, Election.end_time)
+        .filter(Election.finalized_at.is_(None))
+        .all()
+    )
+    for election_id, end_time in elections:
+        # Stored end times are naive UTC
+        if end_time is not None and end_time.replace(tzinfo=timezone.utc) <= now:
+            continue
+        rebuild_tally_counters(election_id, db, commit=False)
+
+
+@migration
+def keep_queued_emails(db: Session):
+    """Keep queued messages in email_deliveries so they survive a restart."""
+    columns = {
+        column["name"]
+        for column in inspect(db.connection()).get_columns("email_deliveries")
+    }
+    for name, kind in [
+        ("subject", "VARCHAR"),
+        ("body", "VARCHAR"),
+        ("claimed_at", "DATETIME"),
+    ]:
+        if name not in columns:
+            db.execute(text(f"ALTER TABLE email_deliveries ADD COLUMN {name} {kind}"))
+    for index in EmailDelivery.__table__.indexes:
+        index.create(db.connection(), checkfirst=True)
+
+
+def upgrade(engine):
+    """Create missing tables, then apply every migration not yet in ``schema_migrations``."""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations "
+                "(name VARCHAR PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+            )
+        )
+        applied = {
+            name for (name,) in connection.execute(text("SELECT name FROM schema_migrations"))
+        }
+
+    for name, fn in MIGRATIONS:
+        if name in applied:
+            continue
+        with Session(bind=engine) as db, db.begin():
+            fn(db)
+            db.execute(
+                text("INSERT INTO schema_migrations (name) VALUES (:name)"),
+                {"name": name},
+            )
+        logger.info("Applied migration %s", name)
@@ -9,7 +9,10 @@ from sqlalchemy import (
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     create_engine,
+    event,
+    func,
 )
 from sqlalchemy.orm import relationship, sessionmaker, declarative_base
 from datetime import datetime
@@ -17,17 +20,61 @@ from datetime import datetime
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./elections.db")
+
+
+def apply_sqlite_pragmas(engine):
+    """Tune every new SQLite connection of ``engine`` from the SQLITE_* env vars.
+
+    Defaults: WAL journal, synchronous=NORMAL (durable at checkpoints, safe
+    against corruption in WAL mode), a 5s busy timeout instead of immediate
+    "database is locked" errors, a 64MB page cache and 256MB of mmap.
+    """
+    pragmas = {
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    }
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def pool_options():
+    """Connection pool settings for server databases from the DB_POOL_* env vars."""
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+
+def make_engine(url=DATABASE_URL):
+    """Create the engine for ``url`` with settings suited to its backend."""
+    if url.startswith("sqlite"):
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        return apply_sqlite_pragmas(engine)
+    return create_engine(url, **pool_options())
+
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
 class Election(Base):
     __tablename__ = "elections"
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
     voting_system = Column(
         Enum(
             "traditional",
@@ -39,54 +86,146 @@ class Election(Base):
         default="traditional",
     )
     end_time = Column(DateTime, nullable=True)
+    # Voice credits each voter may spend in a quadratic_voting election
+    credit_budget = Column(Integer, default=100, nullable=False)
+    # Set once the final tally is stored in Candidate.votes and ElectionWinner
+    finalized_at = Column(DateTime, nullable=True)
+    # Set once every voter token is stored; until then tokens may still arrive
+    tokens_issued_at = Column(DateTime, nullable=True)
     candidates = relationship("Candidate", back_populates="election")
+    # The finalizer's scan for elections still to be closed
+    __table_args__ = (
+        Index("ix_elections_finalized_at_end_time", "finalized_at", "end_time"),
+    )
 
 
 class Candidate(Base):
     __tablename__ = "candidates"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    election_id = Column(Integer, ForeignKey("elections.id"))
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    election_id = Column(Integer, ForeignKey("elections.id"), index=True)
     votes = Column(Float, default=0, nullable=False)
     election = relationship("Election", back_populates="candidates")
 
 
 class Vote(Base):
     __tablename__ = "votes"
-    id = Column(Integer, primary_key=True, index=True)
-    validation_token = Column(String, index=True, nullable=False)
-    election_id = Column(Integer, ForeignKey("elections.id"))
+    id = Column(Integer, primary_key=True)
+    validation_token = Column(String, nullable=False)
+    # Indexed alone for ballot export in id order, with candidate_id for counting
+    election_id = Column(Integer, ForeignKey("elections.id"), index=True)
     candidate_id = Column(Integer, ForeignKey("candidates.id"))
     election = relationship("Election")
     candidate = relationship("Candidate")
+    __table_args__ = (
+        Index("ix_votes_election_id_candidate_id", "election_id", "candidate_id"),
+        Index(
+            "uq_votes_election_id_validation_token",
+            "election_id",
+            "validation_token",
+            unique=True,
+        ),
+    )
 
 
 class AlternativeVote(Base):
     __tablename__ = "alternative_votes"
-    id = Column(Integer, primary_key=True, index=True)
-    validation_token = Column(String, index=True, nullable=False)
-    election_id = Column(Integer, ForeignKey("elections.id"))
-    vote_string = Column(String, index=True, default="{}")
-    vote = Column(BLOB, index=True, default=b"{}")
+    id = Column(Integer, primary_key=True)
+    validation_token = Column(String, nullable=False)
+    election_id = Column(Integer, ForeignKey("elections.id"), index=True)
+    vote_string = Column(String, default="{}")
+    # Packed ballot, see ballots.encode_ballot
+    vote = Column(BLOB, default=b"")
     election = relationship("Election")
+    __table_args__ = (
+        Index(
+            "uq_alternative_votes_election_id_validation_token",
+            "election_id",
+            "validation_token",
+            unique=True,
+        ),
+    )
+
+
+# Distinct packed ballots of an election and how many of each were cast. Ids
+# follow first arrival, so pattern order keeps the ballot order tie-breaks use.
+class BallotPattern(Base):
+    __tablename__ = "ballot_patterns"
+    id = Column(Integer, primary_key=True)
+    # Indexed alone for loading an election's patterns in id order
+    election_id = Column(Integer, ForeignKey("elections.id"), nullable=False, index=True)
+    pattern = Column(BLOB, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    __table_args__ = (
+        Index(
+            "uq_ballot_patterns_election_id_pattern",
+            "election_id",
+            "pattern",
+            unique=True,
+        ),
+    )
+
+
+class CandidateTally(Base):
+    __tablename__ = "candidate_tallies"
+    election_id = Column(Integer, ForeignKey("elections.id"), primary_key=True)
+    candidate_id = Column(Integer, ForeignKey("candidates.id"), primary_key=True)
+    votes = Column(Float, default=0, nullable=False)
 
 
 class AuthorizationToken(Base):
     __tablename__ = "authorization_tokens"
-    id = Column(Integer, primary_key=True, index=True)
-    auth_token = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    auth_token = Column(String)
     election_id = Column(Integer, ForeignKey("elections.id"))
     election = relationship("Election")
+    # Serves token consumption and, as a covering index, loading an election's tokens
+    __table_args__ = (
+        Index(
+            "uq_authorization_tokens_election_id_auth_token",
+            "election_id",
+            "auth_token",
+            unique=True,
+        ),
+    )
+
+
+class EmailDelivery(Base):
+    __tablename__ = "email_deliveries"
+    id = Column(Integer, primary_key=True)
+    election_id = Column(Integer, ForeignKey("elections.id"))
+    recipient = Column(String, nullable=False)
+    status = Column(
+        Enum("queued", "sent", "failed", name="email_delivery_status"),
+        default="queued",
+        nullable=False,
+    )
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), nullable=False)
+    # The message, kept until it is sent or given up on
+    subject = Column(String, nullable=True)
+    body = Column(String, nullable=True)
+    # When a dispatcher worker took the message to send it
+    claimed_at = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index("ix_email_deliveries_election_id_status", "election_id", "status"),
+        # Serves the dispatcher's sweep of queued messages
+        Index("ix_email_deliveries_status_id", "status", "id"),
+    )
 
 
 class ElectionWinner(Base):
     __tablename__ = "election_winners"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     election_id = Column(Integer, ForeignKey("elections.id"))
     winner_id = Column(Integer, ForeignKey("candidates.id"))
     votes = Column(Float, default=0, nullable=False)
     election = relationship("Election")
     winner = relationship("Candidate")
-
-
-Base.metadata.create_all(bind=engine)
+    # Instant-runoff rounds as JSON, see engines.rounds_by_candidate
+    rounds = Column(String, nullable=True)
+    # One final result per election, however many finalizers race for it
+    __table_args__ = (
+        Index("uq_election_winners_election_id", "election_id", unique=True),
+    )
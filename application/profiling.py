@@ -0,0 +1,332 @@
+import asyncio
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+# Set PROFILE_TOKEN to allow profiling single requests: a request carrying
+# "X-Profile: <PROFILE_TOKEN>" is run under cProfile and its profile kept in
+# PROFILE_DIR (newest PROFILE_MAX_FILES only). Without the token nothing is
+# installed, so requests take exactly the unprofiled path.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILING = bool(PROFILE_TOKEN)
+PROFILE_HEADER = "X-Profile"
+
+PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+# Before Python 3.12 cProfile only sees the thread it is enabled on, so each
+# thread a profiled request runs on gets its own profiler. From 3.12 one
+# profiler sees every thread and a second cannot be enabled while it runs,
+# so the middleware runs a single profiler around the whole request.
+PER_THREAD = sys.version_info < (3, 12)
+
+# One profiled request at a time: profilers would otherwise collide (3.12+)
+# or record each other's work. Requests that are not profiled still run
+# alongside and, from 3.12 on, show up in the profile.
+_profiling_lock = threading.Lock()
+
+
+class RequestProfile:
+    """The profilers of the request being profiled, at most one per thread."""
+
+    def __init__(self):
+        self.profilers = []
+        self._threads = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Enable a profiler on this thread, unless one already runs for the request."""
+        if not PER_THREAD:
+            return None
+        thread = threading.get_ident()
+        with self._lock:
+            if thread in self._threads:
+                return None
+            self._threads.add(thread)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler):
+        if profiler is None:
+            return
+        profiler.disable()
+        with self._lock:
+            self._threads.discard(threading.get_ident())
+            self.profilers.append(profiler)
+
+
+# The RequestProfile of the request being profiled
+_active = ContextVar("active_profile", default=None)
+
+
+def profiled(fn):
+    """Run ``fn`` under cProfile when called while a request is being profiled.
+
+    Before Python 3.12 each piece of request work that runs in its own thread
+    (sync endpoints in the threadpool, ``run_in_threadpool`` calls) is
+    wrapped and profiled where it runs, and the profiles are merged when the
+    request finishes; a thread already profiled for the request is not
+    profiled twice. From 3.12 the request's single profiler covers them and
+    this does nothing. Returns ``fn`` unchanged when profiling is off or
+    ``fn`` is already wrapped.
+    """
+    if not PROFILING or getattr(fn, "__profiled__", False):
+        return fn
+
+    if asyncio.iscoroutinefunction(fn):
+
+        @wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            profile = _active.get()
+            profiler = None if profile is None else profile.start()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profile.stop(profiler)
+
+        async_wrapper.__profiled__ = True
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _active.get()
+        profiler = None if profile is None else profile.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profile.stop(profiler)
+
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose endpoint is wrapped with ``profiled``.
+
+    Including a router builds its routes again from the wrapped endpoints,
+    which ``profiled`` leaves as they are.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+
+route_class = ProfiledRoute if PROFILING else APIRoute
+
+
+class ProfileStore:
+    """Directory of request profiles that keeps only the newest ``max_files``.
+
+    Each profile is a pstats dump ``<id>.prof`` with a ``<id>.json`` sidecar
+    describing the request. Ids start with a nanosecond timestamp, so they
+    sort oldest first.
+    """
+
+    def __init__(self, directory, max_files=50):
+        self.directory = directory
+        self.max_files = max_files
+
+    @staticmethod
+    def new_id():
+        return f"{time.time_ns()}-{secrets.token_hex(4)}"
+
+    def path(self, profile_id, suffix=".prof"):
+        if not PROFILE_ID.match(profile_id):
+            raise KeyError(profile_id)
+        path = os.path.join(self.directory, profile_id + suffix)
+        if not os.path.exists(path):
+            raise KeyError(profile_id)
+        return path
+
+    def save(self, profile_id, profiles, info):
+        if not profiles:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(self.directory, profile_id + ".prof"))
+        with open(os.path.join(self.directory, profile_id + ".json"), "w") as file:
+            json.dump({"id": profile_id, **info}, file)
+        self.prune()
+
+    def ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[: -len(".prof")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".prof") and PROFILE_ID.match(name[: -len(".prof")])
+        )
+
+    def prune(self):
+        ids = self.ids()
+        for profile_id in ids[: max(len(ids) - self.max_files, 0)]:
+            for suffix in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        infos = []
+        for profile_id in reversed(self.ids()):
+            try:
+                with open(self.path(profile_id, ".json")) as file:
+                    infos.append(json.load(file))
+            except (KeyError, OSError, ValueError):
+                infos.append({"id": profile_id})
+        return infos
+
+    def text(self, profile_id, sort="cumulative", limit=50):
+        stream = io.StringIO()
+        pstats.Stats(self.path(profile_id), stream=stream).sort_stats(sort).print_stats(
+            limit
+        )
+        return stream.getvalue()
+
+
+store = ProfileStore(
+    os.getenv("PROFILE_DIR", "./profiles"),
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "50")),
+)
+
+
+def is_admin(token, expected=None):
+    expected = PROFILE_TOKEN if expected is None else expected
+    return bool(expected) and hmac.compare_digest(token or "", expected)
+
+
+class ProfilingMiddleware:
+    """Profile requests that carry the admin profiling header.
+
+    The response gets an ``X-Profile-Id`` header naming the stored profile.
+    """
+
+    def __init__(self, app, token=PROFILE_TOKEN, store=store):
+        self.app = app
+        self.token = token
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = PROFILE_HEADER.lower().encode()
+        token = next(
+            (value.decode() for name, value in scope["headers"] if name == header),
+            None,
+        )
+        if token is None or not is_admin(token, self.token):
+            return await self.app(scope, receive, send)
+        if scope["path"] == "/profiles" or scope["path"].startswith("/profiles/"):
+            # Reading profiles carries the header too; keep those requests out
+            return await self.app(scope, receive, send)
+
+        profile_id = self.store.new_id()
+        profile = RequestProfile()
+        status = None
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-profile-id", profile_id.encode()),
+                    ],
+                }
+            await send(message)
+
+        if not _profiling_lock.acquire(blocking=False):
+            # Wait in a worker thread; the call only returns once the lock is
+            # held, even if the request is cancelled meanwhile
+            await run_in_threadpool(_profiling_lock.acquire)
+        reset = _active.set(profile)
+        started = time.perf_counter()
+        profiler = None
+        try:
+            if not PER_THREAD:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # Another profiling tool owns the interpreter's profiler slot
+                    logger.warning("Cannot profile request: %s", sys.exc_info()[1])
+                    profiler = None
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile.profilers.append(profiler)
+            _active.reset(reset)
+            _profiling_lock.release()
+            self.store.save(
+                profile_id,
+                profile.profilers,
+                {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode(),
+                    "status": status,
+                    "seconds": round(time.perf_counter() - started, 6),
+                    "created": time.time(),
+                },
+            )
+
+
+profiles_router = APIRouter()
+
+
+def require_admin(x_profile: str | None):
+    if not PROFILING:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not is_admin(x_profile):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+@profiles_router.get("/profiles", include_in_schema=False)
+def list_profiles(x_profile: str | None = Header(None)):
+    require_admin(x_profile)
+    return store.list()
+
+
+@profiles_router.get("/profiles/{profile_id}", include_in_schema=False)
+def get_profile(
+    profile_id: str,
+    format: str = Query("text", pattern="^(text|pstats)$"),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|calls)$"),
+    x_profile: str | None = Header(None),
+):
+    """A profile as a pstats summary, or the raw dump with ``format=pstats``."""
+    require_admin(x_profile)
+    try:
+        if format == "pstats":
+            return FileResponse(
+                store.path(profile_id),
+                media_type="application/octet-stream",
+                filename=f"{profile_id}.prof",
+            )
+        return PlainTextResponse(store.text(profile_id, sort))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Profile not found")
@@ -0,0 +1,169 @@
+import numpy as np
+
+
+def rank_matrix(rankings, n_candidates):
+    """Pack ranked ballots into a compact integer matrix.
+
+    ``rankings`` is a sequence of ballots, each a sequence of candidate
+    indices (``0 .. n_candidates - 1``) in preference order. Short ballots
+    are padded with ``n_candidates``, which marks an exhausted choice.
+    """
+    width = max((len(ranking) for ranking in rankings), default=0)
+    dtype = np.int16 if n_candidates < np.iinfo(np.int16).max else np.int32
+    matrix = np.full((len(rankings), width), n_candidates, dtype=dtype)
+    for row, ranking in enumerate(rankings):
+        matrix[row, : len(ranking)] = ranking
+    return matrix
+
+
+def _first_seen(current, tied):
+    # Ballot index at which each tied candidate first appears as a current choice
+    return [np.flatnonzero(current == candidate)[0] for candidate in tied]
+
+
+def _count(choices, weights, minlength):
+    # Ballots per choice; integer weights give integer counts
+    if weights is None:
+        return np.bincount(choices, minlength=minlength)
+    counts = np.bincount(choices, weights=weights, minlength=minlength)
+    if np.issubdtype(weights.dtype, np.integer):
+        return counts.astype(np.int64)
+    return counts
+
+
+def instant_runoff(matrix, n_candidates, with_rounds=False, weights=None):
+    """Run an instant-runoff tally over a rank matrix built by ``rank_matrix``.
+
+    Each round counts the current choice of every ballot, then eliminates the
+    candidate with the fewest votes and advances the pointer of the ballots
+    that were sitting on it to their next continuing choice. Only candidates
+    with at least one first-preference vote take part. Ties, both for the
+    round leader and for elimination, go to the candidate whose vote appears
+    first in ballot order.
+
+    Returns the index of the winning candidate, or ``None`` without ballots.
+    With ``with_rounds`` returns ``(winner, rounds)``, one dict per round:
+    ``counts`` of the continuing candidates, ``exhausted`` ballots with no
+    continuing choice left, the ``eliminated`` candidate (``None`` in the
+    deciding round) and the ``transfers`` of its ballots by next choice, where
+    key ``n_candidates`` counts ballots that ran out of choices.
+
+    ``weights`` is the number of ballots each row stands for, so identical
+    ballots can be tallied once as a pattern; rows must then be in order of
+    their first ballot for ties to break as they would over single ballots.
+    """
+    rounds = []
+
+    def result(winner):
+        return (winner, rounds) if with_rounds else winner
+
+    n_ballots, width = matrix.shape
+    if n_ballots == 0 or width == 0:
+        return result(None)
+
+    pointer = np.zeros(n_ballots, dtype=np.intp)
+    current = matrix[:, 0].astype(np.intp)
+
+    counts = _count(current, weights, n_candidates + 1)
+    # Slot ``n_candidates`` is the exhausted marker and is never continuing
+    continuing = np.zeros(n_candidates + 1, dtype=bool)
+    continuing[:n_candidates] = counts[:n_candidates] > 0
+
+    winner = None
+    while True:
+        remaining = np.flatnonzero(continuing[:n_candidates])
+        if len(remaining) == 0:
+            return result(winner)
+
+        remaining_counts = counts[remaining]
+        if with_rounds:
+            rounds.append(
+                {
+                    "counts": dict(zip(remaining.tolist(), remaining_counts.tolist())),
+                    "exhausted": int(counts[n_candidates]),
+                    "eliminated": None,
+                    "transfers": {},
+                }
+            )
+        leaders = remaining[remaining_counts == remaining_counts.max()]
+        if len(leaders) > 1:
+            leaders = leaders[np.argsort(_first_seen(current, leaders), kind="stable")]
+        winner = int(leaders[0])
+        if len(remaining) <= 2:
+            return result(winner)
+
+        trailing = remaining[remaining_counts == remaining_counts.min()]
+        if len(trailing) > 1:
+            trailing = trailing[
+                np.argsort(_first_seen(current, trailing), kind="stable")
+            ]
+        eliminated = trailing[0]
+        continuing[eliminated] = False
+
+        # Advance the ballots sitting on the eliminated candidate
+        moved = moving = np.flatnonzero(current == eliminated)
+        while len(moving):
+            pointer[moving] += 1
+            exhausted = pointer[moving] >= width
+            current[moving[exhausted]] = n_candidates
+            moving = moving[~exhausted]
+            current[moving] = matrix[moving, pointer[moving]]
+            moving = moving[~continuing[current[moving]]]
+
+        if with_rounds:
+            transfers = _count(
+                current[moved],
+                None if weights is None else weights[moved],
+                n_candidates + 1,
+            )
+            rounds[-1]["eliminated"] = int(eliminated)
+            rounds[-1]["transfers"] = {
+                int(candidate): int(transfers[candidate])
+                for candidate in np.flatnonzero(transfers)
+            }
+        counts = _count(current, weights, n_candidates + 1)
+
+
+def score_voting(scores, max_score=None, weights=None):
+    """Total and average each candidate's score over a ``(ballots, candidates)`` matrix.
+
+    Candidates a ballot left unscored count as 0 towards the average. With
+    ``weights``, each row counts as that many ballots. Raises ``ValueError``
+    if any score is above ``max_score``.
+    """
+    if max_score is not None and scores.size and scores.max() > max_score:
+        raise ValueError(f"Score above the maximum of {max_score}")
+    if weights is None:
+        totals = scores.sum(axis=0, dtype=np.int64).astype(np.float64)
+        n_ballots = len(scores)
+    else:
+        totals = weights.astype(np.float64) @ scores
+        n_ballots = int(weights.sum())
+    if n_ballots == 0:
+        return totals, np.zeros_like(totals)
+    return totals, totals / n_ballots
+
+
+def quadratic_voting(credits, credit_budget=None, weights=None):
+    """Sum the square roots of the credits each ballot spent on each candidate.
+
+    With ``weights``, each row counts as that many ballots. Raises
+    ``ValueError`` if any ballot spent more than ``credit_budget``.
+    """
+    if (
+        credit_budget is not None
+        and credits.size
+        and credits.sum(axis=1, dtype=np.int64).max() > credit_budget
+    ):
+        raise ValueError(f"Ballot spends more than {credit_budget} credits")
+    # Count how often each credit amount was spent on each candidate, then
+    # weight the counts by a square-root table instead of rooting every cell
+    top = int(credits.max()) if credits.size else 0
+    roots = np.sqrt(np.arange(top + 1, dtype=np.float64))
+    return np.array(
+        [
+            np.bincount(column, weights=weights, minlength=top + 1) @ roots
+            for column in credits.T
+        ],
+        dtype=np.float64,
+    )
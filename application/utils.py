@@ -1,9 +1,10 @@
-import random
 import string
 import hashlib
+import secrets
 import smtplib
 import os
 import csv
+import numpy as np
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
@@ -11,35 +12,96 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+OTP_ALPHABET = string.ascii_letters + string.digits
+_OTP_CODES = np.frombuffer(OTP_ALPHABET.encode(), dtype=np.uint8).astype(np.uint32)
+# Random bytes at or above the largest multiple of the alphabet size are
+# redrawn, so that ``byte % len(OTP_ALPHABET)`` picks every character equally
+_OTP_BYTE_LIMIT = 256 - 256 % len(OTP_ALPHABET)
+
+
 def generate_otp(length=21):
-    characters = string.ascii_letters + string.digits
-    otp = "".join(random.choice(characters) for i in range(length))
-    return otp
+    return "".join(secrets.choice(OTP_ALPHABET) for _ in range(length))
+
+
+def random_alphabet_indices(count):
+    """``count`` uniformly random indices into ``OTP_ALPHABET``, from ``os.urandom``."""
+    parts, drawn = [], 0
+    while drawn < count:
+        # Over-draw by the rejection rate so one read is almost always enough
+        size = (count - drawn) * 256 // _OTP_BYTE_LIMIT + 64
+        data = np.frombuffer(os.urandom(size), dtype=np.uint8)
+        data = data[data < _OTP_BYTE_LIMIT]
+        parts.append(data)
+        drawn += len(data)
+    return np.concatenate(parts)[:count] % len(OTP_ALPHABET)
+
+
+def generate_otp_batch(count, length=21):
+    """``count`` OTPs like ``generate_otp``'s, drawn with one ``os.urandom`` read.
+
+    The characters are mapped to code points in one array and viewed as
+    fixed-width strings, so no per-character Python work is done.
+    """
+    if count == 0:
+        return []
+    codes = _OTP_CODES[random_alphabet_indices(count * length)]
+    return codes.view(f"<U{length}").tolist()
 
 
 def create_auth_token(email, otp):
     return hashlib.sha256((email + otp).encode()).hexdigest()
 
 
-def send_email(recipient, subject, body):
+def create_auth_token_batch(emails, otps):
+    sha256 = hashlib.sha256
+    return [
+        sha256((email + otp).encode()).hexdigest() for email, otp in zip(emails, otps)
+    ]
+
+
+def open_smtp_connection():
+    """Open an SMTP session using the configured server and credentials.
+
+    STARTTLS is skipped when ``SMTP_STARTTLS`` is ``false`` and login is
+    skipped without a ``SENDER_PASSWORD``, which allows local test servers.
+    """
     sender_email = os.getenv("SENDER_EMAIL")
     sender_password = os.getenv("SENDER_PASSWORD")
     smtp_server = os.getenv("SMTP_SERVER")
     smtp_port = int(os.getenv("SMTP_PORT"))
 
+    server = smtplib.SMTP(smtp_server, smtp_port, timeout=30)
+    if os.getenv("SMTP_STARTTLS", "true").lower() != "false":
+        server.starttls()
+    if sender_password:
+        server.login(sender_email, sender_password)
+    return server
+
+
+def build_email(recipient, subject, body):
     msg = MIMEMultipart()
-    msg["From"] = sender_email
+    msg["From"] = os.getenv("SENDER_EMAIL")
     msg["To"] = recipient
     msg["Subject"] = subject
 
     msg.attach(MIMEText(body, "plain"))
+    return msg
+
+
+def otp_email(election_id, election_title, otp):
+    return (
+        f"Your OTP for election #{election_id}: {election_title}",
+        f"Election #{election_id}: {election_title}\n OTP: {otp}",
+    )
+
+
+def send_email(recipient, subject, body):
+    msg = build_email(recipient, subject, body)
 
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
+        server = open_smtp_connection()
         text = msg.as_string()
-        server.sendmail(sender_email, recipient, text)
+        server.sendmail(msg["From"], recipient, text)
         server.quit()
         return True
     except Exception as e:
@@ -53,23 +115,22 @@ def handle_otp_storage_and_notification(
     email_otp_mapping,
     send_emails=False,
     write_to_csv=False,
+    dispatcher=None,
 ):
+    """Store OTPs in ``identities.csv`` and/or email them to voters.
+
+    With a ``dispatcher`` (see ``mailer.EmailDispatcher``) emails are queued
+    for background delivery instead of being sent one connection at a time.
+    """
     if write_to_csv:
         with open("identities.csv", mode="a", newline="") as file:
             writer = csv.writer(file)
-            for username, otp in email_otp_mapping.items():
-                writer.writerow([username, otp])
-                if send_emails:
-                    send_email(
-                        username,
-                        f"Your OTP for election #{election_id}: {election_title}",
-                        f"Election #{election_id}: {election_title}\n OTP: {otp}",
-                    )
-    else:
-        for username, otp in email_otp_mapping.items():
-            if send_emails:
-                send_email(
-                    username,
-                    f"Your OTP for election #{election_id}: {election_title}",
-                    f"Election #{election_id}: {election_title}\n OTP: {otp}",
-                )
+            writer.writerows(email_otp_mapping.items())
+
+    if not send_emails:
+        return
+    if dispatcher is not None:
+        dispatcher.enqueue_otps(election_id, election_title, email_otp_mapping)
+        return
+    for username, otp in email_otp_mapping.items():
+        send_email(username, *otp_email(election_id, election_title, otp))
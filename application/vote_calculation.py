@@ -1,214 +1,194 @@
 import logging
 import json
 from datetime import datetime, timezone, UTC as datetime_UTC
-import os
 import ast
-import csv
-import pandas as pd
+from collections import Counter
+import numpy as np
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from .models import Candidate, Vote, AlternativeVote, Election
-
-
-def ranked_choice(vote_format, candidates):  # Change parameter to whatever
+from .models import BallotPattern, Candidate, Vote, Election, CandidateTally
+from .tally import rank_matrix, instant_runoff
+from .ballots import rebuild_ballot_patterns
+from .engines import (
+    BALLOT_KINDS,
+    MAX_SCORE,
+    Ballots,
+    TallyResult,
+    run_engine,
+    tally_election,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _candidate_label(key):
+    # Candidate ids arrive as JSON object keys; keep numeric ids numeric
+    return int(key) if str(key).isdigit() else key
+
+
+def ranked_choice(vote_format, candidates):
+    """Return the instant-runoff winner for a list of JSON ranked ballots.
+
+    Each ballot maps candidate id to rank, e.g. ``'{"3": 1, "1": 2, "2": 3}'``.
+    Identical ballots are parsed once and packed into an in-memory rank
+    matrix of distinct ballots, which ``tally.instant_runoff`` tallies
+    weighted by how often each was cast.
+    """
     if not vote_format:
-        print("No votes provided to ranked_choice function.")
+        logger.debug("No ballots passed to ranked_choice")
         return None
 
-    print(f"Vote format: {vote_format}")
-    print(f"Candidates: {candidates}")
-    vote_list = []
-    for i in range(len(vote_format)):
+    index = {str(candidate): i for i, candidate in enumerate(candidates or [])}
+    labels = list(index)
+    rankings, weights = [], []
+    for ballot, count in Counter(vote_format).items():
         try:
-            vote_dict = ast.literal_eval(vote_format[i])
-            vote_list.append(dict((v, k) for k, v in vote_dict.items()))
-        except Exception as e:
-            print(f"Error parsing vote: {vote_format[i]}, error: {e}")
-            continue
-
-    if not vote_list:
-        print("No valid votes parsed.")
+            vote_dict = json.loads(ballot)
+        except ValueError:
+            try:
+                vote_dict = ast.literal_eval(ballot)
+            except Exception as e:
+                logger.warning("Skipping unparseable ballot %r: %s", ballot, e)
+                continue
+        ranking = []
+        for candidate in sorted(vote_dict, key=vote_dict.get):
+            candidate = str(candidate)
+            if candidate not in index:
+                index[candidate] = len(labels)
+                labels.append(candidate)
+            ranking.append(index[candidate])
+        rankings.append(ranking)
+        weights.append(count)
+
+    if not rankings:
+        logger.warning("None of %d ballots could be parsed", len(vote_format))
         return None
 
-    print(vote_list)
-
-    columns = vote_list[0].keys()
-
-    # Define the candidates
-    eliminated_candidates = []
-
-    # Create vote data (each sublist represents a voter's ranked choices)
-    votes = []
-    num_voters = len(vote_list)
-
-    # Write the data to a CSV file
-    with open("votes.csv", "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(
-            ["voter"] + [f"choice_{i+1}" for i in range(len(columns))]
-        )  # len(columns)
-
-        for i in range(len(vote_list)):  # vote_list
-            # Generate unique candidate choices for each voter
-
-            vote_rec = []
-            vote_rec.append(f"voter{i+1}")
-            for count in range(1, len(columns) + 1):
-                vote_rec.append(vote_list[i][count])
-            writer.writerow(vote_rec)
-
-    # Read the CSV file
-    df = pd.read_csv("votes.csv")
-    df["current_winner"] = df["choice_1"]
-    # Create an array with a list of all the candidates
-    candidates = df["current_winner"].unique()
-    num_candidates = len(df.columns[1:-1].tolist())
-
-    # Display the dataframe
-    # print(df.to_string())
-
-    # Initialize the list of winners
-    winners = []
-    round_number = 1
-
-    def RankedChoiceVotingRound(df, candidates, round_text, num_candidates):
-        # Count the number of first-choice votes for each candidate
-        first_choice_votes = df["current_winner"].value_counts()
-
-        total_votes = first_choice_votes.sum()
-        round_winner_votes = -1
-        round_winner = None
-        # Print the results of the current round
-        # print(f"{round_text}")
-        for candidate, votes in first_choice_votes.items():
-            # print(f"{candidate}: {votes} votes")
-            if votes > round_winner_votes:
-                round_winner_votes = votes
-                round_winner = candidate
-        # print(f"Total Votes: {total_votes}\n")
-
-        # Identify the candidate with the fewest votes
-        min_votes = first_choice_votes.min()
-        eliminated_candidate = first_choice_votes[
-            first_choice_votes == min_votes
-        ].index[0]
-        # print(f"Eliminated Candidate: {eliminated_candidate}\nNumber of Votes: {min_votes}\n")
-
-        # Eliminate the candidate with the fewest votes
-        candidates = [
-            candidate for candidate in candidates if candidate != eliminated_candidate
-        ]
-
-        # Redistribute the votes of the eliminated candidate
-        def redistribute_votes(row):
-            if row["current_winner"] == eliminated_candidate:
-                for i in range(1, num_candidates + 1):
-                    if row[f"choice_{i}"] in candidates:
-                        return row[f"choice_{i}"]
-                return None
-            return row["current_winner"]
-
-        df["current_winner"] = df.apply(redistribute_votes, axis=1)
-
-        # print(df.to_string() + "\n")
-
-        if len(candidates) == 1:
-            return df, candidates, round_winner
-
-        return df, candidates, round_winner
-
-    while len(candidates) > 1:
-        df, candidates, rcv_winner = RankedChoiceVotingRound(
-            df, candidates, f"Round {round_number}", num_candidates
-        )
-
-        round_number += 1
-
-    _, _, _ = RankedChoiceVotingRound(
-        df, candidates, f"Round {round_number}", num_candidates
+    winner = instant_runoff(
+        rank_matrix(rankings, len(labels)),
+        len(labels),
+        weights=np.array(weights, dtype=np.int64),
     )
+    if winner is None:
+        return None
+    return _candidate_label(labels[winner])
 
-    if os.path.exists("votes.csv"):
-        os.remove("votes.csv")
 
-    # Print the winner
-    # print(f"Ranked Choice Voting:\nWinner: {rcv_winner}")
-    return rcv_winner
+def first_preference(vote_data):
+    # Candidate id holding the lowest rank on a parsed ranked ballot; 0 is unranked
+    ranked = [candidate_id for candidate_id in vote_data if vote_data[candidate_id]]
+    if not ranked:
+        return None
+    return int(min(ranked, key=vote_data.get))
 
 
-def calculate_traditional_votes(election_id: int, db: Session):
-    candidate_votes = {
-        candidate.id: 0.0
-        for candidate in db.query(Candidate)
-        .filter(Candidate.election_id == election_id)
-        .all()
-    }
-    votes = (
-        db.query(Vote)
-        .join(Candidate)
-        .filter(Candidate.election_id == election_id)
-        .all()
+def increment_tally(election_id: int, candidate_id: int, db: Session, votes=1.0):
+    """Add votes to a candidate's live counter in the caller's transaction."""
+    updated = (
+        db.query(CandidateTally)
+        .filter(
+            CandidateTally.election_id == election_id,
+            CandidateTally.candidate_id == candidate_id,
+        )
+        .update({CandidateTally.votes: CandidateTally.votes + votes})
     )
-    for vote in votes:
-        candidate_votes[vote.candidate_id] += 1.0
-    # print(votes)
-    # print(candidate_votes)
-    return candidate_votes
-
-
-def calculate_ranked_choice_votes(election_id: int, db: Session, traditional=False):
+    if not updated:
+        db.add(
+            CandidateTally(
+                election_id=election_id, candidate_id=candidate_id, votes=votes
+            )
+        )
 
-    candidates = db.query(Candidate).filter(Candidate.election_id == election_id).all()
 
-    # Get all candidates and votes
-    votes = (
-        db.query(AlternativeVote)
-        .filter(AlternativeVote.election_id == election_id)
-        .all()
-    )
+def live_tally(election_id: int, db: Session):
+    """Read the per-candidate counters maintained by ``increment_tally``."""
+    return {
+        candidate_id: votes
+        for candidate_id, votes in db.query(
+            CandidateTally.candidate_id, CandidateTally.votes
+        ).filter(CandidateTally.election_id == election_id)
+    }
 
-    if traditional:
-        candidate_votes = {candidate.id: 0.0 for candidate in candidates}
-        for vote in votes:
-            print(f"Trad Vote in calc_rcv_votes: {vote.vote.decode()}")
-            vote = json.loads(vote.vote.decode())
-            candidate_id = int(min(vote, key=vote.get))
-            candidate_votes[candidate_id] += 1.0
 
-        # print(votes)
-        # print(candidate_votes)
-        return candidate_votes
+def live_results(election: Election, db: Session):
+    """Current TallyResult of an election that is still open, by candidate id.
 
-    print(f"RCV Calc Votes: {votes}")
+    Plurality and ranked-choice elections read the live counters; other
+    voting systems are tallied by their engine. Raises ``ValueError`` for an
+    unknown voting system.
+    """
+    if BALLOT_KINDS.get(election.voting_system) == "ranks":
+        return TallyResult(live_tally(election.id, db), None)
+    return tally_election(election, db)
 
-    # return {
-    #     candidate.id: 0.0
-    #     for candidate in db.query(Candidate)
-    #     .filter(Candidate.election_id == election_id)
-    #     .all()
-    # }
 
-    total_votes = float(len(votes))
+def score_averages(election_id: int, totals, db: Session):
+    """Average score per ballot from stored score totals, as the score engine gives them."""
+    ballots = (
+        db.query(func.sum(BallotPattern.count))
+        .filter(BallotPattern.election_id == election_id)
+        .scalar()
+    )
+    return {
+        candidate_id: votes / ballots if ballots else 0.0
+        for candidate_id, votes in totals.items()
+    }
 
-    vote_format = [vote.vote.decode() for vote in votes]
-    candidate_ids = [str(candidate.id) for candidate in candidates]
 
-    print(f"Vote format: {vote_format}")
+def rebuild_tally_counters(election_id: int, db: Session, commit=True):
+    """Recompute an election's live counters and ballot patterns from its raw ballots."""
+    election = db.query(Election).filter(Election.id == election_id).first()
+    if election is None:
+        return None
 
-    winner = ranked_choice(vote_format, candidate_ids)
-    winning_candidate = db.query(Candidate).filter(Candidate.id == winner).first()
-    print(
-        f"{winner}\nWinner: {winning_candidate.name if winning_candidate else None}, with ID: {winning_candidate.id if winning_candidate else None}\n {winning_candidate}"
+    candidate_votes = {
+        candidate_id: 0.0
+        for (candidate_id,) in db.query(Candidate.id).filter(
+            Candidate.election_id == election_id
+        )
+    }
+    if election.voting_system == "traditional":
+        for candidate_id, votes in (
+            db.query(Vote.candidate_id, func.count(Vote.id))
+            .filter(Vote.election_id == election_id)
+            .group_by(Vote.candidate_id)
+        ):
+            candidate_votes[candidate_id] = float(votes)
+    else:
+        # The ballot patterns tallies read are derived from the raw ballots too
+        rebuild_ballot_patterns(election_id, db)
+        if election.voting_system == "ranked_choice":
+            candidate_votes.update(
+                run_engine("plurality", Ballots.load(election, db)).totals
+            )
+
+    db.query(CandidateTally).filter(CandidateTally.election_id == election_id).delete(
+        synchronize_session=False
     )
-    if not winner:
-        return {0: total_votes}
-    return {int(winner): total_votes}
-
-
-def calculate_score_votes(election_id: int, db: Session):
-    # Implement score voting logic
-    pass
+    db.add_all(
+        CandidateTally(election_id=election_id, candidate_id=candidate_id, votes=votes)
+        for candidate_id, votes in candidate_votes.items()
+    )
+    if commit:
+        db.commit()
+    return candidate_votes
 
 
-def calculate_quadratic_votes(election_id: int, db: Session):
-    # Implement quadratic voting logic
-    pass
+def validate_score_ballot(vote_data):
+    for candidate_id, score in vote_data.items():
+        if type(score) is not int or not 0 <= score <= MAX_SCORE:
+            raise ValueError(
+                f"Score for candidate {candidate_id} must be an integer from 0 to {MAX_SCORE}"
+            )
+
+
+def validate_quadratic_ballot(vote_data, credit_budget):
+    spent = 0
+    for candidate_id, credits in vote_data.items():
+        if type(credits) is not int or credits < 0:
+            raise ValueError(
+                f"Credits for candidate {candidate_id} must be a non-negative integer"
+            )
+        spent += credits
+    if spent > credit_budget:
+        raise ValueError(f"Ballot spends {spent} credits, budget is {credit_budget}")
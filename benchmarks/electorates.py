@@ -0,0 +1,100 @@
+"""Synthetic electorates for the four voting systems.
+
+Each generator returns an ``(n_voters, n_candidates)`` integer matrix in the
+packed ballot layout (see application/ballots.py): a candidate index for
+traditional, ranks (0 = unranked) for ranked_choice, scores for score_voting
+and credits for quadratic_voting. Candidates get a random popularity, so
+elections have a clear but not unanimous favourite. ``ballot_payloads`` turns
+a matrix into request bodies for ``POST /elections/{id}/vote``.
+"""
+
+import json
+import numpy as np
+from application.vote_calculation import MAX_SCORE
+
+VOTING_SYSTEMS = ["traditional", "ranked_choice", "score_voting", "quadratic_voting"]
+
+
+def popularity(num_candidates, rng):
+    return rng.dirichlet(np.ones(num_candidates))
+
+
+def traditional_votes(num_voters, num_candidates, seed=0):
+    """One column holding the index of each voter's candidate."""
+    rng = np.random.default_rng(seed)
+    choices = rng.choice(num_candidates, size=num_voters, p=popularity(num_candidates, rng))
+    return choices.reshape(-1, 1)
+
+
+def ranked_votes(num_voters, num_candidates, seed=0):
+    """Random preference orders, truncated to a random length of at least one.
+
+    Orders are drawn in proportion to candidate popularity (Plackett-Luce,
+    sampled with the Gumbel trick), the vectorized counterpart of the
+    ``random.sample`` ballots in voting_systems/ranked_choice_mod.ipynb.
+    """
+    rng = np.random.default_rng(seed)
+    keys = np.log(popularity(num_candidates, rng)) + rng.gumbel(
+        size=(num_voters, num_candidates)
+    )
+    order = np.argsort(-keys, axis=1)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, num_candidates + 1), axis=1)
+    lengths = rng.integers(1, num_candidates + 1, size=(num_voters, 1))
+    return np.where(ranks <= lengths, ranks, 0)
+
+
+def score_votes(num_voters, num_candidates, seed=0, max_score=MAX_SCORE):
+    """Independent scores per candidate, centred on each candidate's appeal.
+
+    voting_systems/score_voting.ipynb draws uniform ratings; integer scores
+    around a per-candidate mean keep the winner from being a coin toss.
+    """
+    rng = np.random.default_rng(seed)
+    means = rng.uniform(0.2, 0.8, size=num_candidates) * max_score
+    scores = rng.normal(means, max_score / 4, size=(num_voters, num_candidates))
+    return np.clip(np.rint(scores), 0, max_score).astype(np.int64)
+
+
+def quadratic_votes(num_voters, num_candidates, seed=0, credits=100):
+    """Vectorized version of the generator in voting_systems/quad_voting.py.
+
+    Each voter spends a random share of their remaining credits on each
+    candidate in turn, and whatever is left on the last one.
+    """
+    rng = np.random.default_rng(seed)
+    remaining = np.full(num_voters, credits, dtype=np.int64)
+    columns = []
+    for _ in range(num_candidates - 1):
+        spent = rng.integers(0, remaining + 1)
+        columns.append(spent)
+        remaining -= spent
+    columns.append(remaining)
+    return np.stack(columns, axis=1)
+
+
+GENERATORS = {
+    "traditional": traditional_votes,
+    "ranked_choice": ranked_votes,
+    "score_voting": score_votes,
+    "quadratic_voting": quadratic_votes,
+}
+
+
+def generate(voting_system, num_voters, num_candidates, seed=0):
+    return GENERATORS[voting_system](num_voters, num_candidates, seed=seed)
+
+
+def ballot_payloads(voting_system, votes, candidate_ids):
+    """Request bodies for the vote endpoint, one per row of ``votes``."""
+    if voting_system == "traditional":
+        return [{"vote": candidate_ids[row[0]]} for row in votes.tolist()]
+    payloads = []
+    for row in votes.tolist():
+        ballot = {
+            str(candidate_id): value
+            for candidate_id, value in zip(candidate_ids, row)
+            if value or voting_system != "ranked_choice"
+        }
+        payloads.append({"vote": json.dumps(ballot)})
+    return payloads
@@ -0,0 +1,242 @@
+"""Load test of the election API: create, vote, results and export per voting system.
+
+For each voting system an election is created with ``--voters`` voters, every
+voter casts a generated ballot (see benchmarks/electorates.py) from
+``--clients`` concurrent clients, and results and the ballot export are then
+read ``--reads`` times concurrently. Each endpoint reports throughput,
+p50/p95/p99 latency and, in process, the DB statements per request.
+
+By default the app runs in process behind Starlette's TestClient on a fresh
+SQLite file. With ``--url`` a running server is used instead (for example
+``uvicorn application.app:app``); it must share its working directory's
+identities.csv with ``--identities`` and query counts are not reported.
+
+``--save`` writes the report as a JSON baseline, ``--compare`` prints the
+change against an earlier one.
+
+Usage: python -m benchmarks.load_test [--voters 2000] [--clients 16]
+    [--systems traditional,ranked_choice] [--save benchmarks/baselines/local.json]
+    [--compare benchmarks/baselines/sqlite-in-process.json]
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+WORKDIR = tempfile.mkdtemp(prefix="load-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{WORKDIR}/app.db")
+
+import numpy as np
+from benchmarks.electorates import VOTING_SYSTEMS, ballot_payloads, generate
+from application.utils import create_auth_token
+
+CANDIDATES = ["Alice", "Bob", "Charlie", "Diana", "Eve"]
+
+
+class QueryCounter:
+    """Counts statements sent to the app's engine, in process only."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from application.models import engine
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._executed)
+
+    def _executed(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def in_process_client():
+    from fastapi.testclient import TestClient
+    from application.app import app
+
+    # Identities are appended to ./identities.csv, keep it out of the tree
+    os.chdir(WORKDIR)
+    return TestClient(app).__enter__(), QueryCounter()
+
+
+def http_client(url):
+    import httpx
+
+    return httpx.Client(base_url=url, timeout=60), None
+
+
+def read_identities(path, emails):
+    wanted = set(emails)
+    with open(path, newline="") as file:
+        return {email: otp for email, otp in csv.reader(file) if email in wanted}
+
+
+def timed_requests(client, requests, num_clients, queries):
+    """Send ``(method, path, kwargs)`` requests concurrently.
+
+    Returns a summary of the batch and the responses in request order.
+    """
+
+    def send(request):
+        method, path, kwargs = request
+        started = time.perf_counter()
+        response = client.request(method, path, **kwargs)
+        return time.perf_counter() - started, response
+
+    queries_before = queries.count if queries else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_clients) as pool:
+        outcomes = list(pool.map(send, requests))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, _ in outcomes]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    summary = {
+        "requests": len(outcomes),
+        "errors": sum(response.status_code >= 400 for _, response in outcomes),
+        "throughput_rps": round(len(outcomes) / elapsed, 1),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "queries_per_request": (
+            round((queries.count - queries_before) / len(outcomes), 2)
+            if queries
+            else None
+        ),
+    }
+    return summary, [response for _, response in outcomes]
+
+
+def run_system(client, queries, voting_system, args):
+    emails = [f"load_{voting_system}_{i}@example.com" for i in range(args.voters)]
+    body = {
+        "title": f"Load test ({voting_system})",
+        "voting_system": voting_system,
+        "end_time": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
+        "candidates": [{"name": name} for name in CANDIDATES],
+        "voter_emails": emails,
+    }
+    report = {}
+    report["create_election"], (response,) = timed_requests(
+        client, [("POST", "/elections/", {"json": body})], 1, queries
+    )
+    response.raise_for_status()
+    election_id = response.json()["id"]
+    candidate_ids = [candidate["id"] for candidate in response.json()["candidates"]]
+    identities = read_identities(args.identities, emails)
+
+    payloads = ballot_payloads(
+        voting_system,
+        generate(voting_system, args.voters, len(CANDIDATES), seed=args.seed),
+        candidate_ids,
+    )
+    votes = [
+        (
+            "POST",
+            f"/elections/{election_id}/vote",
+            {
+                "json": payload,
+                "headers": {
+                    "Authorization": "Bearer "
+                    + create_auth_token(email, identities[email])
+                },
+            },
+        )
+        for email, payload in zip(emails, payloads)
+    ]
+    report["vote"], _ = timed_requests(client, votes, args.clients, queries)
+    report["results"], _ = timed_requests(
+        client,
+        [("GET", f"/elections/{election_id}/results", {})] * args.reads,
+        args.clients,
+        queries,
+    )
+    report["all_votes"], _ = timed_requests(
+        client,
+        [("GET", f"/elections/{election_id}/all_votes", {"params": {"limit": 1000}})]
+        * args.reads,
+        args.clients,
+        queries,
+    )
+    return report
+
+
+def compare(report, baseline):
+    """Print throughput and p95 changes of ``report`` against ``baseline``."""
+    for voting_system, endpoints in report["results"].items():
+        for endpoint, stats in endpoints.items():
+            before = baseline["results"].get(voting_system, {}).get(endpoint)
+            if not before:
+                continue
+            print(
+                f"{voting_system:<17} {endpoint:<16} "
+                f"{before['throughput_rps']:>9.1f} -> {stats['throughput_rps']:>9.1f} req/s "
+                f"({stats['throughput_rps'] / before['throughput_rps'] - 1:+.0%}), "
+                f"p95 {before['p95_ms']:>8.2f} -> {stats['p95_ms']:>8.2f} ms"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--voters", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--systems", default=",".join(VOTING_SYSTEMS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--identities", default="identities.csv")
+    parser.add_argument("--save", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args(argv)
+    for path in ("save", "compare", "identities"):
+        if getattr(args, path):
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+    if not args.url:
+        args.identities = os.path.join(WORKDIR, "identities.csv")
+
+    client, queries = http_client(args.url) if args.url else in_process_client()
+    report = {
+        "meta": {
+            "voters": args.voters,
+            "clients": args.clients,
+            "reads": args.reads,
+            "seed": args.seed,
+            "target": args.url or "in-process",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "results": {},
+    }
+    for voting_system in args.systems.split(","):
+        report["results"][voting_system] = endpoints = run_system(
+            client, queries, voting_system, args
+        )
+        for endpoint, stats in endpoints.items():
+            print(
+                f"{voting_system:<17} {endpoint:<16} {stats['requests']:>6} req "
+                f"{stats['errors']:>4} err {stats['throughput_rps']:>9.1f} req/s "
+                f"p50/p95/p99 {stats['p50_ms']:.1f}/{stats['p95_ms']:.1f}/"
+                f"{stats['p99_ms']:.1f} ms "
+                f"queries/req {stats['queries_per_request']}"
+            )
+    client.close()
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+    if args.save:
+        os.makedirs(os.path.dirname(args.save), exist_ok=True)
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
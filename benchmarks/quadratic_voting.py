@@ -0,0 +1,62 @@
+"""Quadratic voting tally: voting_systems/quad_voting.py vs tally.quadratic_voting.
+
+Usage: python -m benchmarks.quadratic_voting [--voters 1000000] [--credits 100]
+"""
+
+import argparse
+import io
+import time
+import numpy as np
+import pandas as pd
+from application.ballots import decode_ballots
+from application.tally import quadratic_voting
+from benchmarks.electorates import quadratic_votes
+
+CANDIDATES = ["Alice", "Bob", "Charlie", "Diana", "Eve"]
+
+
+def pandas_script_tally(csv_text):
+    # The CSV read and column-by-column square root from voting_systems/quad_voting.py
+    df = pd.read_csv(io.StringIO(csv_text))[CANDIDATES]
+    sqrt = pd.DataFrame()
+    for i in df.columns:
+        sqrt[i] = df[i] ** 0.5
+    return sqrt.sum().to_numpy()
+
+
+def engine_tally(blobs, num_candidates, credits):
+    return quadratic_voting(decode_ballots(blobs, num_candidates), credits)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--voters", type=int, default=1_000_000)
+    parser.add_argument("--credits", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    credits = quadratic_votes(
+        args.voters, len(CANDIDATES), credits=args.credits
+    ).astype(np.uint16)
+    df = pd.DataFrame(credits.astype(np.int64), columns=CANDIDATES)
+    df.insert(0, "voter", [f"voter {i + 1}" for i in range(args.voters)])
+    csv_text = df.to_csv(index=False)
+    blobs = [row.tobytes() for row in credits.astype("<u2")]
+
+    expected, pandas_seconds = timed(pandas_script_tally, csv_text)
+    totals, engine_seconds = timed(engine_tally, blobs, len(CANDIDATES), args.credits)
+    assert np.allclose(expected, totals)
+
+    print(f"{args.voters} voters, {len(CANDIDATES)} candidates")
+    print(f"pandas script:        {pandas_seconds:.3f}s (read_csv + sqrt columns)")
+    print(f"tally engine:         {engine_seconds:.3f}s (decode + budget check + sum)")
+    print(f"winner: {CANDIDATES[int(np.argmax(totals))]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Tally engine sweep: wall time and peak memory across ballot and candidate counts.
+
+Each engine is run on ballots from benchmarks/electorates.py for every
+combination of ``--ballots`` and ``--candidates``. The in-memory engines
+start from packed ballots, as ``load_ballots`` returns them; ``ranked_choice``
+starts from JSON ballot strings. With ``--db`` each voting system's
+``engines.tally_election`` also runs end to end against a SQLite file holding
+the ballots, as does ``compare_ranked_methods``: every ranked engine of
+``application.engines`` over one load of the ballots.
+
+Peak memory is what tracemalloc sees (Python objects and NumPy buffers, not
+SQLite's page cache), measured in a separate run from the timing. A case is
+skipped when its ballot matrix exceeds ``--max-cells`` or when the previous
+size, scaled up linearly, would take longer than ``--max-seconds``.
+
+After the sweep each engine's time is fitted against the ballot count on a
+log-log scale per candidate count; a slope above ``--max-slope`` means the
+engine grows faster than linearly and is reported (exit status 1).
+
+Usage: python -m benchmarks.tally_engines [--ballots 1e3,1e4,1e5,1e6,1e7]
+    [--candidates 2,5,10,20,50] [--engines instant_runoff,score_voting] [--db]
+    [--save benchmarks/baselines/tally-engines.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+from application.ballots import (
+    BALLOT_DTYPE,
+    decode_ballots,
+    ranks_to_rank_matrix,
+    rebuild_ballot_patterns,
+)
+from application.engines import MAX_SCORE, Ballots, compare, plurality, tally_election
+from application.migrations import upgrade
+from application.models import AlternativeVote, Candidate, Election, Vote, make_engine
+from application.tally import instant_runoff, quadratic_voting, score_voting
+from application.vote_calculation import ranked_choice
+from benchmarks.electorates import ballot_payloads, generate
+
+CREDIT_BUDGET = 100
+
+# setup(votes, candidate_ids) is a context manager yielding the arguments of
+# run; only run is measured
+Engine = namedtuple("Engine", ["name", "voting_system", "setup", "run"])
+
+
+@contextmanager
+def packed(votes, candidate_ids):
+    # One buffer stands in for the joined blobs load_ballots reads
+    yield [votes.astype(BALLOT_DTYPE).tobytes()], len(candidate_ids)
+
+
+@contextmanager
+def first_choices(votes, candidate_ids):
+    # The rows are already in preference order, so skip decoding ranks
+    ballots = Ballots("ranks", candidate_ids, None, np.ones(len(votes), np.int64))
+    ballots.rankings = votes.astype(np.int16)
+    yield (ballots,)
+
+
+@contextmanager
+def json_ballots(votes, candidate_ids):
+    yield [
+        payload["vote"]
+        for payload in ballot_payloads("ranked_choice", votes, candidate_ids)
+    ], candidate_ids
+
+
+@contextmanager
+def sqlite_election(votes, candidate_ids, voting_system):
+    """A throwaway database holding one election with ``votes`` as its ballots."""
+    workdir = tempfile.mkdtemp(prefix="tally-engines-")
+    engine = make_engine(f"sqlite:///{workdir}/tally.db")
+    try:
+        upgrade(engine)
+        with sessionmaker(bind=engine)() as db:
+            election = Election(
+                title="Tally sweep",
+                voting_system=voting_system,
+                credit_budget=CREDIT_BUDGET,
+            )
+            db.add(election)
+            db.flush()
+            candidate_ids = db.scalars(
+                insert(Candidate).returning(
+                    Candidate.id, sort_by_parameter_order=True
+                ),
+                [
+                    {"name": f"Candidate {i}", "election_id": election.id, "votes": 0.0}
+                    for i in range(len(candidate_ids))
+                ],
+            ).all()
+            if voting_system == "traditional":
+                rows = [
+                    {
+                        "validation_token": str(i),
+                        "election_id": election.id,
+                        "candidate_id": candidate_ids[choice],
+                    }
+                    for i, choice in enumerate(votes[:, 0].tolist())
+                ]
+                db.execute(insert(Vote), rows)
+            else:
+                rows = [
+                    {
+                        "validation_token": str(i),
+                        "election_id": election.id,
+                        "vote_string": "",
+                        "vote": row.tobytes(),
+                    }
+                    for i, row in enumerate(votes.astype(BALLOT_DTYPE))
+                ]
+                db.execute(insert(AlternativeVote), rows)
+                rebuild_ballot_patterns(election.id, db)
+            del rows
+            db.commit()
+            yield election.id, db
+    finally:
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare_ranked_methods(election_id, db):
+    return compare(Ballots.load(db.get(Election, election_id), db))
+
+
+def tally_in_database(election_id, db):
+    return tally_election(db.get(Election, election_id), db)
+
+
+def in_database(voting_system):
+    return lambda votes, candidate_ids: sqlite_election(
+        votes, candidate_ids, voting_system
+    )
+
+
+ENGINES = [
+    Engine(
+        "plurality",
+        "traditional",
+        first_choices,
+        plurality,
+    ),
+    Engine(
+        "instant_runoff",
+        "ranked_choice",
+        packed,
+        lambda blobs, n: instant_runoff(
+            ranks_to_rank_matrix(decode_ballots(blobs, n)), n
+        ),
+    ),
+    Engine("ranked_choice", "ranked_choice", json_ballots, ranked_choice),
+    Engine(
+        "score_voting",
+        "score_voting",
+        packed,
+        lambda blobs, n: score_voting(decode_ballots(blobs, n), MAX_SCORE),
+    ),
+    Engine(
+        "quadratic_voting",
+        "quadratic_voting",
+        packed,
+        lambda blobs, n: quadratic_voting(decode_ballots(blobs, n), CREDIT_BUDGET),
+    ),
+]
+
+DB_ENGINES = [
+    *(
+        Engine(
+            f"tally_election[{voting_system}]",
+            voting_system,
+            in_database(voting_system),
+            tally_in_database,
+        )
+        for voting_system in (
+            "traditional",
+            "ranked_choice",
+            "score_voting",
+            "quadratic_voting",
+        )
+    ),
+    Engine(
+        "compare_ranked_methods",
+        "ranked_choice",
+        in_database("ranked_choice"),
+        compare_ranked_methods,
+    ),
+]
+
+
+def measure(engine, num_ballots, num_candidates, repeat, seed):
+    """Return ``(seconds, peak_bytes, setup_seconds)`` for one sweep case."""
+    votes = generate(engine.voting_system, num_ballots, num_candidates, seed=seed)
+    candidate_ids = list(range(1, num_candidates + 1))
+    started = time.perf_counter()
+    with engine.setup(votes, candidate_ids) as args:
+        setup_seconds = time.perf_counter() - started
+        del votes
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            engine.run(*args)
+            timings.append(time.perf_counter() - started)
+        tracemalloc.start()
+        try:
+            engine.run(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return min(timings), peak, setup_seconds
+
+
+def growth(cases, min_seconds):
+    """Log-log slope of time against ballot count per (engine, candidates)."""
+    series = {}
+    for case in cases:
+        if case["seconds"] >= min_seconds:
+            series.setdefault((case["engine"], case["candidates"]), []).append(
+                (case["ballots"], case["seconds"])
+            )
+    slopes = []
+    for (engine, num_candidates), points in sorted(series.items()):
+        if len(points) < 2:
+            continue
+        ballots, seconds = np.log(np.array(points)).T
+        slope = float(np.polyfit(ballots, seconds, 1)[0])
+        slopes.append(
+            {"engine": engine, "candidates": num_candidates, "slope": round(slope, 2)}
+        )
+    return slopes
+
+
+def int_list(text):
+    return [int(float(value)) for value in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int_list, default=int_list("1e3,1e4,1e5,1e6,1e7"))
+    parser.add_argument("--candidates", type=int_list, default=int_list("2,5,10,20,50"))
+    parser.add_argument("--engines", default=None, help="comma separated engine names")
+    parser.add_argument("--db", action="store_true", help="include tally_election")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-cells", type=float, default=5e7)
+    parser.add_argument("--max-seconds", type=float, default=60.0)
+    parser.add_argument("--max-slope", type=float, default=1.5)
+    parser.add_argument("--min-seconds", type=float, default=0.005)
+    parser.add_argument("--save", default=None)
+    args = parser.parse_args(argv)
+
+    engines = ENGINES + (DB_ENGINES if args.db else [])
+    if args.engines:
+        wanted = set(args.engines.split(","))
+        engines = [engine for engine in engines if engine.name in wanted]
+
+    cases, skipped = [], []
+    print(f"{'engine':<34} {'ballots':>9} {'cands':>5} {'time':>10} {'peak MB':>9}")
+    for engine in engines:
+        for num_candidates in args.candidates:
+            previous = None
+            for num_ballots in sorted(args.ballots):
+                projected = (
+                    previous[1] * num_ballots / previous[0] if previous else 0.0
+                )
+                if num_ballots * num_candidates > args.max_cells:
+                    skipped.append((engine.name, num_ballots, num_candidates, "max-cells"))
+                    continue
+                if projected > args.max_seconds:
+                    skipped.append((engine.name, num_ballots, num_candidates, "max-seconds"))
+                    continue
+                started = time.perf_counter()
+                seconds, peak, setup_seconds = measure(
+                    engine, num_ballots, num_candidates, args.repeat, args.seed
+                )
+                previous = (num_ballots, time.perf_counter() - started)
+                cases.append(
+                    {
+                        "engine": engine.name,
+                        "ballots": num_ballots,
+                        "candidates": num_candidates,
+                        "seconds": round(seconds, 6),
+                        "peak_bytes": peak,
+                        "setup_seconds": round(setup_seconds, 3),
+                    }
+                )
+                print(
+                    f"{engine.name:<34} {num_ballots:>9} {num_candidates:>5} "
+                    f"{seconds * 1000:>8.1f}ms {peak / 2**20:>9.1f}",
+                    flush=True,
+                )
+
+    slopes = growth(cases, args.min_seconds)
+    superlinear = [slope for slope in slopes if slope["slope"] > args.max_slope]
+    for engine, num_ballots, num_candidates, reason in skipped:
+        print(f"skipped {engine} {num_ballots} ballots x {num_candidates} ({reason})")
+    for slope in superlinear:
+        print(
+            f"SUPERLINEAR {slope['engine']} with {slope['candidates']} candidates: "
+            f"time ~ ballots^{slope['slope']}"
+        )
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as file:
+            json.dump(
+                {
+                    "meta": {
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                        "platform": platform.platform(),
+                        "run_at": datetime.now(timezone.utc).isoformat(
+                            timespec="seconds"
+                        ),
+                    },
+                    "cases": cases,
+                    "growth": slopes,
+                },
+                file,
+                indent=2,
+            )
+            file.write("\n")
+    return 1 if superlinear else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Vote ingestion throughput with the default and the tuned SQLite engine.
+
+Casts ``--votes`` traditional ballots through ``record_vote`` from
+``--threads`` concurrent threads against a fresh database file, once with a
+bare ``create_engine`` (the engine models.py used to build) and once with
+``models.make_engine`` (WAL, synchronous=NORMAL, busy timeout, cache, mmap),
+and once more with the tuned engine behind the group-commit writer. The
+last run stores the same ballots through the bulk import path
+(``import_ballot_chunk``, ``IMPORT_CHUNK_SIZE`` lines per transaction).
+
+Usage: python -m benchmarks.vote_throughput [--votes 5000] [--threads 8]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKDIR = tempfile.mkdtemp(prefix="vote-throughput-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{WORKDIR}/app.db")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from application import app as app_module, ingest
+from application.app import import_ballot_chunk, record_vote, VoteCreate
+from application.bulk import insert_candidates, insert_voter_tokens
+from application.cache import election_info, token_index
+from application.ingest import IMPORT_CHUNK_SIZE
+from application.models import Base, Election, make_engine
+from application.utils import create_auth_token
+
+
+def baseline_engine(url):
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+
+def prepare_election(Session, num_voters):
+    identities = {}
+    with Session() as db:
+        election = Election(title="Throughput", voting_system="traditional")
+        db.add(election)
+        db.flush()
+        candidates = insert_candidates(election.id, ["A", "B", "C"], db)
+        db.commit()
+        insert_voter_tokens(
+            election.id,
+            (f"voter{i}@example.com" for i in range(num_voters)),
+            db,
+            on_batch=identities.update,
+        )
+        election_id = election.id
+    tokens = [create_auth_token(email, otp) for email, otp in identities.items()]
+    return election_id, [candidate_id for candidate_id, _ in candidates], tokens
+
+
+def run(name, engine, num_votes, num_threads, group_commit=False):
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    election_id, candidate_ids, tokens = prepare_election(Session, num_votes)
+    election_info.clear()
+    app_module.GROUP_COMMIT = group_commit
+    if group_commit:
+        ingest._writer = ingest.GroupCommitWriter(session_factory=Session).start()
+
+    def cast(i):
+        with Session() as db:
+            try:
+                record_vote(
+                    election_id,
+                    VoteCreate(vote=candidate_ids[i % len(candidate_ids)]),
+                    tokens[i],
+                    db,
+                )
+                return True
+            except Exception:
+                return False
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        accepted = sum(pool.map(cast, range(num_votes)))
+    elapsed = time.perf_counter() - started
+    ingest.stop_vote_writer()
+    engine.dispose()
+
+    print(
+        f"{name:<12} {accepted:>7} votes in {elapsed:6.2f}s "
+        f"= {accepted / elapsed:8.0f} votes/s ({num_votes - accepted} failed)"
+    )
+
+
+def run_import(name, engine, num_votes):
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    election_id, candidate_ids, tokens = prepare_election(Session, num_votes)
+    election_info.clear()
+    token_index.clear()
+    lines = [
+        (i + 1, token, str(candidate_ids[i % len(candidate_ids)]))
+        for i, token in enumerate(tokens)
+    ]
+
+    started = time.perf_counter()
+    accepted = 0
+    with Session() as db:
+        for start in range(0, len(lines), IMPORT_CHUNK_SIZE):
+            stored, _ = import_ballot_chunk(
+                election_id,
+                "traditional",
+                lines[start : start + IMPORT_CHUNK_SIZE],
+                db,
+            )
+            accepted += stored
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+
+    print(
+        f"{name:<12} {accepted:>7} votes in {elapsed:6.2f}s "
+        f"= {accepted / elapsed:8.0f} votes/s ({num_votes - accepted} failed)"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--votes", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    run(
+        "baseline",
+        baseline_engine(f"sqlite:///{WORKDIR}/baseline.db"),
+        args.votes,
+        args.threads,
+    )
+    run("tuned", make_engine(f"sqlite:///{WORKDIR}/tuned.db"), args.votes, args.threads)
+    run(
+        "group-commit",
+        make_engine(f"sqlite:///{WORKDIR}/group.db"),
+        args.votes,
+        args.threads,
+        group_commit=True,
+    )
+    run_import("import", make_engine(f"sqlite:///{WORKDIR}/import.db"), args.votes)
+
+
+if __name__ == "__main__":
+    main()
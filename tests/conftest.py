@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from application.bulk import insert_candidates, insert_voter_tokens
+from application.models import Base, Election
+from application.utils import create_auth_token
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+
+@pytest.fixture(scope="session")
+def engine():
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def session_factory(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="session")
+def make_election(session_factory):
+    """Return a function that stores an election with its candidates and voters.
+
+    It takes the title, then optionally ``voting_system``, candidate names,
+    voter emails and any other ``Election`` column, and returns
+    ``(election_id, candidate_ids, tokens)`` with one auth token per voter.
+    """
+
+    def make_election(
+        title, voting_system="traditional", candidates=(), voters=(), **columns
+    ):
+        identities = {}
+        with session_factory() as db:
+            election = Election(title=title, voting_system=voting_system, **columns)
+            db.add(election)
+            db.flush()
+            election_id = election.id
+            rows = insert_candidates(election_id, list(candidates), db)
+            candidate_ids = [candidate_id for candidate_id, _ in rows]
+            db.commit()
+            insert_voter_tokens(election_id, voters, db, on_batch=identities.update)
+        tokens = [create_auth_token(email, otp) for email, otp in identities.items()]
+        return election_id, candidate_ids, tokens
+
+    return make_election
@@ -1,14 +1,26 @@
 import os
 import csv
+import math
 import pytest
 import json
 import logging
 from fastapi.testclient import TestClient
 from fastapi import Response
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from application.app import app, get_db
-from application.models import Base, Election, Candidate, AuthorizationToken
+from application.models import (
+    Base,
+    Election,
+    Candidate,
+    AuthorizationToken,
+    CandidateTally,
+    BallotPattern,
+)
+from application.ballots import load_ballot_patterns
+from application.vote_calculation import rebuild_tally_counters
+from application.cache import election_info, result_cache
 from application.utils import generate_otp, create_auth_token
 from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
@@ -197,6 +209,20 @@ def election_data(client):
     yield election_ids, election_responses
 
 
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement.split()[0].upper())
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 def get_otp_from_csv(email):
     with open("identities.csv", mode="r") as file:
         reader = csv.reader(file)
@@ -250,6 +276,71 @@ def test_vote_in_election(client, election_data, email, vote_index):
     cast_vote(client, email, vote_data, election_id)
 
 
+def test_get_live_election_results(client, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["traditional"]
+
+    response = client.get(f"/elections/{election_id}/results")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["winner"] is None
+    assert [result["votes"] for result in data["results"]] == [2.0, 1.0]
+
+
+def test_rebuild_tally_counters(db, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["traditional"]
+
+    db.query(CandidateTally).filter(CandidateTally.election_id == election_id).delete()
+    db.commit()
+
+    candidate_votes = rebuild_tally_counters(election_id, db)
+    assert sorted(candidate_votes.values()) == [1.0, 2.0]
+    assert db.query(CandidateTally).filter(
+        CandidateTally.election_id == election_id
+    ).count() == 2
+
+
+def test_get_all_votes_paginated(client, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["traditional"]
+
+    response = client.get(f"/elections/{election_id}/all_votes", params={"limit": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["votes"]) == 2
+    assert data["next_after_id"] is not None
+
+    response = client.get(
+        f"/elections/{election_id}/all_votes",
+        params={"limit": 2, "after_id": data["next_after_id"]},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["votes"]) == 1
+    assert data["next_after_id"] is None
+
+
+def test_get_all_votes_ndjson_stream(client, election_data):
+    election_ids, election_responses = election_data
+    election_id = election_ids["traditional"]
+    candidate_ids = [c["id"] for c in election_responses["traditional"]["candidates"]]
+
+    response = client.get(
+        f"/elections/{election_id}/all_votes", params={"format": "ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert [line["id"] for line in lines] == sorted(line["id"] for line in lines)
+    assert [line["vote"] for line in lines] == [
+        candidate_ids[0],
+        candidate_ids[1],
+        candidate_ids[0],
+    ]
+
+
 # @patch("application.app.datetime.datetime")
 # def test_get_election_results(mock_app_datetime, client, election_data):
 def test_get_election_results(client, election_data):
@@ -362,6 +453,27 @@ def test_vote_in_ranked_choice_election(client, election_data, email, vote_indic
     cast_vote(client, email, {"vote": json.dumps(vote_data)}, election_id)
 
 
+def test_repeated_ballots_share_a_pattern(db, election_data):
+    election_ids, election_responses = election_data
+    election_id = election_ids["ranked_choice"]
+    candidate_ids = [c["id"] for c in election_responses["ranked_choice"]["candidates"]]
+
+    def patterns():
+        db.expire_all()
+        ordinals, matrix, counts = load_ballot_patterns(election_id, db)
+        assert ordinals == candidate_ids
+        return matrix.tolist(), counts.tolist()
+
+    # Six ballots, each ranking cast twice (rows are per-candidate ranks)
+    expected = ([[1, 2, 3], [3, 1, 2], [2, 3, 1]], [2, 2, 2])
+    assert patterns() == expected
+
+    db.query(BallotPattern).filter(BallotPattern.election_id == election_id).delete()
+    db.commit()
+    rebuild_tally_counters(election_id, db)
+    assert patterns() == expected
+
+
 def test_get_ranked_choice_election_results(client, election_data):
     election_ids, election_responses = election_data
     election_id = election_ids["ranked_choice_result"]
@@ -404,6 +516,74 @@ def test_get_ranked_choice_election_results(client, election_data):
         assert data["winner"]["name"] == expected_winner["name"]
         assert data["winner"]["votes"] == 6.0
 
+        # Rounds were stored when the results request finalized the election
+        response = client.get(f"/elections/{election_id}/rounds")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["winner"]["id"] == expected_winner["id"]
+        rounds = data["rounds"]
+        assert [round["round"] for round in rounds] == list(range(1, len(rounds) + 1))
+        for round in rounds:
+            assert sum(round["counts"].values()) + round["exhausted"] == 6
+        for round, next_round in zip(rounds, rounds[1:]):
+            assert str(round["eliminated"]) not in next_round["counts"]
+            assert sum(round["transfers"].values()) + round["transfers_exhausted"] == (
+                round["counts"][str(round["eliminated"])]
+            )
+        assert rounds[-1]["eliminated"] is None
+        assert str(expected_winner["id"]) in rounds[-1]["counts"]
+
+
+def test_get_rounds_needs_a_closed_ranked_choice_election(client, election_data):
+    election_ids, _ = election_data
+    response = client.get(f"/elections/{election_ids['ranked_choice']}/rounds")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Election has not ended"
+    response = client.get(f"/elections/{election_ids['score_voting']}/rounds")
+    assert response.status_code == 400
+
+
+def test_compare_election_methods(client, election_data):
+    election_ids, election_responses = election_data
+    election_id = election_ids["ranked_choice_result"]
+    ids = [c["id"] for c in election_responses["ranked_choice_result"]["candidates"]]
+
+    response = client.get(f"/elections/{election_id}/compare")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["ballots"] == 6
+    methods = {method["method"]: method for method in data["methods"]}
+    assert list(methods) == ["plurality", "instant_runoff", "borda", "copeland"]
+
+    def totals(method):
+        return [result["votes"] for result in methods[method]["results"]]
+
+    # Three-way tie on first preferences, which the other methods break
+    assert totals("plurality") == [2.0, 2.0, 2.0, 0.0]
+    assert methods["plurality"]["is_draw"] is True
+    assert methods["plurality"]["winner"] is None
+    assert totals("borda") == [11.0, 13.0, 12.0, 0.0]
+    assert totals("copeland") == [1.5, 2.5, 2.0, 0.0]
+    for method in ("instant_runoff", "borda", "copeland"):
+        assert methods[method]["winner"]["id"] == ids[1]
+
+    response = client.get(f"/elections/{election_id}/compare?methods=borda")
+    assert [method["method"] for method in response.json()["methods"]] == ["borda"]
+    for methods in ("borda,unknown", "score"):
+        response = client.get(f"/elections/{election_id}/compare?methods={methods}")
+        assert response.status_code == 400
+
+
+def test_compare_traditional_election(client, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["traditional"]
+    live = client.get(f"/elections/{election_id}/results").json()["results"]
+
+    response = client.get(f"/elections/{election_id}/compare?methods=plurality")
+    assert response.status_code == 200
+    (plurality,) = response.json()["methods"]
+    assert plurality["results"] == live
+
 
 @pytest.mark.skip("Vote calculation logic does not account for draws.")
 @patch("application.app.datetime")
@@ -481,6 +661,30 @@ def test_vote_in_score_voting_election(
     cast_vote(client, email, {"vote": json.dumps(vote_data)}, election_id)
 
 
+def test_get_score_voting_election_results(client, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["score_voting"]
+
+    response = client.get(f"/elections/{election_id}/results")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["voting_system"] == "score_voting"
+    assert [result["votes"] for result in data["results"]] == [17.0, 13.0, 12.0]
+    averages = [17 / 6, 13 / 6, 12 / 6]
+    assert [result["average"] for result in data["results"]] == pytest.approx(averages)
+
+    # Final results carry the same averages, stored totals over the ballot count
+    with patch("application.app.datetime") as mock_app_datetime:
+        mock_app_datetime.now.return_value = datetime.now(timezone.utc) + timedelta(
+            days=2
+        )
+        response = client.get(f"/elections/{election_id}/results")
+    assert response.status_code == 200
+    data = response.json()
+    assert [result["average"] for result in data["results"]] == pytest.approx(averages)
+    assert data["winner"]["average"] == pytest.approx(17 / 6)
+
+
 # @pytest.mark.skip(reason="Quadratic voting not implemented")
 @pytest.mark.parametrize(
     "email, vote_indices, election_type",
@@ -506,3 +710,347 @@ def test_vote_in_quadratic_voting_election(
         if i < len(candidates)
     }
     cast_vote(client, email, {"vote": json.dumps(vote_data)}, election_id)
+
+
+def test_get_quadratic_voting_election_results(client, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["quadratic_voting"]
+    ballots = [
+        [20, 30, 50],
+        [34, 33, 33],
+        [60, 20, 20],
+        [10, 0, 90],
+        [40, 35, 25],
+        [100, 0, 0],
+    ]
+
+    response = client.get(f"/elections/{election_id}/results")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["voting_system"] == "quadratic_voting"
+    expected = [sum(math.sqrt(ballot[i]) for ballot in ballots) for i in range(3)]
+    assert [result["votes"] for result in data["results"]] == pytest.approx(expected)
+
+
+def test_vote_over_credit_budget_is_rejected(client):
+    response = client.post(
+        "/elections/",
+        json={
+            "title": "Quadratic Election (Budget)",
+            "voting_system": "quadratic_voting",
+            "end_time": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
+            "candidates": [{"name": "Candidate 1"}, {"name": "Candidate 2"}],
+            "voter_emails": ["quad_budget_user1@example.com"],
+            "credit_budget": 25,
+        },
+    )
+    assert response.status_code == 200
+    election = response.json()
+    candidate_ids = [candidate["id"] for candidate in election["candidates"]]
+    auth_token = create_auth_token(
+        "quad_budget_user1@example.com",
+        get_otp_from_csv("quad_budget_user1@example.com"),
+    )
+
+    response = client.post(
+        f"/elections/{election['id']}/vote",
+        headers={"Authorization": f"Bearer {auth_token}"},
+        json={"vote": json.dumps({str(candidate_ids[0]): 16, str(candidate_ids[1]): 16})},
+    )
+    assert response.status_code == 400
+
+    cast_vote(
+        client,
+        "quad_budget_user1@example.com",
+        {"vote": json.dumps({str(candidate_ids[0]): 16, str(candidate_ids[1]): 9})},
+        election["id"],
+    )
+
+
+@pytest.mark.parametrize(
+    "voting_system, ballots, expected_statements",
+    [
+        ("traditional", [0, 1], ["DELETE", "SELECT", "INSERT", "UPDATE"]),
+        (
+            "ranked_choice",
+            [[0, 1], [1, 0]],
+            ["DELETE", "SELECT", "INSERT", "INSERT", "UPDATE"],
+        ),
+        ("score_voting", [[3, 1], [2, 2]], ["DELETE", "SELECT", "INSERT", "INSERT"]),
+    ],
+)
+def test_vote_is_a_single_transaction(client, voting_system, ballots, expected_statements):
+    emails = [f"query_{voting_system}_user{i}@example.com" for i in range(len(ballots))]
+    response = client.post(
+        "/elections/",
+        json={
+            "title": f"Query Count Election ({voting_system})",
+            "voting_system": voting_system,
+            "end_time": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
+            "candidates": [{"name": "Candidate 1"}, {"name": "Candidate 2"}],
+            "voter_emails": emails,
+        },
+    )
+    assert response.status_code == 200
+    election = response.json()
+    candidate_ids = [candidate["id"] for candidate in election["candidates"]]
+
+    def ballot(values):
+        if voting_system == "traditional":
+            return {"vote": candidate_ids[values]}
+        return {"vote": json.dumps(dict(zip(map(str, candidate_ids), values)))}
+
+    # The first vote loads the election and its candidates
+    cast_vote(client, emails[0], ballot(ballots[0]), election["id"])
+    with count_queries() as statements:
+        cast_vote(client, emails[1], ballot(ballots[1]), election["id"])
+    assert [s for s in statements if s not in ("BEGIN", "COMMIT")] == expected_statements
+
+    # Replayed and unknown tokens are rejected without touching the database
+    for token in (
+        create_auth_token(emails[1], get_otp_from_csv(emails[1])),
+        create_auth_token(emails[1], "not-the-otp"),
+    ):
+        with count_queries() as statements:
+            response = client.post(
+                f"/elections/{election['id']}/vote",
+                headers={"Authorization": f"Bearer {token}"},
+                json=ballot(ballots[1]),
+            )
+        assert response.status_code == 401
+        assert statements == []
+
+
+def test_vote_refused_once_the_election_is_finalized(client):
+    email = "late_voter@example.com"
+    response = client.post(
+        "/elections/",
+        json={
+            "title": "Finalized Mid-Vote",
+            "voting_system": "traditional",
+            "end_time": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
+            "candidates": [{"name": "Candidate 1"}, {"name": "Candidate 2"}],
+            "voter_emails": [email],
+        },
+    )
+    election = response.json()
+    election_id = election["id"]
+    # Before its end time, so the ballot is valid, but the finalizer has
+    # already stored the results
+    with TestingSessionLocal() as db:
+        db.get(Election, election_id).finalized_at = datetime.now(timezone.utc)
+        db.commit()
+
+    auth_token = create_auth_token(email, get_otp_from_csv(email))
+    response = client.post(
+        f"/elections/{election_id}/vote",
+        headers={"Authorization": f"Bearer {auth_token}"},
+        json={"vote": election["candidates"][0]["id"]},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Election has ended"
+    with TestingSessionLocal() as db:
+        assert db.query(AuthorizationToken).filter(
+            AuthorizationToken.election_id == election_id
+        ).count() == 1
+        assert not db.query(CandidateTally).filter(
+            CandidateTally.election_id == election_id, CandidateTally.votes > 0
+        ).count()
+
+
+def create_import_election(client, voting_system, emails):
+    response = client.post(
+        "/elections/",
+        json={
+            "title": f"Import Election ({voting_system})",
+            "voting_system": voting_system,
+            "end_time": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
+            "candidates": [{"name": "Candidate 1"}, {"name": "Candidate 2"}],
+            "voter_emails": emails,
+        },
+    )
+    assert response.status_code == 200
+    election = response.json()
+    tokens = [create_auth_token(email, get_otp_from_csv(email)) for email in emails]
+    return election, [candidate["id"] for candidate in election["candidates"]], tokens
+
+
+def test_import_ballots_csv(client):
+    emails = [f"import_csv_user{i}@example.com" for i in range(5)]
+    election, candidate_ids, tokens = create_import_election(
+        client, "traditional", emails
+    )
+    body = "\n".join(
+        [
+            "token,vote",
+            f"{tokens[0]},{candidate_ids[0]}",
+            f"{tokens[1]},{candidate_ids[1]}",
+            f"{tokens[0]},{candidate_ids[1]}",
+            "",
+            f"{tokens[2]},999999",
+            f"{tokens[3]},not-a-candidate",
+            "not-a-token,1",
+            "just one field",
+            f"{tokens[4]},{candidate_ids[0]}",
+        ]
+    )
+
+    # Small chunks so the duplicate token lands in a later transaction
+    with patch("application.app.IMPORT_CHUNK_SIZE", 2):
+        response = client.post(
+            f"/elections/{election['id']}/ballots",
+            content=body,
+            headers={"Content-Type": "text/csv"},
+        )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["accepted"], data["rejected"]) == (3, 5)
+    assert [error["line"] for error in data["errors"]] == [4, 6, 7, 8, 9]
+    assert data["errors"][0]["error"] == "Invalid OTP"
+    assert data["errors_truncated"] is False
+
+    results = client.get(f"/elections/{election['id']}/results").json()
+    assert [result["votes"] for result in results["results"]] == [2.0, 1.0]
+    # Imported tokens are spent for the vote endpoint too
+    response = client.post(
+        f"/elections/{election['id']}/vote",
+        headers={"Authorization": f"Bearer {tokens[1]}"},
+        json={"vote": candidate_ids[0]},
+    )
+    assert response.status_code == 401
+
+
+def test_import_ballots_ndjson(client):
+    emails = [f"import_ndjson_user{i}@example.com" for i in range(3)]
+    election, candidate_ids, tokens = create_import_election(
+        client, "ranked_choice", emails
+    )
+    first, second = map(str, candidate_ids)
+    lines = [
+        {"token": tokens[0], "vote": json.dumps({first: 1, second: 2})},
+        {"token": tokens[1], "vote": {second: 1, first: 2}},
+        {"token": tokens[2], "vote": 1},
+    ]
+    body = "".join(json.dumps(line) + "\n" for line in lines) + "{not json\n"
+
+    response = client.post(
+        f"/elections/{election['id']}/ballots",
+        params={"format": "ndjson"},
+        content=body,
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["accepted"], data["rejected"]) == (2, 2)
+    assert [error["line"] for error in data["errors"]] == [3, 4]
+    assert data["errors"][1]["error"].startswith("Invalid line")
+
+    votes = client.get(f"/elections/{election['id']}/all_votes").json()["votes"]
+    assert json.loads(votes[tokens[1]]) == {second: 1, first: 2}
+
+    response = client.post(
+        f"/elections/{election['id']}/ballots",
+        content=body,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 415
+
+
+@contextmanager
+def capture_queries():
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.split()[0].upper() in ("SELECT", "UPDATE", "DELETE"):
+            # One parameter set is enough to plan an executemany
+            queries.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.mark.parametrize(
+    "voting_system, ballot_values",
+    [
+        ("traditional", 0),
+        ("ranked_choice", [1, 2]),
+        ("score_voting", [3, 1]),
+        ("quadratic_voting", [4, 9]),
+    ],
+)
+def test_hot_queries_use_indexes(client, voting_system, ballot_values):
+    emails = [f"explain_{voting_system}_user{i}@example.com" for i in range(2)]
+    response = client.post(
+        "/elections/",
+        json={
+            "title": f"Explain Election ({voting_system})",
+            "voting_system": voting_system,
+            "end_time": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
+            "candidates": [{"name": "Candidate 1"}, {"name": "Candidate 2"}],
+            "voter_emails": emails,
+        },
+    )
+    election = response.json()
+    candidate_ids = [candidate["id"] for candidate in election["candidates"]]
+    if voting_system == "traditional":
+        ballot = {"vote": candidate_ids[ballot_values]}
+    else:
+        ballot = {"vote": json.dumps(dict(zip(map(str, candidate_ids), ballot_values)))}
+
+    with capture_queries() as queries:
+        for email in emails:
+            cast_vote(client, email, ballot, election["id"])
+        client.get(f"/elections/{election['id']}/results")
+        client.get(f"/elections/{election['id']}/all_votes?limit=1")
+        client.get(f"/elections/{election['id']}/all_votes?limit=1&after_id=1")
+        client.get(f"/elections/{election['id']}/email_status")
+        # Final results read the stored winner and tally the raw ballots
+        with TestingSessionLocal() as db:
+            db.query(Election).filter(Election.id == election["id"]).update(
+                {Election.end_time: datetime.now(timezone.utc) - timedelta(days=1)}
+            )
+            db.commit()
+        election_info.clear()
+        result_cache.clear()
+        assert client.get(f"/elections/{election['id']}/results").status_code == 200
+
+    # Every table access is an index or primary key lookup, never a full scan
+    with engine.connect() as connection:
+        for statement, parameters in queries:
+            for *_, detail in connection.exec_driver_sql(
+                "EXPLAIN QUERY PLAN " + statement, parameters
+            ):
+                assert detail.startswith("SEARCH"), (detail, statement)
+
+
+def test_metrics_endpoint(client, election_data):
+    election_ids, _ = election_data
+    election_id = election_ids["traditional"]
+    client.post(
+        f"/elections/{election_id}/vote",
+        headers={"Authorization": "Bearer not-a-token"},
+        json={"vote": 1},
+    )
+    client.get(f"/elections/{election_id}/results")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert 'votes_rejected_total{reason="invalid_token"}' in {
+        line.rsplit(" ", 1)[0] for line in lines
+    }
+    assert any(
+        line.startswith(
+            'http_request_duration_seconds_count{method="GET",'
+            'route="/elections/{election_id}/results"}'
+        )
+        for line in lines
+    )
+    assert any(
+        line.startswith('votes_accepted_total{voting_system="traditional"}')
+        for line in lines
+    )
+    assert "email_queue_depth 0.0" in lines
@@ -0,0 +1,131 @@
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import application.app
+from application.app import async_router, get_db
+from application.async_db import async_database_url, get_async_db
+
+pytest.importorskip("aiosqlite")
+
+
+def test_async_database_url():
+    assert async_database_url("sqlite:///./elections.db") == (
+        "sqlite+aiosqlite:///./elections.db"
+    )
+    assert async_database_url("postgresql://u:p@db/elections") == (
+        "postgresql+asyncpg://u:p@db/elections"
+    )
+    assert async_database_url("postgresql+psycopg2://u:p@db/elections") == (
+        "postgresql+asyncpg://u:p@db/elections"
+    )
+
+
+@pytest.fixture(scope="module")
+def client(engine, session_factory):
+    async_engine = create_async_engine(async_database_url(str(engine.url)))
+    AsyncTestingSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    def override_get_db():
+        with session_factory() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(async_router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def election(make_election):
+    return make_election(
+        "Async Election",
+        voting_system="ranked_choice",
+        candidates=["A", "B", "C"],
+        voters=[f"async_user{i}@example.com" for i in range(3)],
+        end_time=datetime.now(timezone.utc) + timedelta(days=1),
+    )
+
+
+def test_async_vote_and_results(client, election):
+    election_id, candidate_ids, tokens = election
+    rankings = [[0, 1, 2], [1, 0, 2], [1, 2, 0]]
+    for token, ranking in zip(tokens, rankings):
+        ballot = {str(candidate_ids[i]): rank + 1 for rank, i in enumerate(ranking)}
+        response = client.post(
+            f"/elections/{election_id}/vote",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"vote": json.dumps(ballot)},
+        )
+        assert response.status_code == 200
+
+    response = client.post(
+        f"/elections/{election_id}/vote",
+        headers={"Authorization": "Bearer not-a-token"},
+        json={"vote": json.dumps({str(candidate_ids[0]): 1})},
+    )
+    assert response.status_code == 401
+
+    response = client.get(f"/elections/{election_id}/results")
+    assert response.status_code == 200
+    assert [result["votes"] for result in response.json()["results"]] == [
+        1.0,
+        2.0,
+        0.0,
+    ]
+
+
+def test_async_results_tally_off_the_event_loop(client, make_election):
+    election_id, candidate_ids, tokens = make_election(
+        "Async Score",
+        voting_system="score_voting",
+        candidates=["A", "B"],
+        voters=["score_a@example.com", "score_b@example.com"],
+        end_time=datetime.now(timezone.utc) + timedelta(days=1),
+    )
+    for token, scores in zip(tokens, [[4, 1], [2, 0]]):
+        ballot = dict(zip(map(str, candidate_ids), scores))
+        response = client.post(
+            f"/elections/{election_id}/vote",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"vote": json.dumps(ballot)},
+        )
+        assert response.status_code == 200
+
+    # Only the tally itself, and finalizing, go to the threadpool
+    offloaded = []
+    run_in_threadpool = application.app.run_in_threadpool
+
+    async def recording(fn, *args):
+        offloaded.append(fn.__name__)
+        return await run_in_threadpool(fn, *args)
+
+    with patch("application.app.run_in_threadpool", recording):
+        response = client.get(f"/elections/{election_id}/results")
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["votes"] for result in results] == [6.0, 1.0]
+        assert [result["average"] for result in results] == [3.0, 0.5]
+        assert offloaded == ["tally_ballots"]
+
+        with patch("application.app.datetime") as mock_app_datetime:
+            mock_app_datetime.now.return_value = datetime.now(
+                timezone.utc
+            ) + timedelta(days=2)
+            response = client.get(f"/elections/{election_id}/results")
+        assert response.status_code == 200
+        data = response.json()
+        assert [result["votes"] for result in data["results"]] == [6.0, 1.0]
+        assert data["winner"]["id"] == candidate_ids[0]
+        assert offloaded == ["tally_ballots", "finalize_election"]
@@ -0,0 +1,34 @@
+from application.bulk import insert_candidates, insert_voter_tokens
+from application.models import AuthorizationToken, Candidate
+from application.utils import create_auth_token
+
+
+def test_voter_tokens_verify_like_single_tokens(make_election, session_factory):
+    election_id, _, _ = make_election("Voter Tokens")
+    identities = {}
+    emails = [f"token_user{i}@example.com" for i in range(25)]
+    with session_factory() as db:
+        assert (
+            insert_voter_tokens(
+                election_id, emails, db, on_batch=identities.update, batch_size=10
+            )
+            == 25
+        )
+        stored = {
+            token
+            for (token,) in db.query(AuthorizationToken.auth_token).filter(
+                AuthorizationToken.election_id == election_id
+            )
+        }
+    assert list(identities) == emails
+    assert stored == {create_auth_token(email, otp) for email, otp in identities.items()}
+
+
+def test_insert_no_candidates(make_election, session_factory):
+    election_id, _, _ = make_election("No Candidates")
+    with session_factory() as db:
+        assert insert_candidates(election_id, [], db) == []
+        assert (
+            db.query(Candidate).filter(Candidate.election_id == election_id).count()
+            == 0
+        )
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from application.cache import BallotVersions, ResultCache, TokenIndex
+from application.models import Election, AuthorizationToken
+from application.utils import create_auth_token
+
+NOW = datetime(2030, 1, 1, tzinfo=timezone.utc)
+LATER = NOW + timedelta(hours=1)
+
+
+def test_cache_serves_until_ballot_version_changes():
+    versions = BallotVersions()
+    cache = ResultCache(versions)
+    cache.put(1, versions.get(1), False, LATER, "results")
+
+    assert cache.get(1, NOW) == "results"
+    versions.bump(1)
+    assert cache.get(1, NOW) is None
+
+
+def test_cache_misses_once_election_ends():
+    versions = BallotVersions()
+    cache = ResultCache(versions)
+    cache.put(1, versions.get(1), False, LATER, "live results")
+
+    assert cache.get(1, LATER + timedelta(seconds=1)) is None
+
+
+def test_cache_evicts_least_recently_used():
+    versions = BallotVersions()
+    cache = ResultCache(versions, max_entries=2)
+    for election_id in (1, 2):
+        cache.put(election_id, 0, False, None, election_id)
+    cache.get(1, NOW)
+    cache.put(3, 0, False, None, 3)
+
+    assert cache.get(2, NOW) is None
+    assert cache.get(1, NOW) == 1
+    assert cache.get(3, NOW) == 3
+
+
+def test_cache_staleness_window_tolerates_new_ballots():
+    versions = BallotVersions()
+    cache = ResultCache(versions, max_staleness=5.0)
+    with patch("application.cache.time.monotonic", return_value=100.0):
+        cache.put(1, versions.get(1), False, None, "results")
+    versions.bump(1)
+
+    with patch("application.cache.time.monotonic", return_value=104.0):
+        assert cache.get(1, NOW) == "results"
+    with patch("application.cache.time.monotonic", return_value=105.0):
+        assert cache.get(1, NOW) is None
+
+
+def test_token_index_rejects_unknown_and_consumed_tokens(session_factory):
+    tokens = [create_auth_token(f"index_user{i}@example.com", "otp") for i in range(3)]
+    with session_factory() as db:
+        election = Election(
+            title="Token Index", voting_system="traditional", tokens_issued_at=NOW
+        )
+        db.add(election)
+        db.flush()
+        db.add_all(
+            AuthorizationToken(auth_token=token, election_id=election.id)
+            for token in tokens
+        )
+        db.commit()
+
+        index = TokenIndex()
+        assert all(index.might_contain(election.id, token, db) for token in tokens)
+        assert not index.might_contain(election.id, "0" * 64, db)
+        assert not index.might_contain(election.id, "not-a-token", db)
+        index.consume(election.id, tokens[0])
+        assert not index.might_contain(election.id, tokens[0], db)
+        assert index.stats() == {"hits": 3, "misses": 3}
+
+
+def test_token_index_drops_a_load_overtaken_by_new_tokens(session_factory):
+    first, second = (
+        create_auth_token(f"race_user{i}@example.com", "otp") for i in range(2)
+    )
+    with session_factory() as db:
+        election = Election(
+            title="Token Index Race", voting_system="traditional", tokens_issued_at=NOW
+        )
+        db.add(election)
+        db.flush()
+        db.add(AuthorizationToken(auth_token=first, election_id=election.id))
+        db.commit()
+
+        index = TokenIndex()
+        load = index._load
+
+        def load_then_issue_more(election_id, db):
+            loaded = load(election_id, db)
+            # Another batch lands between the load and storing it
+            with session_factory() as other:
+                other.add(AuthorizationToken(auth_token=second, election_id=election_id))
+                other.commit()
+            index.invalidate(election_id)
+            return loaded
+
+        with patch.object(index, "_load", side_effect=load_then_issue_more):
+            assert index.might_contain(election.id, first, db)
+        assert index.might_contain(election.id, second, db)
+
+
+def test_token_index_trusts_no_load_before_all_tokens_are_stored(session_factory):
+    first, second = (
+        create_auth_token(f"issuing_user{i}@example.com", "otp") for i in range(2)
+    )
+    with session_factory() as db:
+        election = Election(title="Token Index Issuing", voting_system="traditional")
+        db.add(election)
+        db.flush()
+        db.add(AuthorizationToken(auth_token=first, election_id=election.id))
+        db.commit()
+
+        index = TokenIndex()
+        assert index.might_contain(election.id, second, db)
+        # Another worker process stores the rest, without invalidating this index
+        with session_factory() as other:
+            other.add(AuthorizationToken(auth_token=second, election_id=election.id))
+            other.get(Election, election.id).tokens_issued_at = NOW
+            other.commit()
+        assert index.might_contain(election.id, second, db)
+        assert not index.might_contain(election.id, "0" * 64, db)
+
+
+def test_token_index_remembers_unusable_elections(session_factory):
+    with session_factory() as db:
+        election = Election(
+            title="Plain Tokens", voting_system="traditional", tokens_issued_at=NOW
+        )
+        db.add(election)
+        db.flush()
+        db.add(AuthorizationToken(auth_token="plain-token", election_id=election.id))
+        db.commit()
+
+        index = TokenIndex()
+        with patch.object(index, "_load", wraps=index._load) as load:
+            for _ in range(3):
+                assert index.might_contain(election.id, "0" * 64, db)
+        assert load.call_count == 1
@@ -0,0 +1,217 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import pytest
+from sqlalchemy.exc import IntegrityError
+from application.app import compute_election_results
+from application.engines import TallyResult, tally_election
+from application.finalizer import FinalizerScheduler, finalize_election
+from application.models import Candidate, Election, ElectionWinner, Vote
+
+
+@pytest.fixture
+def create_election(make_election, session_factory):
+    """Return a function storing a traditional election ending at ``end_time``,
+    with one ballot per entry of ``choices`` (a candidate index)."""
+
+    def create_election(end_time, choices):
+        election_id, candidate_ids, _ = make_election(
+            "Finalizer", candidates=["A", "B"], end_time=end_time
+        )
+        with session_factory() as db:
+            db.add_all(
+                Vote(
+                    validation_token=f"token{i}",
+                    election_id=election_id,
+                    candidate_id=candidate_ids[choice],
+                )
+                for i, choice in enumerate(choices)
+            )
+            db.commit()
+        return election_id, candidate_ids
+
+    return create_election
+
+
+def test_finalize_election_stores_results(create_election, session_factory):
+    election_id, candidate_ids = create_election(
+        datetime.now(timezone.utc) - timedelta(minutes=1), [1, 1, 0]
+    )
+    with session_factory() as db:
+        assert finalize_election(election_id, db)
+        assert not finalize_election(election_id, db)
+
+    with session_factory() as db:
+        assert db.get(Election, election_id).finalized_at is not None
+        votes = dict(
+            db.query(Candidate.id, Candidate.votes).filter(
+                Candidate.election_id == election_id
+            )
+        )
+        assert votes == {candidate_ids[0]: 1.0, candidate_ids[1]: 2.0}
+        (winner,) = db.query(ElectionWinner).filter(
+            ElectionWinner.election_id == election_id
+        )
+        assert (winner.winner_id, winner.votes) == (candidate_ids[1], 2.0)
+
+
+def test_scheduler_finalizes_at_end_time(create_election, session_factory):
+    end_time = datetime.now(timezone.utc) + timedelta(seconds=0.5)
+    election_id, candidate_ids = create_election(end_time, [0, 1])
+    later_id, _ = create_election(end_time + timedelta(days=1), [0])
+
+    scheduler = FinalizerScheduler(
+        session_factory=session_factory, grace=0.1, resync_interval=60
+    ).start()
+    try:
+        # Picked up from the database on start
+        assert {election_id, later_id} <= set(scheduler.pending())
+        with session_factory() as db:
+            assert db.get(Election, election_id).finalized_at is None
+
+        deadline = time.monotonic() + 5
+        while election_id in scheduler.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        scheduler.stop()
+
+    with session_factory() as db:
+        assert db.get(Election, election_id).finalized_at is not None
+        assert db.get(Election, later_id).finalized_at is None
+        (winner,) = db.query(ElectionWinner).filter(
+            ElectionWinner.election_id == election_id
+        )
+        assert winner.winner_id is None
+
+
+def test_concurrent_finalizations_share_one_tally(create_election, session_factory):
+    election_id, candidate_ids = create_election(
+        datetime.now(timezone.utc) - timedelta(minutes=1), [0, 0, 1]
+    )
+    tallies = []
+    release = threading.Event()
+
+    def slow_tally(election, db):
+        tallies.append(election.id)
+        release.wait(5)
+        return TallyResult({candidate_ids[0]: 2.0, candidate_ids[1]: 1.0}, None)
+
+    def finalize():
+        with session_factory() as db:
+            return finalize_election(election_id, db, trigger="request")
+
+    with patch("application.finalizer.tally_election", slow_tally):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(finalize) for _ in range(8)]
+            while not tallies:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            release.set()
+            assert [future.result() for future in futures] == [True] * 8
+
+    assert tallies == [election_id]
+    with session_factory() as db:
+        assert (
+            db.query(ElectionWinner)
+            .filter(ElectionWinner.election_id == election_id)
+            .count()
+            == 1
+        )
+
+
+def test_finalization_lost_to_another_process(create_election, session_factory):
+    election_id, candidate_ids = create_election(
+        datetime.now(timezone.utc) - timedelta(minutes=1), [0]
+    )
+
+    def tally_while_another_worker_finishes(election, db):
+        # Another process claims and stores the election mid-tally
+        with session_factory() as other:
+            other.add(ElectionWinner(election_id=election_id, winner_id=None, votes=0))
+            other.get(Election, election_id).finalized_at = datetime.now(timezone.utc)
+            other.commit()
+        return TallyResult({candidate_ids[0]: 1.0}, None)
+
+    with patch(
+        "application.finalizer.tally_election", tally_while_another_worker_finishes
+    ):
+        with session_factory() as db:
+            assert not finalize_election(election_id, db)
+
+    with session_factory() as db:
+        (winner,) = db.query(ElectionWinner).filter(
+            ElectionWinner.election_id == election_id
+        )
+        assert winner.winner_id is None
+        with pytest.raises(IntegrityError):
+            db.add(ElectionWinner(election_id=election_id, winner_id=None, votes=0))
+            db.commit()
+
+
+def test_ballot_landing_mid_tally_is_counted(create_election, session_factory):
+    election_id, candidate_ids = create_election(
+        datetime.now(timezone.utc) - timedelta(minutes=1), [0, 0]
+    )
+    tallies = []
+
+    def tally_while_a_ballot_lands(election, db):
+        result = tally_election(election, db)
+        if not tallies:
+            # Committed after the tally read the ballots, before the claim
+            with session_factory() as other:
+                other.add(
+                    Vote(
+                        validation_token="late",
+                        election_id=election_id,
+                        candidate_id=candidate_ids[1],
+                    )
+                )
+                other.commit()
+        tallies.append(result)
+        return result
+
+    with patch("application.finalizer.tally_election", tally_while_a_ballot_lands):
+        with session_factory() as db:
+            assert finalize_election(election_id, db)
+
+    assert len(tallies) == 2
+    with session_factory() as db:
+        votes = dict(
+            db.query(Candidate.id, Candidate.votes).filter(
+                Candidate.election_id == election_id
+            )
+        )
+    assert votes == {candidate_ids[0]: 2.0, candidate_ids[1]: 1.0}
+
+
+def test_request_waiting_on_a_finalization_sees_its_totals(
+    create_election, session_factory
+):
+    election_id, candidate_ids = create_election(
+        datetime.now(timezone.utc) - timedelta(minutes=1), [0, 0, 0, 0, 1]
+    )
+    started = threading.Event()
+    release = threading.Event()
+    def slow_tally(election, db):
+        started.set()
+        release.wait(5)
+        return tally_election(election, db)
+
+    def results():
+        with session_factory() as db:
+            election = db.get(Election, election_id)
+            response = compute_election_results(election, True, db)
+            return {result.id: result.votes for result in response.results}
+
+    with patch("application.finalizer.tally_election", slow_tally):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(results)
+            started.wait(5)
+            # The second request loads its candidates, then waits on the first
+            waiter = pool.submit(results)
+            time.sleep(0.2)
+            release.set()
+            expected = {candidate_ids[0]: 4.0, candidate_ids[1]: 1.0}
+            assert leader.result() == waiter.result() == expected
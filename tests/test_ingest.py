@@ -0,0 +1,117 @@
+import threading
+from datetime import datetime
+import pytest
+from sqlalchemy import event
+from application.ingest import ElectionClosed, GroupCommitWriter, PendingVote
+from application.models import CandidateTally, Vote
+
+
+@pytest.fixture
+def election(make_election):
+    return make_election(
+        "Group Commit",
+        candidates=["A", "B"],
+        voters=[f"group_user{i}@example.com" for i in range(20)],
+    )
+
+
+def pending_vote(election_id, token, candidate_id):
+    return PendingVote(
+        election_id=election_id,
+        voting_system="traditional",
+        validation_token=token,
+        candidate_id=candidate_id,
+        vote_string=None,
+        packed_vote=None,
+        tally_candidate_id=candidate_id,
+    )
+
+
+def test_group_commit_batches_concurrent_votes(election, engine, session_factory):
+    election_id, candidate_ids, tokens = election
+    commits = []
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, "commit", listener)
+    writer = GroupCommitWriter(
+        session_factory=session_factory, max_batch=50, interval=0.2
+    ).start()
+    try:
+        futures = []
+        lock = threading.Lock()
+
+        def cast(i):
+            future = writer.submit(
+                pending_vote(election_id, tokens[i], candidate_ids[i % 2])
+            )
+            with lock:
+                futures.append(future)
+
+        threads = [threading.Thread(target=cast, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(future.result(timeout=5) for future in futures)
+    finally:
+        writer.stop()
+        event.remove(engine, "commit", listener)
+
+    assert len(commits) < 20
+    with session_factory() as db:
+        assert db.query(Vote).filter(Vote.election_id == election_id).count() == 20
+        assert sorted(
+            tally.votes
+            for tally in db.query(CandidateTally).filter(
+                CandidateTally.election_id == election_id
+            )
+        ) == [10.0, 10.0]
+
+
+def test_group_commit_rejects_reused_tokens(election, session_factory):
+    election_id, candidate_ids, tokens = election
+    writer = GroupCommitWriter(session_factory=session_factory, interval=0.1).start()
+    try:
+        futures = [
+            writer.submit(pending_vote(election_id, token, candidate_ids[0]))
+            for token in (tokens[0], tokens[0], "not-a-token")
+        ]
+        assert [future.result(timeout=5) for future in futures] == [
+            True,
+            False,
+            False,
+        ]
+    finally:
+        writer.stop()
+
+    with session_factory() as db:
+        assert db.query(Vote).filter(Vote.election_id == election_id).count() == 1
+
+
+def test_group_commit_failure_only_reaches_the_failing_ballot(
+    election, make_election, session_factory
+):
+    election_id, candidate_ids, tokens = election
+    closed_id, [closed_candidate_id], [late_token] = make_election(
+        "Finalized",
+        candidates=["C"],
+        voters=["late_user@example.com"],
+        finalized_at=datetime.now(),
+    )
+
+    writer = GroupCommitWriter(session_factory=session_factory, interval=0.1).start()
+    try:
+        futures = [
+            writer.submit(pending_vote(election_id, tokens[0], candidate_ids[0])),
+            writer.submit(pending_vote(closed_id, late_token, closed_candidate_id)),
+            writer.submit(pending_vote(election_id, tokens[1], candidate_ids[1])),
+        ]
+        assert futures[0].result(timeout=5)
+        with pytest.raises(ElectionClosed):
+            futures[1].result(timeout=5)
+        assert futures[2].result(timeout=5)
+    finally:
+        writer.stop()
+
+    with session_factory() as db:
+        assert db.query(Vote).filter(Vote.election_id == election_id).count() == 2
+        assert db.query(Vote).filter(Vote.election_id == closed_id).count() == 0
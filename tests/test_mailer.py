@@ -0,0 +1,175 @@
+import socket
+import pytest
+from application.models import EmailDelivery
+from application.mailer import EmailDispatcher
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+
+class CollectingHandler:
+    def __init__(self):
+        self.sessions = 0
+        self.messages = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        self.sessions += 1
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def election_id(make_election):
+    election_id, _, _ = make_election("Email Election")
+    return election_id
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = CollectingHandler()
+    port = free_port()
+    controller = aiosmtpd_controller.Controller(
+        handler, hostname="127.0.0.1", port=port
+    )
+    controller.start()
+    monkeypatch.setenv("SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(port))
+    monkeypatch.setenv("SMTP_STARTTLS", "false")
+    monkeypatch.setenv("SENDER_EMAIL", "elections@example.com")
+    monkeypatch.delenv("SENDER_PASSWORD", raising=False)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+def delivery_statuses(session_factory):
+    def delivery_statuses(election_id):
+        with session_factory() as db:
+            return [
+                (delivery.status, delivery.attempts)
+                for delivery in db.query(EmailDelivery).filter(
+                    EmailDelivery.election_id == election_id
+                )
+            ]
+
+    return delivery_statuses
+
+
+def test_dispatcher_reuses_pooled_connections(
+    smtp_server, election_id, delivery_statuses, session_factory
+):
+    dispatcher = EmailDispatcher(
+        workers=2, queue_size=4, session_factory=session_factory
+    ).start()
+    dispatcher.enqueue_otps(
+        election_id,
+        "Email Election",
+        {f"voter{i}@example.com": f"otp{i}" for i in range(10)},
+    )
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert len(smtp_server.messages) == 10
+    assert smtp_server.sessions <= 2
+    assert delivery_statuses(election_id) == [("sent", 1)] * 10
+
+
+def test_dispatcher_records_failures_after_retries(
+    election_id, delivery_statuses, make_election, session_factory
+):
+    attempts = []
+
+    def refuse_connection():
+        attempts.append(1)
+        raise ConnectionRefusedError("SMTP server unavailable")
+
+    dispatcher = EmailDispatcher(
+        workers=1,
+        max_attempts=3,
+        retry_backoff=0,
+        session_factory=session_factory,
+        connect=refuse_connection,
+    ).start()
+    failing_election_id, _, _ = make_election("Unreachable")
+    dispatcher.enqueue(
+        failing_election_id, [("voter@example.com", "Subject", "Body")]
+    )
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert len(attempts) == 3
+    assert delivery_statuses(failing_election_id) == [("failed", 3)]
+
+
+def test_dispatcher_resumes_queued_messages(
+    smtp_server, delivery_statuses, make_election, session_factory
+):
+    election_id, _, _ = make_election("Restarted")
+    # Never started, as if the process stopped before sending; enqueue does
+    # not wait for room in the queue
+    stopped = EmailDispatcher(
+        workers=1, queue_size=2, session_factory=session_factory
+    )
+    stopped.enqueue_otps(
+        election_id,
+        "Restarted",
+        {f"late{i}@example.com": f"otp{i}" for i in range(5)},
+    )
+    assert delivery_statuses(election_id) == [("queued", 0)] * 5
+
+    dispatcher = EmailDispatcher(
+        workers=2, queue_size=2, session_factory=session_factory
+    ).start()
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in smtp_server.messages) == [
+        f"late{i}@example.com" for i in range(5)
+    ]
+    assert delivery_statuses(election_id) == [("sent", 1)] * 5
+    with session_factory() as db:
+        assert db.query(EmailDelivery.body).filter(
+            EmailDelivery.election_id == election_id
+        ).all() == [(None,)] * 5
+
+
+def test_dispatcher_skips_messages_claimed_elsewhere(
+    smtp_server, delivery_statuses, make_election, session_factory
+):
+    election_id, _, _ = make_election("Claimed")
+    other = EmailDispatcher(session_factory=session_factory)
+    other.enqueue(
+        election_id,
+        [
+            ("first@example.com", "Subject", "Body"),
+            ("second@example.com", "Subject", "Body"),
+        ],
+    )
+    with session_factory() as db:
+        first_id = (
+            db.query(EmailDelivery.id)
+            .filter(EmailDelivery.recipient == "first@example.com")
+            .scalar()
+        )
+    # A worker of another process is sending the first message
+    assert other._claim(first_id)
+
+    dispatcher = EmailDispatcher(
+        workers=1, session_factory=session_factory
+    ).start()
+    dispatcher.join()
+    dispatcher.stop()
+
+    assert [envelope.rcpt_tos for envelope in smtp_server.messages] == [
+        ["second@example.com"]
+    ]
+    assert delivery_statuses(election_id) == [("queued", 0), ("sent", 1)]
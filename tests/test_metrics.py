@@ -0,0 +1,60 @@
+from sqlalchemy import create_engine, text
+from application.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    ballots_bucket,
+    db_query_duration,
+    instrument_engine,
+)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ["route"], registry=registry)
+    depth = Gauge("queue_depth", "Queue depth", registry=registry)
+    latency = Histogram(
+        "latency_seconds", "Latency", ["route"], buckets=(0.1, 1.0), registry=registry
+    )
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    depth.set_function(lambda: 7)
+    for value in (0.05, 0.5, 5):
+        latency.labels("/a").observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 3.0',
+        "# HELP queue_depth Queue depth",
+        "# TYPE queue_depth gauge",
+        "queue_depth 7.0",
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_ballots_bucket():
+    assert [ballots_bucket(n) for n in (0, 1, 7, 10, 11, 250_000)] == [
+        "0",
+        "1",
+        "1e1",
+        "1e1",
+        "1e2",
+        "1e6",
+    ]
+
+
+def test_instrumented_engine_times_statements():
+    engine = instrument_engine(create_engine("sqlite://"))
+    before = db_query_duration.labels("SELECT").count
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 2"))
+    assert db_query_duration.labels("SELECT").count == before + 2
@@ -0,0 +1,195 @@
+import json
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from application.models import (
+    AlternativeVote,
+    BallotPattern,
+    Base,
+    CandidateTally,
+    Election,
+)
+from application.ballots import decode_ballots
+from application.migrations import MIGRATIONS, upgrade
+
+LEGACY_INDEXES = [
+    (f"ix_{table}_{column}", table, column)
+    for table, columns in {
+        "elections": ["id", "title"],
+        "candidates": ["id", "name"],
+        "votes": ["id", "validation_token"],
+        "alternative_votes": ["id", "validation_token", "vote_string", "vote"],
+        "authorization_tokens": ["id", "auth_token"],
+        "email_deliveries": ["id", "election_id"],
+        "election_winners": ["id"],
+    }.items()
+    for column in columns
+]
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    # Current schema, rolled back to what the original models created
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(connection)
+        connection.execute(text("ALTER TABLE elections DROP COLUMN credit_budget"))
+        connection.execute(text("ALTER TABLE elections DROP COLUMN finalized_at"))
+        connection.execute(text("ALTER TABLE elections DROP COLUMN tokens_issued_at"))
+        connection.execute(text("ALTER TABLE election_winners DROP COLUMN rounds"))
+        for column in ("subject", "body", "claimed_at"):
+            connection.execute(text(f"ALTER TABLE email_deliveries DROP COLUMN {column}"))
+        connection.execute(text("DROP TABLE candidate_tallies"))
+        for name, table, column in LEGACY_INDEXES:
+            connection.execute(text(f"CREATE INDEX {name} ON {table} ({column})"))
+    yield engine
+    engine.dispose()
+
+
+def test_upgrade_migrates_legacy_database(legacy_engine):
+    with legacy_engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO elections (id, title, voting_system) "
+                "VALUES (1, 'Legacy', 'ranked_choice'), (2, 'Open', 'traditional')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO candidates (id, name, election_id, votes) "
+                "VALUES (7, 'A', 1, 0), (8, 'B', 1, 0), (9, 'C', 1, 0), "
+                "(10, 'D', 2, 0), (11, 'E', 2, 0)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO votes (validation_token, election_id, candidate_id) "
+                "VALUES ('v1', 2, 10), ('v2', 2, 11), ('v3', 2, 11)"
+            )
+        )
+        ballot = json.dumps({"9": 1, "7": 2})
+        connection.execute(
+            text(
+                "INSERT INTO alternative_votes "
+                "(validation_token, election_id, vote_string, vote) "
+                "VALUES ('token', 1, :ballot, :blob)"
+            ),
+            {"ballot": ballot, "blob": ballot.encode()},
+        )
+        # A float rank, a deleted candidate and a ballot that is not JSON
+        for token, vote_string in [
+            ("float", '{"9": 1.5}'),
+            ("deleted", '{"42": 1}'),
+            ("garbled", "9>7"),
+        ]:
+            connection.execute(
+                text(
+                    "INSERT INTO alternative_votes "
+                    "(validation_token, election_id, vote_string, vote) "
+                    "VALUES (:token, 1, :ballot, :blob)"
+                ),
+                {"token": token, "ballot": vote_string, "blob": vote_string.encode()},
+            )
+        connection.execute(
+            text(
+                "INSERT INTO election_winners (id, election_id, winner_id, votes) "
+                "VALUES (1, 1, 9, 1), (2, 1, 9, 1)"
+            )
+        )
+
+    upgrade(legacy_engine)
+    upgrade(legacy_engine)
+
+    Session = sessionmaker(bind=legacy_engine)
+    with Session() as db:
+        (packed,) = db.query(AlternativeVote.vote).one()
+        election = db.get(Election, 1)
+        tallies = dict(
+            db.query(CandidateTally.candidate_id, CandidateTally.votes).filter(
+                CandidateTally.election_id == 2
+            )
+        )
+        applied = db.execute(text("SELECT name FROM schema_migrations")).all()
+        winners = db.execute(text("SELECT id FROM election_winners")).all()
+        patterns = db.query(BallotPattern.pattern, BallotPattern.count).all()
+        unreadable = db.execute(
+            text("SELECT validation_token FROM unreadable_ballots ORDER BY id")
+        ).all()
+    assert decode_ballots([packed], 3).tolist() == [[2, 0, 1]]
+    assert election.credit_budget == 100
+    assert election.finalized_at is not None
+    assert election.tokens_issued_at is not None
+    assert winners == [(1,)]
+    # Open elections get live counters; finalized ones are answered from storage
+    assert tallies == {10: 1.0, 11: 2.0}
+    assert patterns == [(packed, 1)]
+    assert unreadable == [("float",), ("deleted",), ("garbled",)]
+    assert sorted(name for (name,) in applied) == sorted(name for name, _ in MIGRATIONS)
+    inspector = inspect(legacy_engine)
+    for table in Base.metadata.sorted_tables:
+        assert {index["name"] for index in inspector.get_indexes(table.name)} == {
+            index.name for index in table.indexes
+        }
+
+
+def test_upgrade_sets_aside_duplicate_tokens(legacy_engine):
+    # The original check-then-insert voting flow could store a token twice
+    with legacy_engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO elections (id, title, voting_system) "
+                "VALUES (1, 'Plurality', 'traditional'), (2, 'Ranked', 'ranked_choice')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO candidates (id, name, election_id, votes) "
+                "VALUES (10, 'A', 1, 0), (11, 'B', 1, 0), (20, 'C', 2, 0)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO votes (id, validation_token, election_id, candidate_id) "
+                "VALUES (1, 'v1', 1, 10), (2, 'v1', 1, 11), (3, 'v2', 1, 11)"
+            )
+        )
+        ballot = json.dumps({"20": 1})
+        connection.execute(
+            text(
+                "INSERT INTO alternative_votes "
+                "(id, validation_token, election_id, vote_string, vote) "
+                "VALUES (1, 'r1', 2, :ballot, :blob), (2, 'r1', 2, :ballot, :blob)"
+            ),
+            {"ballot": ballot, "blob": ballot.encode()},
+        )
+        connection.execute(
+            text(
+                "INSERT INTO authorization_tokens (id, auth_token, election_id) "
+                "VALUES (1, 'otp', 1), (2, 'otp', 1), (3, 'otp', 2)"
+            )
+        )
+
+    upgrade(legacy_engine)
+
+    with legacy_engine.connect() as connection:
+        kept_votes = connection.execute(text("SELECT id FROM votes ORDER BY id")).all()
+        moved_votes = connection.execute(
+            text("SELECT id, candidate_id FROM votes_duplicates")
+        ).all()
+        kept_ballots = connection.execute(text("SELECT id FROM alternative_votes")).all()
+        moved_ballots = connection.execute(
+            text("SELECT id FROM alternative_votes_duplicates")
+        ).all()
+        kept_tokens = connection.execute(
+            text("SELECT id FROM authorization_tokens ORDER BY id")
+        ).all()
+        patterns = connection.execute(text("SELECT count FROM ballot_patterns")).all()
+    assert kept_votes == [(1,), (3,)]
+    assert moved_votes == [(2, 11)]
+    assert kept_ballots == [(1,)]
+    assert moved_ballots == [(2,)]
+    assert kept_tokens == [(1,), (3,)]
+    assert patterns == [(1,)]
@@ -0,0 +1,23 @@
+from sqlalchemy import text
+from application.models import make_engine, pool_options
+
+
+def test_sqlite_engine_applies_pragmas(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "2500")
+    engine = make_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+    with engine.connect() as connection:
+        pragma = lambda name: connection.execute(text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("busy_timeout") == 2500
+        assert pragma("cache_size") == -64000
+    engine.dispose()
+
+
+def test_pool_options_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    options = pool_options()
+    assert options["pool_size"] == 3
+    assert options["max_overflow"] == 20
+    assert options["pool_pre_ping"] is False
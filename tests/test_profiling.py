@@ -0,0 +1,142 @@
+import cProfile
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+from application import profiling
+from application.profiling import ProfileStore, ProfilingMiddleware
+
+TOKEN = "admin-secret"
+
+
+def busy_tally(n):
+    return sum(i * i for i in range(n))
+
+
+@pytest.fixture
+def client(request, tmp_path, monkeypatch):
+    # Parametrize with False to run the Python 3.12+ single profiler path
+    per_thread = getattr(request, "param", profiling.PER_THREAD)
+    monkeypatch.setattr(profiling, "PER_THREAD", per_thread)
+    monkeypatch.setattr(profiling, "PROFILING", True)
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", TOKEN)
+    store = ProfileStore(str(tmp_path), max_files=2)
+    monkeypatch.setattr(profiling, "store", store)
+
+    router = APIRouter(route_class=profiling.ProfiledRoute)
+
+    @router.get("/sync")
+    def sync_endpoint(n: int = 1000):
+        return {"total": busy_tally(n)}
+
+    @router.get("/async")
+    async def async_endpoint(n: int = 1000):
+        total = await run_in_threadpool(profiling.profiled(busy_tally), n)
+        return {"total": total}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.include_router(profiling.profiles_router)
+    app.add_middleware(ProfilingMiddleware, token=TOKEN, store=store)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_requests_without_the_header_are_not_profiled(client):
+    for headers in ({}, {"X-Profile": "wrong"}):
+        response = client.get("/sync", headers=headers)
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+    assert client.get("/profiles", headers={"X-Profile": TOKEN}).json() == []
+
+
+@pytest.mark.parametrize("path", ["/sync", "/async"])
+def test_profiled_request_is_stored_and_retrievable(client, path):
+    response = client.get(path, headers={"X-Profile": TOKEN})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+
+    (info,) = client.get("/profiles", headers={"X-Profile": TOKEN}).json()
+    assert info["id"] == profile_id
+    assert info["path"] == path
+    assert info["status"] == 200
+
+    text = client.get(f"/profiles/{profile_id}", headers={"X-Profile": TOKEN})
+    assert "busy_tally" in text.text
+    raw = client.get(
+        f"/profiles/{profile_id}?format=pstats", headers={"X-Profile": TOKEN}
+    )
+    assert raw.status_code == 200 and raw.content
+
+
+def test_profile_store_is_bounded_and_admin_only(client):
+    ids = [
+        client.get("/sync", headers={"X-Profile": TOKEN}).headers["x-profile-id"]
+        for _ in range(3)
+    ]
+    listed = [
+        info["id"]
+        for info in client.get("/profiles", headers={"X-Profile": TOKEN}).json()
+    ]
+    assert listed == ids[:0:-1]
+    assert (
+        client.get(f"/profiles/{ids[0]}", headers={"X-Profile": TOKEN}).status_code
+        == 404
+    )
+    assert client.get("/profiles").status_code == 403
+    assert client.get("/profiles/../../etc", headers={"X-Profile": TOKEN}).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/sync", "/async"])
+def test_concurrent_profiled_requests(client, path):
+    # Requests run one profiler at a time; on Python 3.12+ a second active
+    # profiler would make enable() raise
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(
+            pool.map(
+                lambda _: client.get(f"{path}?n=20000", headers={"X-Profile": TOKEN}),
+                range(4),
+            )
+        )
+    assert [response.status_code for response in responses] == [200] * 4
+    profile_ids = {response.headers["x-profile-id"] for response in responses}
+    assert len(profile_ids) == 4
+    listed = {
+        info["id"] for info in client.get("/profiles", headers={"X-Profile": TOKEN}).json()
+    }
+    # The store keeps the newest two
+    assert len(listed) == 2 and listed <= profile_ids
+
+
+@pytest.mark.parametrize("client", [False], indirect=True)
+def test_single_profiler_covers_concurrent_requests(client, monkeypatch, caplog):
+    profilers = []
+
+    class Profile(cProfile.Profile):
+        def __init__(self):
+            super().__init__()
+            profilers.append(self)
+
+    monkeypatch.setattr(profiling.cProfile, "Profile", Profile)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(
+            pool.map(
+                lambda _: client.get("/async?n=20000", headers={"X-Profile": TOKEN}),
+                range(4),
+            )
+        )
+    assert [response.status_code for response in responses] == [200] * 4
+    # One profiler per request, never two enabled at once
+    assert len(profilers) == 4
+    assert "Cannot profile request" not in caplog.text
+    profile_id = client.get("/profiles", headers={"X-Profile": TOKEN}).json()[0]["id"]
+    text = client.get(f"/profiles/{profile_id}", headers={"X-Profile": TOKEN}).text
+    assert "async_endpoint" in text
+
+
+def test_profiled_wraps_once(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING", True)
+    wrapped = profiling.profiled(busy_tally)
+    assert wrapped is not busy_tally
+    assert profiling.profiled(wrapped) is wrapped
@@ -0,0 +1,13 @@
+from collections import Counter
+from application.utils import OTP_ALPHABET, generate_otp_batch
+
+
+def test_generate_otp_batch():
+    otps = generate_otp_batch(2000, length=21)
+    assert len(otps) == len(set(otps)) == 2000
+    assert all(len(otp) == 21 and set(otp) <= set(OTP_ALPHABET) for otp in otps)
+    # Every character is reachable, none of them favoured
+    counts = Counter("".join(otps))
+    assert set(counts) == set(OTP_ALPHABET)
+    assert max(counts.values()) < 2 * min(counts.values())
+    assert generate_otp_batch(0) == []
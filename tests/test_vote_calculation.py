@@ -0,0 +1,175 @@
+import json
+import numpy as np
+import pytest
+from application.tally import (
+    rank_matrix,
+    instant_runoff,
+    score_voting,
+    quadratic_voting,
+)
+from application.ballots import (
+    encode_ballot,
+    decode_ballots,
+    ranks_to_rank_matrix,
+)
+from application.engines import (
+    BALLOT_KINDS,
+    Ballots,
+    TallyResult,
+    compare,
+    engine_for,
+)
+from application.vote_calculation import ranked_choice, validate_score_ballot
+
+
+def ballots(*rankings):
+    return [
+        json.dumps({str(candidate): rank + 1 for rank, candidate in enumerate(r)})
+        for r in rankings
+    ]
+
+
+def test_rank_matrix_pads_short_ballots():
+    matrix = rank_matrix([[2, 0, 1], [1]], 3)
+    assert matrix.dtype == np.int16
+    assert matrix.tolist() == [[2, 0, 1], [1, 3, 3]]
+
+
+def test_instant_runoff_transfers_eliminated_votes():
+    # 0 leads on first preferences, but 2's voters prefer 1
+    matrix = rank_matrix([[0, 1], [0, 1], [1, 0], [1, 0], [2, 1]], 3)
+    assert instant_runoff(matrix, 3) == 1
+
+
+def test_instant_runoff_skips_exhausted_ballots():
+    # 1 is eliminated first and its ballots have no further choice
+    matrix = rank_matrix([[1], [1], [0], [0], [0], [2, 1], [2, 1]], 3)
+    assert instant_runoff(matrix, 3) == 0
+
+
+def test_instant_runoff_rounds():
+    matrix = rank_matrix([[1], [1], [0], [0], [0], [2, 1], [2, 0]], 3)
+    winner, rounds = instant_runoff(matrix, 3, with_rounds=True)
+    assert winner == instant_runoff(matrix, 3) == 0
+    assert rounds == [
+        {
+            "counts": {0: 3, 1: 2, 2: 2},
+            "exhausted": 0,
+            "eliminated": 1,
+            "transfers": {3: 2},
+        },
+        {"counts": {0: 3, 2: 2}, "exhausted": 2, "eliminated": None, "transfers": {}},
+    ]
+
+
+def test_instant_runoff_weighted_patterns():
+    # Each distinct ranking once, weighted by how many voters cast it
+    expanded = rank_matrix([[1], [1], [0], [0], [0], [2, 1], [2, 0]], 3)
+    patterns = rank_matrix([[1], [0], [2, 1], [2, 0]], 3)
+    weights = np.array([2, 3, 1, 1])
+    assert instant_runoff(
+        patterns, 3, with_rounds=True, weights=weights
+    ) == instant_runoff(expanded, 3, with_rounds=True)
+
+
+def test_instant_runoff_without_ballots():
+    assert instant_runoff(rank_matrix([], 3), 3) is None
+
+
+def test_ranked_choice_breaks_ties_by_ballot_order():
+    votes = ballots(
+        [1, 2, 3, 4],
+        [2, 3, 1, 4],
+        [3, 2, 1, 4],
+        [1, 3, 2, 4],
+        [2, 1, 3, 4],
+        [3, 2, 1, 4],
+    )
+    assert ranked_choice(votes, ["1", "2", "3", "4"]) == 2
+
+
+def test_ranked_choice_single_contender():
+    assert ranked_choice(ballots([5, 6], [5, 6]), ["5", "6"]) == 5
+
+
+def test_packed_ballots_round_trip():
+    ordinals = {11: 0, 12: 1, 13: 2}
+    blobs = [
+        encode_ballot({"12": 1, "13": 2, "11": 3}, ordinals),
+        encode_ballot({"13": 1}, ordinals),
+    ]
+    assert all(len(blob) == 6 for blob in blobs)
+
+    ranks = decode_ballots(blobs, 3)
+    assert ranks.tolist() == [[3, 1, 2], [0, 0, 1]]
+    assert ranks_to_rank_matrix(ranks).tolist() == [[1, 2, 0], [2, 3, 3]]
+
+
+@pytest.mark.parametrize("value", [-1, 70_000, 1.5, "1", True])
+def test_encode_ballot_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        encode_ballot({"11": value}, {11: 0})
+
+
+def test_score_voting_totals_and_averages():
+    scores = np.array([[4, 3, 0], [2, 0, 2], [0, 3, 1]], dtype=np.uint16)
+    totals, averages = score_voting(scores, max_score=10)
+    assert totals.tolist() == [6.0, 6.0, 3.0]
+    assert averages.tolist() == [2.0, 2.0, 1.0]
+
+
+def test_score_voting_rejects_out_of_range_scores():
+    with pytest.raises(ValueError):
+        score_voting(np.array([[11, 0]], dtype=np.uint16), max_score=10)
+    with pytest.raises(ValueError):
+        validate_score_ballot({"1": 11})
+
+
+def test_quadratic_voting_sums_square_roots():
+    credits = np.array([[16, 9, 0], [4, 0, 25]], dtype=np.uint16)
+    assert quadratic_voting(credits, credit_budget=29).tolist() == [6.0, 3.0, 5.0]
+    with pytest.raises(ValueError):
+        quadratic_voting(credits, credit_budget=25)
+
+
+def test_weighted_score_and_quadratic_voting():
+    patterns = np.array([[4, 3, 0], [0, 3, 1]], dtype=np.uint16)
+    weights = np.array([2, 1])
+    expanded = np.repeat(patterns, weights, axis=0)
+    totals, averages = score_voting(patterns, max_score=10, weights=weights)
+    expected_totals, expected_averages = score_voting(expanded, max_score=10)
+    assert totals.tolist() == expected_totals.tolist() == [8.0, 9.0, 1.0]
+    assert averages.tolist() == expected_averages.tolist()
+    assert (
+        quadratic_voting(patterns, credit_budget=25, weights=weights).tolist()
+        == quadratic_voting(expanded, credit_budget=25).tolist()
+    )
+
+
+def test_compare_engines_over_one_ballot_set():
+    # Per-candidate ranks: 10 > 20 > 30 four times, 30 > 20 > 10 three times
+    # and 20 > 10 > 30 twice, so 20 beats both others head to head
+    ranks = np.array([[1, 2, 3], [3, 2, 1], [2, 1, 3]], dtype=np.uint16)
+    ballots = Ballots("ranks", [10, 20, 30], ranks, np.array([4, 3, 2]))
+    results = compare(ballots)
+    assert results["plurality"] == TallyResult({10: 4.0, 20: 2.0, 30: 3.0}, 10)
+    assert results["instant_runoff"].winner == 10
+    assert results["borda"] == TallyResult({10: 10.0, 20: 11.0, 30: 6.0}, 20)
+    assert results["copeland"] == TallyResult({10: 1.0, 20: 2.0, 30: 0.0}, 20)
+
+    values = np.array([[3, 1], [0, 2]], dtype=np.uint16)
+    scores = Ballots("scores", [10, 20], values, np.array([1, 2]))
+    assert compare(scores) == {
+        "score": TallyResult({10: 3.0, 20: 5.0}, 20, averages={10: 1.0, 20: 5 / 3})
+    }
+    with pytest.raises(ValueError):
+        compare(scores, ["borda"])
+    with pytest.raises(KeyError):
+        compare(ballots, ["approval"])
+
+
+def test_every_voting_system_has_an_engine():
+    for voting_system, kind in BALLOT_KINDS.items():
+        assert engine_for(voting_system).kind == kind
+    with pytest.raises(ValueError):
+        engine_for("approval")